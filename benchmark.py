@@ -1,70 +1,232 @@
+import asyncio
 from pprint import pprint
-from time import sleep
+from time import sleep, monotonic
 from termcolor import colored
 from numpy import repeat
+from numpy.random import SeedSequence, default_rng
 
 from multicast.core import *
 from multicast.coordinator import *
 from multicast.router import *
 from multicast.worker import *
+from multicast.interest import ExactInterest, CountingBloomInterest
+from multicast.combining import WriteCombiner
+from multicast.cache import KeyCache, cache_policies
+from multicast.placement import LeastLoaded, placement_policies
+from functools import partial
+from inspect import signature
 
 from simulators.network import *
+from simulators.events import simEnable, simEnabled, simReset, simSchedule, simRun, \
+    simNow
+from simulators.links import link_profiles
+from simulators.aio import aioRun, aioIdle
 from util.workloads import *
+from util.traces import Trace
+from util.loadgen import OpenLoop, ClosedLoop, loadReport
 from util.user_args import *
 
-def bench(print_to_console, workload, n_routers, n_workers,
-          max_children, max_routers_root, max_children_root,
-          sharding):
-    assert isinstance(n_routers, int),\
-        f"n_routers must be an integer, but is {n_routers}"
-    assert isinstance(n_workers, int),\
-        f"n_workers must be an integer, but is {n_workers}"
-    assert isinstance(max_children, int),\
-        f"max_children must be an integer, but is {max_children}"
-    assert isinstance(max_children_root, int),\
-        f"max_children_root must be an integer, but is {max_children_root}"
-
-    netReset()
-
+def seedStreams(seed):
+    """
+    Independent SeedSequences for each source of randomness in a simulation
+    seeded with SEED (None: unseeded): (workload, link model, workers, load
+    generator, task placement). Each worker enclave gets its own child of
+    the third.
+    """
+    return tuple(SeedSequence(seed).spawn(5))
+
+
+def buildTree(n_routers, n_workers, max_children, max_routers_root,
+              sharding=True, interest_summary=ExactInterest,
+              service_time=0.0, queue_limit=None, worker_seeds=None,
+              max_in_flight=None, batch_size=1, batch_delay=0.0,
+              write_combiner=None, worker_cache=KeyCache,
+              upward_sharding=False, placement=LeastLoaded,
+              keep_results=True):
+    """
+    Sets up a coordinator, root router, N_ROUTERS further routers and N_WORKERS
+    workers on the (current) network. Workers that don't fit in the router
+    tree are hung off the root. Worker i's enclave draws from the i'th child
+    of WORKER_SEEDS, a SeedSequence (default: unseeded). The coordinator keeps
+    at most MAX_IN_FLIGHT tasks in the tree at once (default: no limit), and
+    dispatches them in batches of BATCH_SIZE, flushed after BATCH_DELAY.
+    Routers and workers combine KeyUpdates if given a WRITE_COMBINER factory
+    (see multicast.combining). Each worker's key cache is made by
+    WORKER_CACHE (see multicast.cache). With UPWARD_SHARDING, routers only
+    pass KeyUpdates up for keys used outside their subtree. PLACEMENT makes
+    each router's task placement policy (see multicast.placement). Without
+    KEEP_RESULTS, the coordinator forgets tasks once they finish.
+    Returns (coordinator, root, routers, workers).
+    """
     #max_children = 4
     #max_children_root = 2
     #n_routers = 9
     #n_workers = 27
 
+    # IP space:
+    #  Driver, Coordinator, and Root Router are on 73.0.0.1
+    #  Routers are on 80.*.*.*
+    #  Workers are on 90.*.*.*
     serv_coord = NetworkHost("73.0.0.1")
     serv_root = serv_coord
 
-    coord = Coordinator(serv_coord, serv_root.ip, "coord")
+    # In discrete-event mode, let each node finish joining before the next
+    # starts, so that link delays can't reorder the joins
+    def settle():
+        if simEnabled():
+            simRun()
+
+    coord = Coordinator(serv_coord, serv_root.ip, "coord", max_in_flight,
+                        batch_size, batch_delay, keep_results)
     root = Router(serv_root, serv_coord.ip, True, max_routers_root,
-                  "root", sharding)
+                  "root", sharding, interest_summary,
+                  service_time, queue_limit, write_combiner, upward_sharding,
+                  placement)
+    settle()
 
     workers = []
     routers = []
-
-    workload_tasks = []
-    task_ids = []
+    worker_rngs = [default_rng(s) for s in
+                   (worker_seeds or SeedSequence()).spawn(n_workers)]
 
     for i in range(n_routers):
-        server = NetworkHost("80.0")
+        server = NetworkHost("80")
         router = Router(server, serv_coord.ip, False, max_children,
-                        "r_" + str(i), sharding)
+                        "r_" + str(i), sharding, interest_summary,
+                        service_time, queue_limit, write_combiner,
+                        upward_sharding, placement)
         routers.append(router)
+        settle()
 
     # Max # of workers that can fit in the tree
     worker_capacity = max_children + (n_routers * (max_children - 1))
 
     # Add as many workers as the router tree can allegedly handle
     for i in range(min(n_workers, worker_capacity)):
-        server = NetworkHost("90.0")
-        worker = Worker(server, serv_coord.ip, "w_" + str(i))
+        server = NetworkHost("90")
+        worker = Worker(server, serv_coord.ip, "w_" + str(i), worker_rngs[i],
+                        write_combiner, worker_cache)
         workers.append(worker)
+        settle()
 
     # Allocate the rest to root :)
     coord.max_children = n_workers # Force root to accept them
     for i in range(worker_capacity, n_workers):
-        server = NetworkHost("90.0")
-        worker = Worker(server, serv_coord.ip, "w_" + str(i))
+        server = NetworkHost("90")
+        worker = Worker(server, serv_coord.ip, "w_" + str(i), worker_rngs[i],
+                        write_combiner, worker_cache)
         workers.append(worker)
+        settle()
+
+    # An 'InterestUpdate' comes down at most one hop per level, asking for
+    # updates that would have climbed as many: so the furthest back one can
+    # look is a round trip of the whole tree's depth (plus a hop, for slack)
+    depths = {root.host.ip: 0}
+    for router in routers:  # Each joined below one already in the tree
+        depths[router.host.ip] = depths[router.parent] + 1
+    max_hop = max([r.host.ping(r.parent)[1] / 2 for r in routers],
+                  default=0.0)
+    for router in [root] + routers:
+        router.interest_horizon = (2 * max(depths.values()) + 1) * max_hop
+
+    return coord, root, routers, workers
+
+
+def bench(print_to_console, workload, n_routers, n_workers,
+          max_children, max_routers_root, max_children_root,
+          sharding, discrete_event=False, interest_summary=ExactInterest,
+          log_packets=True, queued_delivery=False, link_model=None,
+          router_service_time=0.0, router_queue_limit=None,
+          task_interval=0.01, seed=None, asyncio_mode=False, load=None,
+          max_in_flight=None, batch_size=1, batch_delay=0.0,
+          combine_window=None, combine_count=None, worker_cache=KeyCache,
+          upward_sharding=False, placement=LeastLoaded):
+    """
+    Runs WORKLOAD on a freshly built tree and returns the values of
+    bench_metrics. With a SEED, the tree's randomness (worker enclaves and the
+    link model) is drawn from seedStreams(SEED); build WORKLOAD from the same
+    seed's workload stream (see workloadRng) to reproduce a run exactly.
+    Only discrete-event runs are deterministic.
+    With ASYNCIO_MODE the whole run (in wall-clock time) happens on one
+    asyncio event loop: see simulators.aio.
+    If LOAD (see util.loadgen) is given it decides when tasks are submitted,
+    instead of TASK_INTERVAL and the tasks' own arrival times.
+    MAX_IN_FLIGHT bounds the tasks in the tree at once: see
+    Coordinator.submitUserTask. Tasks go down the tree BATCH_SIZE to a packet,
+    a partial batch leaving BATCH_DELAY seconds after it was started.
+    With COMBINE_WINDOW (seconds) and/or COMBINE_COUNT (keys) set, KeyUpdates
+    are write-combined on every link: see multicast.combining.
+    WORKER_CACHE makes each worker's key cache: see multicast.cache.
+    UPWARD_SHARDING stops KeyUpdates climbing past the lowest router whose
+    subtree holds every task using the key: see Router._pushInterest. It
+    needs links with only latency, no ROUTER_SERVICE_TIME and no
+    write-combining, or updates could be lost: see Router._holdBack.
+    PLACEMENT makes each router's placement policy: see multicast.placement.
+    Policies with an RNG share one, drawn from SEED.
+    Tasks are only kept for the metrics once they finish if one of
+    bench_metrics needs them (see task_list_metrics), so a long workload or
+    trace is streamed through rather than held in memory.
+    """
+    # bools are ints too, so a flag passed one position early (e.g. sharding
+    # landing in max_children_root) would otherwise get through
+    def isCount(n): return isinstance(n, int) and not isinstance(n, bool)
+    assert isCount(n_routers),\
+        f"n_routers must be an integer, but is {n_routers}"
+    assert isCount(n_workers),\
+        f"n_workers must be an integer, but is {n_workers}"
+    assert isCount(max_children),\
+        f"max_children must be an integer, but is {max_children}"
+    assert isCount(max_routers_root),\
+        f"max_routers_root must be an integer, but is {max_routers_root}"
+    assert isCount(max_children_root),\
+        f"max_children_root must be an integer, but is {max_children_root}"
+    assert isinstance(sharding, bool),\
+        f"sharding must be a bool, but is {sharding}"
+    assert isinstance(discrete_event, bool),\
+        f"discrete_event must be a bool, but is {discrete_event}"
+
+    _, link_seeds, worker_seeds, load_seeds, placement_seeds = \
+        seedStreams(seed)
+    if link_model and seed is not None:
+        link_model.seed(link_seeds)
+    if load and seed is not None:
+        load.seed(load_seeds)
+    if seed is not None and 'rng' in signature(placement).parameters:
+        placement = partial(placement, rng=default_rng(placement_seeds))
+    assert not (asyncio_mode and discrete_event),\
+        "asyncio mode runs on the wall clock"
+    # Routers catch up on updates they held back assuming each hop takes
+    # just its latency: see Router._holdBack
+    assert not (upward_sharding and (
+        router_service_time > 0
+        or (link_model and link_model.limitsBandwidth())
+        or combine_window is not None or combine_count is not None)),\
+        "Upward sharding can't be combined with router service times, " \
+        "limited link bandwidth or write-combining, which delay updates"
+    assert not (asyncio_mode and load),\
+        "Load generators don't run in asyncio mode"
+    write_combiner = None
+    if combine_window is not None or combine_count is not None:
+        write_combiner = partial(WriteCombiner, combine_window, combine_count)
+    netReset(log_packets, queued_delivery, link_model)
+    simReset()
+    simEnable(discrete_event)
+    keep_tasks = any(m in task_list_metrics for m in bench_metrics or [])
+
+    def build():
+        return buildTree(
+            n_routers, n_workers, max_children, max_routers_root,
+            sharding, interest_summary, router_service_time,
+            router_queue_limit, worker_seeds, max_in_flight,
+            batch_size, batch_delay, write_combiner, worker_cache,
+            upward_sharding, placement, keep_tasks)
+    workload_tasks = []
+
+    def kept(tasks):
+        for task in tasks:
+            if keep_tasks:
+                workload_tasks.append(task)
+            yield task
 
     ## Used to pre-init all dicts to have keys to avoid deadlock
     #empty_keydict = {}
@@ -76,12 +238,54 @@ def bench(print_to_console, workload, n_routers, n_workers,
     #    for child in router.child_task_keys.keys():
     #        router.child_task_keys = dict(empty_keydict)
 
-    for task in workload:
-        workload_tasks.append(task)
-        coord.enqueueUserTask(task)
-        sleep(0.01)
+    # Tasks arrive every TASK_INTERVAL, unless they carry their own arrival
+    # times (e.g. when replayed from a trace: see util.traces)
+    def arrivals():
+        for i, task in enumerate(kept(workload)):
+            yield (i * task_interval if task.arrival is None
+                   else task.arrival), task
+
+    async def runAsync():
+        tree = build()
+        await aioIdle()  # Let every node finish joining
+        start = monotonic()
+        for arrival, task in arrivals():
+            await asyncio.sleep(max(0.0, start + arrival - monotonic()))
+            tree[0].enqueueUserTask(task)
+        await tree[0].joinUserTasksAsync()
+        return tree
+
+    if asyncio_mode:
+        coord, root, routers, workers = aioRun(runAsync)
+    elif load:
+        coord, root, routers, workers = build()
+        load.start(coord, kept(workload))
+        load.wait()
+        coord.joinUserTasks()
+    else:
+        coord, root, routers, workers = build()
+        if discrete_event:
+            # Arrivals are events too, each scheduling the next when it
+            # happens, so only one task at a time is waiting on the event
+            # queue; nothing runs until joinUserTasks
+            upcoming = arrivals()
+            start = simNow()
+
+            def arrive(task=None):
+                if task is not None:
+                    coord.enqueueUserTask(task)
+                arrival, task = next(upcoming, (None, None))
+                if task is not None:
+                    simSchedule(max(0.0, start + arrival - simNow()),
+                                arrive, task)
+            arrive()
+        else:
+            start = monotonic()
+            for arrival, task in arrivals():
+                sleep(max(0.0, start + arrival - monotonic()))
+                coord.enqueueUserTask(task)
 
-    coord.joinUserTasks() # Wait for enclaves to finish execution
+        coord.joinUserTasks() # Wait for enclaves to finish execution
 
     ip_map, packets, failures = getNetworkDebugInfo()
     metrics = []
@@ -95,7 +299,10 @@ def bench(print_to_console, workload, n_routers, n_workers,
                     workload_tasks,
                     ip_map,
                     packets,
-                    failures))
+                    failures,
+                    [root] + routers,
+                    workers))
+    simEnable(False)
 
     return metrics
 
@@ -107,13 +314,16 @@ def bench_nPackets(
         tasks,
         ip_map,
         packet_list,
-        failure_info):
+        failure_info,
+        routers,
+        workers):
     def br(s): return colored(str(s), 'green')
     def res(s): return colored(str(s), 'blue')
 
+    n_packets = getTrafficStats().n_packets
     if console:
-        print(f"{br('[')}Total packets sent: {res(len(packet_list))}{br(']')}")
-    return len(packet_list)
+        print(f"{br('[')}Total packets sent: {res(n_packets)}{br(']')}")
+    return n_packets
 
 
 def bench_nRootPackets(
@@ -123,16 +333,40 @@ def bench_nRootPackets(
         tasks,
         ip_map,
         packet_list,
-        failure_info):
+        failure_info,
+        routers,
+        workers):
     def br(s): return colored(str(s), 'green')
     def res(s): return colored(str(s), 'blue')
 
-    root_ip = root.host.ip
-    ls = [x for x in packet_list if x.src is root_ip or x.dst is root_ip]
+    n_root = getTrafficStats().involving(root.host.ip)
     if console:
         print(
-            f"{br('[')}Total packets handled by root router: {res(len(ls))}{br(']')}")
-    return len(ls)
+            f"{br('[')}Total packets handled by root router: {res(n_root)}{br(']')}")
+    return n_root
+
+def bench_rootPacketsPerTask(
+        console,
+        coord,
+        root,
+        tasks,
+        ip_map,
+        packet_list,
+        failure_info,
+        routers,
+        workers):
+    def br(s): return colored(str(s), 'green')
+    def res(s): return colored(str(s), 'blue')
+
+    # Tasks (batched or not) pass through the root's user-task ports only
+    ports = getTrafficStats().ports
+    n_dispatch = sum(ports.get((root.host.ip, port), 0) for port in
+                     (ROUTER_RECV_USERTASK_PORT, ROUTER_SEND_USERTASK_PORT))
+    per_task = n_dispatch / max(1, len(tasks))
+    if console:
+        print(f"{br('[')}Task packets handled by root router per task: "
+              f"{res(per_task)}{br(']')}")
+    return per_task
 
 def bench_topThroughputPackets(
         percentile: float, # [0, 1]
@@ -142,30 +376,18 @@ def bench_topThroughputPackets(
         tasks,
         ip_map,
         packet_list,
-        failure_info):
+        failure_info,
+        routers,
+        workers):
     #assert percentile <= 1 and percentile >= 0,\
     #       f"Invalid percentile {percentile}"
 
     def br(s): return colored(str(s), 'green')
     def res(s): return colored(str(s), 'blue')
 
-    root_ip = root.host.ip
-
-    ips = {}
-
-    for packet in packet_list:
-        if packet.src in ips:
-            ips[packet.src] += 1
-        else:
-            ips[packet.src] = 1
-        if packet.dst in ips:
-            ips[packet.dst] += 1
-        else:
-            ips[packet.dst] = 1
-
-    # just cause i make routers start with 80, save for the root one
-    throughput_counts = [v for k, v in ips.items() if k.startswith("80")]
-    throughput_counts.append(ips[root_ip])
+    traffic = getTrafficStats()
+    router_ips = {r.host.ip for r in routers}  # Includes the root
+    throughput_counts = [traffic.throughput(ip) for ip in router_ips]
 
     throughput_counts.sort()
     if percentile == -1.0:
@@ -185,6 +407,307 @@ def bench_topThroughputPackets(
     return val_at_percentile
 
 
+def bench_simTime(
+        console,
+        coord,
+        root,
+        tasks,
+        ip_map,
+        packet_list,
+        failure_info,
+        routers,
+        workers):
+    def br(s): return colored(str(s), 'green')
+    def res(s): return colored(str(s), 'blue')
+
+    # Simulated seconds in discrete-event mode, wall-clock seconds otherwise
+    makespan = max(t.finish_time for t in tasks)\
+             - min(t.submit_time for t in tasks)
+    if console:
+        print(f"{br('[')}Time to complete all tasks: {res(makespan)}s{br(']')}")
+    return makespan
+
+
+def bench_meanLatency(
+        console,
+        coord,
+        root,
+        tasks,
+        ip_map,
+        packet_list,
+        failure_info,
+        routers,
+        workers):
+    def br(s): return colored(str(s), 'green')
+    def res(s): return colored(str(s), 'blue')
+
+    latency = sum(t.latency() for t in tasks) / len(tasks)
+    if console:
+        print(f"{br('[')}Mean task latency: {res(latency)}s{br(']')}")
+    return latency
+
+
+def bench_loadReport(
+        stat: str, # One of util.loadgen.loadReport's keys
+        console,
+        coord,
+        root,
+        tasks,
+        ip_map,
+        packet_list,
+        failure_info,
+        routers,
+        workers):
+    def br(s): return colored(str(s), 'green')
+    def res(s): return colored(str(s), 'blue')
+
+    value = loadReport(tasks)[stat]
+    if console:
+        units = "tasks/s" if stat in ('offered_load', 'throughput') else "s"
+        print(f"{br('[')}{stat}: {res(value)}{units}{br(']')}")
+    return value
+
+
+def bench_mcastReachTime(
+        percentile: float, # [0, 1], or None for the mean
+        console,
+        coord,
+        root,
+        tasks,
+        ip_map,
+        packet_list,
+        failure_info,
+        routers,
+        workers):
+    def br(s): return colored(str(s), 'green')
+    def res(s): return colored(str(s), 'blue')
+
+    # An update has reached everyone once it arrives at its last subscriber
+    reach_times = {}
+    for w in workers:
+        for update_id, (sent, arrived) in w.key_update_arrivals.items():
+            reach_times[update_id] = max(reach_times.get(update_id, 0),
+                                         arrived - sent)
+    reach_times = sorted(reach_times.values())
+
+    if not reach_times:
+        val = 0
+    elif percentile is None:
+        val = sum(reach_times) / len(reach_times)
+    else:
+        val = reach_times[min(int(len(reach_times) * percentile),
+                              len(reach_times) - 1)]
+
+    if console:
+        desc = "Mean" if percentile is None else f"{percentile*100}-percentile"
+        print(f"{br('[')}{desc} time for a KeyUpdate to reach all subscribers: "
+              f"{res(val)}s{br(']')}")
+    return val
+
+
+def bench_combining(
+        stat: str, # 'saved' or 'delay'
+        console,
+        coord,
+        root,
+        tasks,
+        ip_map,
+        packet_list,
+        failure_info,
+        routers,
+        workers):
+    def br(s): return colored(str(s), 'green')
+    def res(s): return colored(str(s), 'blue')
+
+    combiners = [w.combiner for w in workers if w.combiner]
+    for r in [root] + routers:
+        combiners += r.combiners.values()
+    if stat == 'saved':
+        val = sum(c.nSaved() for c in combiners)
+        if console:
+            merged = sum(c.n_merged for c in combiners)
+            print(f"{br('[')}KeyUpdate packets saved by write-combining: "
+                  f"{res(val)} ({res(merged)} updates superseded){br(']')}")
+    else:
+        n_sent = sum(c.n_updates - c.n_merged for c in combiners)
+        val = sum(c.total_delay for c in combiners) / max(1, n_sent)
+        if console:
+            print(f"{br('[')}Mean delay added per hop by write-combining: "
+                  f"{res(val)}s{br(']')}")
+    return val
+
+
+def bench_cache(
+        stat: str, # 'hit_rate', 'invalidations' or 'evictions'
+        console,
+        coord,
+        root,
+        tasks,
+        ip_map,
+        packet_list,
+        failure_info,
+        routers,
+        workers):
+    def br(s): return colored(str(s), 'green')
+    def res(s): return colored(str(s), 'blue')
+
+    caches = [w.cache for w in workers]
+    if stat == 'hit_rate':
+        hits = sum(c.n_hits for c in caches)
+        accesses = hits + sum(c.n_misses for c in caches)
+        val = hits / accesses if accesses else 0.0
+        desc = "Worker cache hit rate"
+    else:
+        val = sum(getattr(c, 'n_' + stat) for c in caches)
+        desc = f"Worker cache {stat}"
+    if console:
+        print(f"{br('[')}{desc}: {res(val)}{br(']')}")
+    return val
+
+
+def bench_msgType(
+        msg_type, # A message type, or a tuple of them to count together
+        console,
+        coord,
+        root,
+        tasks,
+        ip_map,
+        packet_list,
+        failure_info,
+        routers,
+        workers):
+    def br(s): return colored(str(s), 'green')
+    def res(s): return colored(str(s), 'blue')
+
+    types = (msg_type,) if isinstance(msg_type, str) else msg_type
+    n = sum(getTrafficStats().msg_types.get(t, 0) for t in types)
+    if console:
+        print(f"{br('[')}{'/'.join(types)} packets sent: {res(n)}{br(']')}")
+    return n
+
+
+def bench_loadImbalance(
+        console,
+        coord,
+        root,
+        tasks,
+        ip_map,
+        packet_list,
+        failure_info,
+        routers,
+        workers):
+    def br(s): return colored(str(s), 'green')
+    def res(s): return colored(str(s), 'blue')
+
+    # Busiest worker's share of the tasks relative to an even split: 1 is
+    # perfectly balanced
+    n_run = [w.n_tasks_run for w in workers]
+    mean = sum(n_run) / len(n_run) if n_run else 0
+    val = max(n_run) / mean if mean else 0.0
+    if console:
+        print(f"{br('[')}Load imbalance (max/mean tasks per worker): "
+              f"{res(val)}{br(']')}")
+    return val
+
+
+def bench_routerLoad(
+        stat: str,
+        console,
+        coord,
+        root,
+        tasks,
+        ip_map,
+        packet_list,
+        failure_info,
+        routers,
+        workers):
+    """
+    Reports on the routers' input queues (see Router.service_time). STAT is
+    one of 'utilisation' (fraction of the run each router spent busy, by
+    router), 'max_utilisation', 'mean_wait', 'max_queue_depth' or 'drops'.
+    """
+    def br(s): return colored(str(s), 'green')
+    def res(s): return colored(str(s), 'blue')
+
+    if stat in ('utilisation', 'max_utilisation'):
+        start = min(t.submit_time for t in tasks)
+        end = max(t.finish_time for t in tasks)
+        utilisation = {r.name: r.busy_time / (end - start) for r in routers}
+        if stat == 'max_utilisation':
+            val = max(utilisation.values())
+        else:
+            val = utilisation
+    elif stat == 'mean_wait':
+        n_served = sum(r.n_served for r in routers)
+        val = sum(r.total_wait for r in routers) / n_served if n_served else 0
+    elif stat == 'max_queue_depth':
+        val = max(r.max_queue_depth for r in routers)
+    elif stat == 'drops':
+        val = sum(r.n_dropped for r in routers)
+    else:
+        assert False, f"Unknown router load stat {stat}"
+
+    if console and stat == 'utilisation':
+        print(f"{br('[')}Router utilisation:")
+        for name, u in sorted(val.items(), key=lambda kv: -kv[1]):
+            print(f"  {name}: {res(f'{u:.1%}')}")
+        print(br(']'))
+    elif console:
+        print(f"{br('[')}Router {stat.replace('_', ' ')}: {res(val)}{br(']')}")
+    return val
+
+
+def bench_falsePositivePackets(
+        console,
+        coord,
+        root,
+        tasks,
+        ip_map,
+        packet_list,
+        failure_info,
+        routers,
+        workers):
+    def br(s): return colored(str(s), 'green')
+    def res(s): return colored(str(s), 'blue')
+
+    # Only audited summaries (see multicast.interest) can count these
+    n_extra = sum(r.n_false_positive_mcasts for r in routers)
+    if console:
+        print(f"{br('[')}Extra mcast packets from false positives: "
+              f"{res(n_extra)}{br(']')}")
+    return n_extra
+
+
+def bench_summaryBytes(
+        saved: bool,
+        console,
+        coord,
+        root,
+        tasks,
+        ip_map,
+        packet_list,
+        failure_info,
+        routers,
+        workers):
+    def br(s): return colored(str(s), 'green')
+    def res(s): return colored(str(s), 'blue')
+
+    # Peaks: by now every task is done, and exact summaries have emptied
+    n_bytes = 0
+    for r in routers:
+        summary = r.child_task_keys
+        if not saved:
+            n_bytes += summary.peak_nbytes
+        elif summary.audit:
+            n_bytes += summary.audit.peak_nbytes - summary.peak_nbytes
+
+    if console:
+        desc = "saved vs. exact" if saved else "used"
+        print(f"{br('[')}Router interest summary peak bytes {desc}: "
+              f"{res(n_bytes)}{br(']')}")
+    return n_bytes
+
+
 def bench_showTree(
         console,
         coord,
@@ -192,7 +715,9 @@ def bench_showTree(
         tasks,
         ip_map,
         packet_list,
-        failure_info):
+        failure_info,
+        routers,
+        workers):
     tree = coord.root.prettyString()
     if console:
         print("======== Mcast Tree ========")
@@ -207,7 +732,9 @@ def bench_dumpTasks(
         tasks,
         ip_map,
         packet_list,
-        failure_info):
+        failure_info,
+        routers,
+        workers):
     if console:
         print("======= Task Results =======")
         pprint(tasks)
@@ -223,16 +750,21 @@ def bench_dumpPackets(
         tasks,
         ip_map,
         packet_list,
-        failure_info):
-    if console:
+        failure_info,
+        routers,
+        workers):
+    if console and packet_list is None:
+        print("Packet logging was disabled for this run")
+    elif console:
         print("======= Sent Packets =======")
-        pprint(packet_list)
+        pprint(list(packet_list))
     return packet_list
 
 
 benchmark_stats = {
     'n_packets': bench_nPackets,
     'n_packets_root': bench_nRootPackets,
+    'root_packets_per_task': bench_rootPacketsPerTask,
     'top_half_packets':\
         lambda *args, **kw: bench_topThroughputPackets(0.5, *args, *kw),
     'top_quartile_packets':\
@@ -245,27 +777,152 @@ benchmark_stats = {
         lambda *args, **kw: bench_topThroughputPackets(0.99, *args, *kw),
     'maximum_packets':\
         lambda *args, **kw: bench_topThroughputPackets(1.00, *args, *kw),
+    'sim_time': bench_simTime,
+    'mean_latency': bench_meanLatency,
+    'offered_load':\
+        lambda *args, **kw: bench_loadReport('offered_load', *args, *kw),
+    'throughput':\
+        lambda *args, **kw: bench_loadReport('throughput', *args, *kw),
+    'p50_latency':\
+        lambda *args, **kw: bench_loadReport('p50_latency', *args, *kw),
+    'p99_latency':\
+        lambda *args, **kw: bench_loadReport('p99_latency', *args, *kw),
+    'mcast_packets_saved':\
+        lambda *args, **kw: bench_combining('saved', *args, *kw),
+    'combining_delay':\
+        lambda *args, **kw: bench_combining('delay', *args, *kw),
+    'cache_hit_rate':\
+        lambda *args, **kw: bench_cache('hit_rate', *args, *kw),
+    'cache_invalidations':\
+        lambda *args, **kw: bench_cache('invalidations', *args, *kw),
+    'cache_evictions':\
+        lambda *args, **kw: bench_cache('evictions', *args, *kw),
+    'n_interest_packets':\
+        lambda *args, **kw: bench_msgType('InterestUpdate', *args, *kw),
+    'n_mcast_packets':\
+        lambda *args, **kw: bench_msgType(('KeyUpdate', 'KeyUpdateBatch'),
+                                          *args, *kw),
+    'load_imbalance': bench_loadImbalance,
+    'mean_mcast_reach_time':\
+        lambda *args, **kw: bench_mcastReachTime(None, *args, *kw),
+    'p99_mcast_reach_time':\
+        lambda *args, **kw: bench_mcastReachTime(0.99, *args, *kw),
+    'max_mcast_reach_time':\
+        lambda *args, **kw: bench_mcastReachTime(1.00, *args, *kw),
+    'router_utilisation':\
+        lambda *args, **kw: bench_routerLoad('utilisation', *args, *kw),
+    'max_router_utilisation':\
+        lambda *args, **kw: bench_routerLoad('max_utilisation', *args, *kw),
+    'router_queue_wait':\
+        lambda *args, **kw: bench_routerLoad('mean_wait', *args, *kw),
+    'router_queue_depth':\
+        lambda *args, **kw: bench_routerLoad('max_queue_depth', *args, *kw),
+    'router_drops':\
+        lambda *args, **kw: bench_routerLoad('drops', *args, *kw),
+    'n_false_positive_packets': bench_falsePositivePackets,
+    'summary_bytes':\
+        lambda *args, **kw: bench_summaryBytes(False, *args, *kw),
+    'summary_bytes_saved':\
+        lambda *args, **kw: bench_summaryBytes(True, *args, *kw),
     'print_tree': bench_showTree,
     'dump_tasks': bench_dumpTasks,
     'dump_packets': bench_dumpPackets}
 
+# The metrics above that read the list of tasks run: bench() only keeps it
+# (and the coordinator only keeps finished tasks) for these
+task_list_metrics = {
+    'root_packets_per_task', 'sim_time', 'mean_latency', 'offered_load',
+    'throughput', 'p50_latency', 'p99_latency', 'router_utilisation',
+    'max_router_utilisation', 'dump_tasks'}
+
+def workloadRng(seed):
+    """ The Generator a workload should draw from in a run seeded with SEED. """
+    return default_rng(seedStreams(seed)[0])
+
+
 workloads = {
     'fruits_of_my_labor': fruitsOfMyLabor, 'posterboard': posterboard,
-    'monic': monic, '2x10': lambda n, t: working_sets(n, t, 2, 10),
-    '4x5': lambda n, t: working_sets(n, t, 4, 5),
-    '1x20': lambda n, t: working_sets(n, t, 1, 20)
+    'monic': monic,
+    '2x10': lambda n, t, rng=None: working_sets(n, t, 2, 10, rng),
+    '4x5': lambda n, t, rng=None: working_sets(n, t, 4, 5, rng),
+    '1x20': lambda n, t, rng=None: working_sets(n, t, 1, 20, rng),
+    # Skewed popularity; these also take the options in workloadOptions
+    'zipf': zipf, 'hot_set': hot_set, 'drifting': drifting
 }
 
+
+def workloadOptions(args):
+    """
+    Keyword arguments from the CLI ARGS for the chosen workload: only those
+    the user actually set, each of which it must take.
+    """
+    dests = {'n_keys': 'n_keys', 'exponent': 'zipf_exponent',
+             'hot_keys': 'hot_keys', 'hot_fraction': 'hot_fraction',
+             'n_phases': 'n_phases'}  # Keyword => CLI option
+    options = {k: getattr(args, dest) for k, dest in dests.items()
+               if getattr(args, dest) is not None}
+    accepted = signature(workloads[args.workload]).parameters
+    unaccepted = ['--' + dests[k] for k in options if k not in accepted]
+    assert not unaccepted,\
+        f"Workload {args.workload} doesn't take {', '.join(unaccepted)}"
+    return options
+
 bench_metrics = []
 
 if __name__ == "__main__":
     args = parseUserArgs()
     bench_metrics = args.metrics
+    interest_summary = ExactInterest
+    if args.bloom_counters:
+        # Audited, so that false positives can be reported
+        interest_summary = partial(CountingBloomInterest, args.bloom_counters,
+                                   args.bloom_hashes, True)
+    link_model = None
+    if args.link_profile:
+        link_model = link_profiles[args.link_profile](args.link_latency,
+                                                      args.link_bandwidth)
+    if args.trace:
+        workload = Trace(args.trace).tasks()
+    else:
+        workload = workloads[args.workload](args.n_workers * 2, 5,
+                                            rng=workloadRng(args.seed),
+                                            **workloadOptions(args))()
+    worker_cache = KeyCache
+    if args.cache_policy != 'unbounded':
+        assert args.cache_capacity, "Bounded caches need a --cache_capacity"
+        worker_cache = partial(cache_policies[args.cache_policy],
+                               args.cache_capacity)
+    placement = placement_policies[args.placement]
+    if args.placement == 'affinity':
+        placement = partial(placement, args.affinity_weight)
+    load = None
+    if args.arrival_rate:
+        load = OpenLoop(args.arrival_rate, args.poisson)
+    elif args.n_clients:
+        load = ClosedLoop(args.n_clients, args.think_time)
     bench(True,  # Print to console
-          workloads[args.workload](args.n_workers * 2, 5)(),
+          workload,
           args.n_routers,
           args.n_workers,
           args.max_children,
           args.max_children_root,
           args.max_children_root,
-          args.sharding)
+          args.sharding,
+          args.discrete_event,
+          interest_summary,
+          args.log_packets,
+          args.queued_delivery,
+          link_model,
+          args.service_time,
+          args.queue_limit,
+          seed=args.seed,
+          asyncio_mode=args.asyncio_mode,
+          load=load,
+          max_in_flight=args.max_in_flight,
+          batch_size=args.batch_size,
+          batch_delay=args.batch_delay,
+          combine_window=args.combine_window,
+          combine_count=args.combine_count,
+          worker_cache=worker_cache,
+          upward_sharding=args.upward_sharding,
+          placement=placement)
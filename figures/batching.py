@@ -0,0 +1,52 @@
+import matplotlib.pyplot as plt
+from functools import partial
+from benchmark import *
+from util.loadgen import OpenLoop
+from util.result_cache import ResultCache
+from util.sweep import sweep, sweepStats
+
+
+bench_metrics.extend(["root_packets_per_task", "mean_latency"])
+n_trials = 3
+n_tasks = 400
+rate = 400 # Tasks/sec arriving at the coordinator
+batch_delay = 0.05 # Seconds a partial batch may wait
+batch_sizes = [1, 2, 4, 8, 16, 32]
+b = 4 # Branching factor of routers in the tree
+
+
+def sweep_points():
+    return [dict(workload=partial(working_sets, n_tasks, 0.5, 4, 16),
+                 n_routers=b + b * b,
+                 n_workers=b ** 3,
+                 max_children=b,
+                 max_routers_root=b,
+                 max_children_root=b,
+                 sharding=True,
+                 discrete_event=True,
+                 log_packets=False,
+                 load=OpenLoop(rate),
+                 batch_size=size,
+                 batch_delay=batch_delay)
+            for size in batch_sizes]
+
+
+if __name__ == '__main__':
+    # Fewer, larger dispatch packets at the root, for a little extra latency
+    results = sweep(sweep_points(), n_trials, bench_metrics,
+                    cache=ResultCache())
+    [(per_task, per_task_err), (latency, latency_err)] = sweepStats(results)
+
+    fig, ax = plt.subplots()
+    ax.set_title(f"Batched dispatch at {rate} tasks/s")
+    ax.errorbar(batch_sizes, per_task, per_task_err, fmt='D--g')
+    ax.set_xscale('log', base=2)
+    ax.set_xlabel("Batch size (tasks)")
+    ax.set_ylabel("Task packets through the root, per task", color='g')
+    latency_ax = ax.twinx()
+    latency_ax.errorbar(batch_sizes, [1000 * l for l in latency],
+                        [1000 * e for e in latency_err], fmt='o:b')
+    latency_ax.set_ylabel("Mean task latency (ms)", color='b')
+
+    plt.savefig("batching.png", format="png")
+    plt.show()
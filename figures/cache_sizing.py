@@ -0,0 +1,56 @@
+import matplotlib.pyplot as plt
+from functools import partial
+from benchmark import *
+from multicast.cache import cache_policies
+from util.result_cache import ResultCache
+from util.sweep import sweep, sweepStats
+
+
+bench_metrics.extend(["cache_hit_rate"])
+n_trials = 3
+n_tasks = 2000
+n_keys = 4096
+capacities = [8, 16, 32, 64, 128, 256, 512] # Keys per worker
+policies = ['lru', 'lfu', 'arc']
+workloads = {
+    'zipf': partial(zipf, n_tasks, 1, n_keys),
+    'hot_set': partial(hot_set, n_tasks, 1, n_keys),
+    'drifting': partial(drifting, n_tasks, 1, n_keys),
+    'working_sets': partial(working_sets, n_tasks, 1, 16, n_keys // 16),
+}
+b = 4 # Branching factor of routers in the tree
+
+
+def sweep_points(workload, policy):
+    return [dict(workload=workloads[workload],
+                 n_routers=b,
+                 n_workers=b * b,
+                 max_children=b,
+                 max_routers_root=b,
+                 max_children_root=b,
+                 sharding=True,
+                 discrete_event=True,
+                 log_packets=False,
+                 worker_cache=partial(cache_policies[policy], capacity))
+            for capacity in capacities]
+
+
+if __name__ == '__main__':
+    # How much memory each worker needs for a given hit rate
+    fig, axes = plt.subplots(1, len(workloads), figsize=(16, 4),
+                             sharey=True)
+    for ax, workload in zip(axes, workloads):
+        for policy, fmt in zip(policies, ['D--g', 'o--b', 's--r']):
+            results = sweep(sweep_points(workload, policy), n_trials,
+                            bench_metrics, cache=ResultCache())
+            [(hit_rate, err)] = sweepStats(results)
+            ax.errorbar(capacities, hit_rate, err, fmt=fmt,
+                        label=policy.upper())
+        ax.set_title(workload)
+        ax.set_xscale('log', base=2)
+        ax.set_xlabel("Cache capacity (keys per worker)")
+        ax.legend()
+    axes[0].set_ylabel("Hit rate")
+
+    plt.savefig("cache_sizing.png", format="png")
+    plt.show()
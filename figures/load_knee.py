@@ -0,0 +1,55 @@
+import matplotlib.pyplot as plt
+from functools import partial
+from benchmark import *
+from util.loadgen import OpenLoop
+from util.result_cache import ResultCache
+from util.sweep import sweep, sweepStats
+
+
+bench_metrics.extend(["offered_load", "throughput", "p99_latency"])
+n_trials = 3
+n_tasks = 400
+rates = [25, 50, 100, 200, 400, 800, 1600] # Target arrival rates, tasks/sec
+# (n_routers, n_workers, branching factor) for each tree
+shapes = [(0, 8, 8), (4, 16, 4), (12, 32, 4)]
+
+
+def sweep_points(shape):
+    n_routers, n_workers, b = shape
+    return [dict(workload=partial(working_sets, n_tasks, 0.5, 4, 16),
+                 n_routers=n_routers,
+                 n_workers=n_workers,
+                 max_children=b,
+                 max_routers_root=b,
+                 max_children_root=b,
+                 sharding=True,
+                 discrete_event=True,
+                 log_packets=False,
+                 load=OpenLoop(rate))
+            for rate in rates]
+
+
+if __name__ == '__main__':
+    # Throughput and tail latency as the offered load climbs past what each
+    # tree can sustain: the knee is where latency takes off
+    fig, (tput_ax, lat_ax) = plt.subplots(1, 2, figsize=(12, 5))
+    for shape, fmt in zip(shapes, ['D--g', 'o--b', 's--r']):
+        results = sweep(sweep_points(shape), n_trials, bench_metrics,
+                        cache=ResultCache())
+        [(offered, _), (throughput, _), (p99, _)] = sweepStats(results)
+        label = f"{shape[0]} routers, {shape[1]} workers"
+        tput_ax.plot(offered, throughput, fmt, label=label)
+        lat_ax.plot(offered, [1000 * p for p in p99], fmt, label=label)
+
+    tput_ax.plot(rates, rates, ':k', label="Ideal")
+    for ax in (tput_ax, lat_ax):
+        ax.set_xscale('log')
+        ax.set_xlabel("Offered load (tasks/s)")
+        ax.legend()
+    tput_ax.set_yscale('log')
+    tput_ax.set_ylabel("Throughput (tasks/s)")
+    lat_ax.set_ylabel("p99 task latency (ms)")
+    fig.suptitle("Open-loop load vs. tree size")
+
+    plt.savefig("load_knee.png", format="png")
+    plt.show()
@@ -0,0 +1,60 @@
+import matplotlib.pyplot as plt
+from functools import partial
+from benchmark import *
+from simulators.links import UniformLinks
+from util.result_cache import ResultCache
+from util.sweep import sweep, sweepStats
+
+
+bench_metrics.extend(["mean_mcast_reach_time", "max_mcast_reach_time"])
+n_trials = 4
+b = 3 # Branching factor of routers in the tree
+max_tree_height = 5 # Does not include worker nodes
+latency = 0.0005 # Seconds per hop
+bandwidth = 1.25e8 # Bytes per second (1 Gbit/s)
+
+heights = range(1, max_tree_height)
+
+
+def sweep_points():
+    points = []
+    for h in heights:
+        # Create a balanced tree of *internal* height h:
+        # i.e. not including the root node or workers
+        n_workers = b ** (h + 1)
+        n_routers = sum([b ** (i + 1) for i in range(0, h)])
+        points.append(dict(workload=partial(monic, n_workers * 2, 0.05),
+                           n_routers=n_routers,
+                           n_workers=n_workers,
+                           max_children=b,
+                           max_routers_root=b,
+                           max_children_root=b,
+                           sharding=True,
+                           discrete_event=True,
+                           log_packets=False,
+                           link_model=UniformLinks(latency, bandwidth)))
+    return points
+
+
+if __name__ == '__main__':
+    # Mean/max time taken for a KeyUpdate to reach all of its subscribers
+    results = sweep(sweep_points(), n_trials, bench_metrics,
+                    cache=ResultCache())
+    [(mean_reach, _), (max_reach, _)] = sweepStats(results)
+
+    x = heights
+    # Reported in milliseconds
+    mean_means = [1000 * m for m in mean_reach]
+    max_means = [1000 * m for m in max_reach]
+
+    plt.figure()
+    ax = plt.axes()
+    plt.title(f"KeyUpdate delivery time vs. tree height ({latency*1000}ms/hop)")
+    plt.plot(x, mean_means, 'D--g', label="Mean")
+    plt.plot(x, max_means, 'D--r', label="Worst case")
+    ax.set_xlabel("Tree height (routers)")
+    ax.set_ylabel("Time to reach all subscribers (ms)")
+    ax.legend()
+
+    plt.savefig("mcast_latency.png", format="png")
+    plt.show()
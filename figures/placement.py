@@ -0,0 +1,71 @@
+import matplotlib.pyplot as plt
+import numpy as np
+from functools import partial
+from benchmark import *
+from multicast.placement import LeastLoaded, KeyAffinity, PowerOfTwoChoices
+from util.loadgen import OpenLoop
+from util.result_cache import ResultCache
+from util.sweep import sweep, sweepStats
+
+
+bench_metrics.extend(["n_mcast_packets", "load_imbalance"])
+n_trials = 3
+n_tasks = 1000
+rate = 400 # Tasks/sec, enough to keep most workers busy
+b = 4 # Branching factor of routers in the tree
+policies = {
+    'least loaded': LeastLoaded,
+    'affinity (w=0.5)': partial(KeyAffinity, 0.5),
+    'affinity (w=2)': partial(KeyAffinity, 2.0),
+    'p2c': PowerOfTwoChoices,
+}
+workloads = {
+    'working_sets': partial(working_sets, n_tasks, 1, 16, 8),
+    'hot_set': partial(hot_set, n_tasks, 1, 4096, 64),
+    'zipf': partial(zipf, n_tasks, 1, 4096),
+}
+
+
+def sweep_points(workload):
+    return [dict(workload=workloads[workload],
+                 n_routers=b + b * b,
+                 n_workers=b ** 3,
+                 max_children=b,
+                 max_routers_root=b,
+                 max_children_root=b,
+                 sharding=True,
+                 discrete_event=True,
+                 log_packets=False,
+                 load=OpenLoop(rate),
+                 placement=placement)
+            for placement in policies.values()]
+
+
+if __name__ == '__main__':
+    # Placing tasks by key affinity trades load balance for narrower
+    # multicasts
+    fig, (mcast_ax, balance_ax) = plt.subplots(1, 2, figsize=(12, 5))
+    width = 0.8 / len(policies)
+    x = np.arange(len(workloads))
+    for i, workload in enumerate(workloads):
+        results = sweep(sweep_points(workload), n_trials, bench_metrics,
+                        cache=ResultCache())
+        [(mcasts, mcast_err), (imbalance, imbalance_err)] = \
+            sweepStats(results)
+        for j, policy in enumerate(policies):
+            label = policy if i == 0 else None
+            color = f"C{j}"
+            mcast_ax.bar(x[i] + j * width, mcasts[j], width,
+                         yerr=mcast_err[j], color=color, label=label)
+            balance_ax.bar(x[i] + j * width, imbalance[j], width,
+                           yerr=imbalance_err[j], color=color, label=label)
+
+    for ax in (mcast_ax, balance_ax):
+        ax.set_xticks(x + 0.4 - width / 2, list(workloads))
+        ax.legend()
+    mcast_ax.set_ylabel("Multicast packets")
+    balance_ax.set_ylabel("Load imbalance (max/mean tasks per worker)")
+    fig.suptitle("Task placement policies")
+
+    plt.savefig("placement.png", format="png")
+    plt.show()
@@ -0,0 +1,66 @@
+import matplotlib.pyplot as plt
+from functools import partial
+from benchmark import *
+from util.result_cache import ResultCache
+from util.sweep import sweep, sweepStats
+
+
+bench_metrics.extend(["max_router_utilisation", "router_queue_wait"])
+n_trials = 4
+b = 3 # Branching factor of the deep tree
+h = 3 # Internal height of the deep tree
+service_time = 0.0002 # Seconds of router CPU per packet
+# Offered load, in tasks per (simulated) second
+arrival_rates = [10, 25, 50, 100, 200, 400, 800]
+
+n_workers = b ** (h + 1)
+n_routers = sum([b ** (i + 1) for i in range(0, h)])
+
+
+def sweep_point(rate, flat):
+    if flat:
+        # Every worker hangs directly off the root
+        config = dict(n_routers=0, max_children=n_workers,
+                      max_routers_root=n_workers, max_children_root=n_workers,
+                      sharding=False)
+    else:
+        config = dict(n_routers=n_routers, max_children=b, max_routers_root=b,
+                      max_children_root=b, sharding=True)
+    return dict(config,
+                workload=partial(working_sets, n_workers * 4, 1, 4, 5),
+                n_workers=n_workers,
+                discrete_event=True,
+                log_packets=False,
+                router_service_time=service_time,
+                task_interval=1 / rate)
+
+
+if __name__ == '__main__':
+    points = [sweep_point(rate, flat)
+              for flat in (True, False) for rate in arrival_rates]
+    [(util_means, _), (wait_means, _)] = sweepStats(
+        sweep(points, n_trials, bench_metrics, cache=ResultCache()))
+    wait_means = [1000 * w for w in wait_means]
+    n_rates = len(arrival_rates)
+    results = {True: (util_means[:n_rates], wait_means[:n_rates]),
+               False: (util_means[n_rates:], wait_means[n_rates:])}
+
+    fig, (ax_util, ax_wait) = plt.subplots(nrows=1, ncols=2, sharex=True)
+    fig.suptitle("Busiest router vs. offered load")
+
+    ax_util.set_title("Utilisation")
+    ax_util.plot(arrival_rates, results[True][0], 'D--r', label="Flat")
+    ax_util.plot(arrival_rates, results[False][0], 'D--g',
+                 label=f"Sharded tree, height {h}")
+    ax_util.set_xscale('log')
+    ax_util.set_xlabel("Tasks / second")
+    ax_util.legend()
+
+    ax_wait.set_title("Mean queueing delay (ms)")
+    ax_wait.plot(arrival_rates, results[True][1], 'D--r', label="Flat")
+    ax_wait.plot(arrival_rates, results[False][1], 'D--g',
+                 label=f"Sharded tree, height {h}")
+    ax_wait.set_yscale('log')
+
+    plt.savefig("root_saturation.png", format="png")
+    plt.show()
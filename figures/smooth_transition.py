@@ -1,16 +1,12 @@
 import matplotlib.pyplot as plt
-import multiprocessing as mp
-import statistics
-import pickle
+from functools import partial
 from itertools import chain
 from benchmark import *
 from simulators.network import *
+from util.result_cache import ResultCache
+from util.sweep import sweep, sweepStats
 
 
-# I guess these have to be global to be accessible to the processes?
-tree_trials_L = []
-tree_scores_D = {}
-
 max_tree_height = 3
 n_trials = 8
 b_f = 4
@@ -27,7 +23,8 @@ bench_metrics.extend([
     "top_decile_packets",
     "top_5pct_packets"])
 
-def trial_fn(b, scores):
+def sweep_points(b):
+    points = []
     for n in iv_range:
         # First fix the number of nodes we're allocating to work as routers
         n_routers = n
@@ -40,118 +37,42 @@ def trial_fn(b, scores):
                            - n_routers)      # Total util. by non-root routers
         leftover_workers = max(0, -leftover_workers) # Sign correct & clip
 
-        workload = working_sets(total_nodes, 0.01, 4, 8)#posterboard(total_nodes, 0.1)
-        score = bench(False,
-                      workload(),
-                      n_routers,
-                      n_workers,
-                      b,
-                      b,
-                      b + leftover_workers, # Give root room to handle extras
-                      True)
-
-        scores[n][0].append(score[0])
-        scores[n][1].append(score[1])
-        scores[n][2].append(score[2])
-        scores[n][3].append(score[3])
-        #print(f"===============");
-        #print(f"===== {n} =====");
-        #print(f"===============");
-        #ip_map, packets, failures = getNetworkDebugInfo()
-        #pprint(packets)
-        #pprint(failures)
-        #print(f"=== failure ===");
-        #print(score[4])
-
-def calc_and_show_fig():
-    mp.set_start_method('spawn')
-
-    # Dictionaries mapping node counts to lists containing the sum of packets touched
-    # by the root router for each trial
-    # {int} -> [int]
-    percentile_50_scores = {}
-    percentile_75_scores = {}
-    percentile_90_scores = {}
-    percentile_95_scores = {}
-
-    # Means and standard deviation of the score lists for each trial
-    percentile_50_means  = []
-    percentile_50_stdevs = []
-    percentile_75_means  = []
-    percentile_75_stdevs = []
-    percentile_90_means  = []
-    percentile_90_stdevs = []
-    percentile_95_means  = []
-    percentile_95_stdevs = []
-
-    with mp.Manager() as manager:
-        tree_scores_D = manager.dict()
-        for n in iv_range:
-            tree_scores_D[n] = manager.list([manager.list(),
-                                             manager.list(),
-                                             manager.list(),
-                                             manager.list()])
-
-        # Run N_TRIALS simulations to smooth out randomness
-        processes = []
-        for t in range(n_trials):
-            p = mp.Process(target=trial_fn, args=(3,tree_scores_D,))
-            p.start()
-            processes.append(p)
-        for p in processes:
-            p.join()
-
-        # Convert IPC structures into useable lists/dicts
-        tree_scores_D = dict(tree_scores_D)
-        for n in iv_range:
-            tree_scores_D[n] = list(tree_scores_D[n])
-            tree_scores_D[n][0] = list(tree_scores_D[n][0])
-            tree_scores_D[n][1] = list(tree_scores_D[n][1])
-            tree_scores_D[n][2] = list(tree_scores_D[n][2])
-            tree_scores_D[n][3] = list(tree_scores_D[n][3])
-
-        # Transpose data and calculate statistics from it
-        for n in iv_range:
-            percentile_50_scores[n] = []
-            percentile_75_scores[n] = []
-            percentile_90_scores[n] = []
-            percentile_95_scores[n] = []
-            for t in range(n_trials):
-                for i in range(4):
-                    percentile_50_scores[n].append(tree_scores_D[n][0][t])
-                    percentile_75_scores[n].append(tree_scores_D[n][1][t])
-                    percentile_90_scores[n].append(tree_scores_D[n][2][t])
-                    percentile_95_scores[n].append(tree_scores_D[n][3][t])
-            percentile_50_means.append(statistics.mean(percentile_50_scores[n]))
-            percentile_50_stdevs.append(statistics.stdev(percentile_50_scores[n]))
-            percentile_75_means.append(statistics.mean(percentile_75_scores[n]))
-            percentile_75_stdevs.append(statistics.stdev(percentile_75_scores[n]))
-            percentile_90_means.append(statistics.mean(percentile_90_scores[n]))
-            percentile_90_stdevs.append(statistics.stdev(percentile_90_scores[n]))
-            percentile_95_means.append(statistics.mean(percentile_95_scores[n]))
-            percentile_95_stdevs.append(statistics.stdev(percentile_95_scores[n]))
+        points.append(dict(
+            workload=partial(working_sets, total_nodes, 0.01, 4, 8),
+            #workload=partial(posterboard, total_nodes, 0.1),
+            n_routers=n_routers,
+            n_workers=n_workers,
+            max_children=b,
+            max_routers_root=b,
+            max_children_root=b + leftover_workers, # Give root room for extras
+            sharding=True,
+            discrete_event=True,
+            log_packets=False))
+    return points
+
+def calc_stats():
+    # Run N_TRIALS simulations at every point to smooth out randomness, each
+    # one as a separate task so that all cores stay busy. Results are cached,
+    # so replotting (or widening IV_RANGE) only simulates what's new
+    results = sweep(sweep_points(3), n_trials, bench_metrics,
+                    cache=ResultCache())
+    [(p50_m, p50_sd), (p75_m, p75_sd), (p90_m, p90_sd), (p95_m, p95_sd)] =\
+        sweepStats(results)
 
     stats = {
-            "50_m": percentile_50_means
-          , "50_sd": percentile_50_stdevs
-          , "75_m": percentile_75_means
-          , "75_sd": percentile_75_stdevs
-          , "90_m": percentile_90_means
-          , "90_sd": percentile_90_stdevs
-          , "95_m": percentile_95_means
-          , "95_sd": percentile_95_stdevs
+            "50_m": p50_m
+          , "50_sd": p50_sd
+          , "75_m": p75_m
+          , "75_sd": p75_sd
+          , "90_m": p90_m
+          , "90_sd": p90_sd
+          , "95_m": p95_m
+          , "95_sd": p95_sd
             }
+    return stats
 
-    save_stats(stats)
-    plot_stats(stats)
-
-def save_stats(stats):
-    with open("last_stats", 'wb') as file:
-        pickle.dump(stats, file)
-
-def load_stats():
-    with open("last_stats", 'rb') as file:
-        return pickle.load(file)
+def calc_and_show_fig():
+    plot_stats(calc_stats())
 
 def plot_stats(stats):
     #plt.figure()
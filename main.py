@@ -2,5 +2,5 @@ from benchmark import *
 from figures.smooth_transition import *
 
 if __name__ == '__main__':
-    #calc_and_show_fig()
-    plot_stats(load_stats())
+    # Only simulates points missing from the result cache
+    calc_and_show_fig()
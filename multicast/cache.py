@@ -0,0 +1,195 @@
+from collections import OrderedDict
+
+# Worker-side key caches. An enclave's key accesses go through its worker's
+# cache, and KeyUpdates multicast by other workers refresh whatever copies
+# the cache holds. All caches share the same interface, so Worker can take
+# any of them:
+#   get(key)              (hit, value) for an access by the local enclave
+#   put(key, value)       the local enclave wrote KEY, resident or not
+#   update(key, value)    a remote write to KEY: refreshes a resident copy
+#   key in cache, len(cache)
+# and count n_hits, n_misses, n_invalidations (resident copies overwritten by
+# remote updates) and n_evictions. CAPACITY is in keys.
+
+
+class KeyCache:
+    """ Unbounded: nothing is ever evicted. Base class of the others. """
+
+    def __init__(self, capacity: int = None):
+        self.capacity = capacity
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_invalidations = 0
+        self.n_evictions = 0
+        self._values = {}
+
+    def get(self, key):
+        if key in self._values:
+            self.n_hits += 1
+            self._touch(key)
+            return True, self._values[key]
+        self.n_misses += 1
+        return False, None
+
+    def put(self, key, value):
+        if key not in self._values:
+            self._admit(key)
+        self._values[key] = value
+
+    def update(self, key, value) -> bool:
+        """ Returns whether KEY was resident (and so has been refreshed). """
+        if key not in self._values:
+            return False
+        self.n_invalidations += 1
+        self._values[key] = value
+        return True
+
+    def hitRate(self) -> float:
+        accesses = self.n_hits + self.n_misses
+        return self.n_hits / accesses if accesses else 0.0
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __len__(self):
+        return len(self._values)
+
+    def _touch(self, key):
+        """ KEY, which is resident, was just accessed. """
+        pass
+
+    def _admit(self, key):
+        """ Makes room for KEY, which isn't resident, and tracks it. """
+        pass
+
+    def _evict(self, key):
+        del self._values[key]
+        self.n_evictions += 1
+
+
+class LRUCache(KeyCache):
+    """ Evicts the least recently accessed key. """
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity)
+        self._order = OrderedDict()  # Least recently used first
+
+    def _touch(self, key):
+        self._order.move_to_end(key)
+
+    def _admit(self, key):
+        if len(self._order) >= self.capacity:
+            victim, _ = self._order.popitem(last=False)
+            self._evict(victim)
+        self._order[key] = None
+
+
+class LFUCache(KeyCache):
+    """
+    Evicts the least frequently accessed key, the least recently used of
+    those on ties. O(1) per operation: keys are bucketed by access count.
+    """
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity)
+        self._counts = {}  # Key => # accesses
+        self._buckets = {}  # # accesses => OrderedDict of keys, LRU first
+        self._min_count = 0
+
+    def _touch(self, key):
+        count = self._counts[key]
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+            if self._min_count == count:
+                self._min_count = count + 1
+        self._counts[key] = count + 1
+        self._buckets.setdefault(count + 1, OrderedDict())[key] = None
+
+    def _admit(self, key):
+        if len(self._counts) >= self.capacity:
+            bucket = self._buckets[self._min_count]
+            victim, _ = bucket.popitem(last=False)
+            if not bucket:
+                del self._buckets[self._min_count]
+            del self._counts[victim]
+            self._evict(victim)
+        self._counts[key] = 1
+        self._buckets.setdefault(1, OrderedDict())[key] = None
+        self._min_count = 1
+
+
+class ARCCache(KeyCache):
+    """
+    Adaptive Replacement Cache (Megiddo & Modha): splits the capacity
+    between keys seen once recently (T1) and keys seen again (T2), steering
+    the split by hits on the ghost lists of keys recently evicted from each
+    (B1 and B2). A one-off scan only churns T1, so it can't flush the keys
+    that are actually being reused.
+    """
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity)
+        self._t1 = OrderedDict()  # Resident, LRU first
+        self._t2 = OrderedDict()
+        self._b1 = OrderedDict()  # Ghosts: keys only, no values
+        self._b2 = OrderedDict()
+        self._p = 0  # Target size of T1
+
+    def _touch(self, key):
+        if key in self._t1:
+            del self._t1[key]
+        else:
+            del self._t2[key]
+        self._t2[key] = None
+
+    def _admit(self, key):
+        c = self.capacity
+        if key in self._b1:
+            self._p = min(c, self._p + max(len(self._b2) // len(self._b1), 1))
+            self._replace(False)
+            del self._b1[key]
+            self._t2[key] = None
+            return
+        if key in self._b2:
+            self._p = max(0, self._p - max(len(self._b1) // len(self._b2), 1))
+            self._replace(True)
+            del self._b2[key]
+            self._t2[key] = None
+            return
+        if len(self._t1) + len(self._b1) >= c:
+            if len(self._t1) < c:
+                self._b1.popitem(last=False)
+                self._replace(False)
+            else:
+                victim, _ = self._t1.popitem(last=False)
+                self._evict(victim)
+        elif len(self._t1) + len(self._t2) + len(self._b1) \
+                + len(self._b2) >= c:
+            if len(self._t1) + len(self._t2) + len(self._b1) \
+                    + len(self._b2) >= 2 * c:
+                self._b2.popitem(last=False)
+            self._replace(False)
+        self._t1[key] = None
+
+    def _replace(self, in_b2: bool):
+        """ Evicts from T1 or T2 into its ghost list, if the cache is full. """
+        if len(self._t1) + len(self._t2) < self.capacity:
+            return
+        if self._t1 and (len(self._t1) > self._p
+                         or (in_b2 and len(self._t1) == self._p)):
+            victim, _ = self._t1.popitem(last=False)
+            self._b1[victim] = None
+        else:
+            victim, _ = self._t2.popitem(last=False)
+            self._b2[victim] = None
+        self._evict(victim)
+
+
+cache_policies = {
+    'unbounded': KeyCache,
+    'lru': LRUCache,
+    'lfu': LFUCache,
+    'arc': ARCCache,
+}
@@ -0,0 +1,82 @@
+from threading import RLock
+from simulators.events import simEnabled, simNow, simSchedule, rtSchedule
+from simulators.aio import aioEnabled, aioSchedule
+
+# Write-combining for KeyUpdate multicasts. A WriteCombiner sits on one
+# outgoing link (a worker's link to its parent, or a router's link to a
+# neighbour) and holds back the updates bound for it:
+#   - a newer update to a key replaces the one still waiting, so only the
+#     latest value of each key is sent
+#   - whatever is waiting goes out as a single multi-key packet, WINDOW
+#     seconds after the first update arrived or as soon as MAX_KEYS keys are
+#     waiting, whichever comes first
+# Updates are dicts as carried by 'KeyUpdate' messages; several of them make
+# up a 'KeyUpdateBatch' message's 'updates'.
+
+
+class WriteCombiner:
+    """
+    Buffers updates for FLUSH_FN(updates), which sends them on. WINDOW
+    (seconds) or MAX_KEYS may be None, but not both.
+    """
+
+    def __init__(self, window: float, max_keys: int, flush_fn):
+        assert window is not None or max_keys is not None, \
+            "A combiner needs a window or a key limit to flush on"
+        self.window = window
+        self.max_keys = max_keys
+        self.flush_fn = flush_fn
+        self._pending = {}  # Key => (update, time it arrived here)
+        self._n_flushes = 0  # Tells a flush timer if its buffer already left
+        self._lock = RLock()
+
+        self.n_updates = 0  # Updates added
+        self.n_merged = 0  # ...of which overwritten before being sent
+        self.n_packets = 0  # Packets sent
+        self.total_delay = 0.0  # Seconds updates that were sent spent waiting
+
+    def add(self, update: dict):
+        with self._lock:
+            self.n_updates += 1
+            if update['key'] in self._pending:
+                self.n_merged += 1
+            elif not self._pending and self.window is not None:
+                schedule = simSchedule if simEnabled() else \
+                    aioSchedule if aioEnabled() else rtSchedule
+                schedule(self.window, self.flush, self._n_flushes)
+            self._pending[update['key']] = (update, simNow())
+            full = self.max_keys is not None \
+                and len(self._pending) >= self.max_keys
+        if full:
+            self.flush()
+
+    def flush(self, flush_no: int = None):
+        """
+        Sends whatever is waiting. From a flush timer (FLUSH_NO given), only
+        if that timer's updates haven't already left.
+        """
+        with self._lock:
+            if not self._pending or flush_no not in (None, self._n_flushes):
+                return
+            pending, self._pending = self._pending, {}
+            self._n_flushes += 1
+            self.n_packets += 1
+            now = simNow()
+            self.total_delay += sum(now - t for _, t in pending.values())
+        self.flush_fn([update for update, _ in pending.values()])
+
+    def nSaved(self) -> int:
+        """ Packets that sending each update on its own would have added. """
+        return self.n_updates - self.n_packets
+
+
+def updatesOf(msg: dict):
+    """ The updates carried by a 'KeyUpdate' or 'KeyUpdateBatch' message. """
+    return msg['updates'] if msg['type'] == 'KeyUpdateBatch' else [msg]
+
+
+def updateMsg(updates) -> dict:
+    """ The message carrying UPDATES: as a plain 'KeyUpdate' if it can be. """
+    if len(updates) == 1:
+        return updates[0]
+    return {'type': 'KeyUpdateBatch', 'updates': updates}
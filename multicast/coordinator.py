@@ -1,9 +1,15 @@
+import asyncio
+import heapq
+from concurrent.futures import Future
 from queue import Queue, SimpleQueue
 from time import sleep
 from termcolor import colored
-from threading import Thread
+from threading import Thread, Condition
 from simulators.enclave import EnclaveProgram, enclaveExecute
 from simulators.network import Packet, NetworkHost, simpleSockListener, IpAddr, loopback_ip
+from simulators.events import simEnabled, simNow, simRun, simStep, \
+    simSchedule, rtSchedule
+from simulators.aio import aioEnabled, aioSchedule
 from multicast.core import *
 
 
@@ -14,6 +20,13 @@ class Tree(Node):
         self.max_children = max_children
         self.is_router = is_router
 
+        # Maintained incrementally as nodes are added below us
+        self.parent = None
+        self.n_descendants = 0
+        self.free_slots = max_children  # Room left anywhere in this subtree
+        self._index = 0  # Position in parent's list of children
+        self._room_heap = None  # See _leastLoadedWithRoom
+
     def prettyString(self, indent=0) -> str:
         tab = '  '
         car = colored(
@@ -40,22 +53,82 @@ class Tree(Node):
         return len(self.children)
 
     def numDescendants(self) -> int:
-        if not self.children:
-            return 0
-        return self.numChildren()\
-             + sum([c.numDescendants() for c in self.children])
+        return self.n_descendants
 
-    def addChild(self, ip: IpAddr):
+    def addChild(self, child):
         assert(self.hasRoom())
-        self.children.append(ip)
+        self._attach(child)
+
+    def forceAddChild(self, child):
+        self._attach(child)
+
+    def findRoom(self):
+        """
+        Returns the node that should adopt a new child: this node if it has
+        room, otherwise (recursively) the child subtree with room which has the
+        fewest descendants, earliest child first on ties. Returns None if the
+        whole tree is full.
+        Takes time logarithmic in the branching factor at each level.
+        """
+        node = self
+        while not node.hasRoom():
+            if node.free_slots <= 0:
+                return None
+            node = node._leastLoadedWithRoom()
+        return node
+
+    def _attach(self, child):
+        delta_free = child.free_slots - (1 if self.hasRoom() else 0)
+        delta_desc = 1 + child.n_descendants
+
+        child.parent = self
+        child._index = len(self.children)
+        self.children.append(child)
+        if self._room_heap is None and not self.hasRoom():
+            self._rebuildRoomHeap()  # Just filled up: placement goes past us
+        elif self._room_heap is not None and child.free_slots > 0:
+            heapq.heappush(self._room_heap,
+                           (child.n_descendants, child._index, child))
 
-    def forceAddChild(self, ip: IpAddr):
-        self.children.append(ip)
+        node = self
+        while node:
+            node.n_descendants += delta_desc
+            node.free_slots += delta_free
+            parent = node.parent
+            if parent and parent._room_heap is not None and node.free_slots > 0:
+                # Supersedes the entry keyed on our old size
+                heapq.heappush(parent._room_heap,
+                               (node.n_descendants, node._index, node))
+            node = parent
+
+    def _leastLoadedWithRoom(self):
+        """
+        Only valid once this node is full. Pops stale heap entries (for
+        children whose size has since grown, or which have filled up) until
+        the top is current.
+        """
+        heap = self._room_heap
+        if len(heap) > 2 * len(self.children) + 16:
+            self._rebuildRoomHeap()  # Keep stale entries from piling up
+            heap = self._room_heap
+        while heap:
+            n_desc, _, child = heap[0]
+            if child.free_slots > 0 and n_desc == child.n_descendants:
+                return child
+            heapq.heappop(heap)
+        return None
+
+    def _rebuildRoomHeap(self):
+        self._room_heap = [(c.n_descendants, c._index, c)
+                           for c in self.children if c.free_slots > 0]
+        heapq.heapify(self._room_heap)
 
 class Coordinator(Node):
 
     def __init__(self, host: NetworkHost, root_ip: IpAddr,
-                 debug_name: str = ""):
+                 debug_name: str = "", max_in_flight: int = None,
+                 batch_size: int = 1, batch_delay: float = 0.0,
+                 keep_results: bool = True):
         super().__init__(host, host.ip, f"Coordinator \'{debug_name}\'")
 
         assert host.openPort(simpleSockListener(host, self.handleControlMsg),
@@ -64,7 +137,28 @@ class Coordinator(Node):
                              COORD_RECV_RESULT_PORT)
 
         self.task_queue = Queue()  # Queue for tasks to send to mcast tree
+        self._all_done = None  # Set once all tasks finish, in asyncio mode
         self.tasks = {}  # Used to store results of previously completed tasks
+        # ...unless not KEEP_RESULTS: then finished tasks are only passed to
+        # their Futures (and asCompleted, while it runs), so a long stream of
+        # tasks needn't stay in memory
+        self.keep_results = keep_results
+
+        # At most MAX_IN_FLIGHT tasks are in the tree at once (None: no
+        # limit); later ones wait in task_queue until a result comes back
+        self.max_in_flight = max_in_flight
+        self.n_in_flight = 0
+        self._window = Condition()  # Guards n_in_flight and dispatch
+        self._futures = {}  # Task id => Future, until the task finishes
+        self._completed = None  # Finished tasks, while asCompleted() runs
+
+        # Tasks are sent down the tree BATCH_SIZE to a packet: a partial
+        # batch goes out BATCH_DELAY seconds after its first task joined it
+        assert batch_size >= 1, f"Bad batch size: {batch_size}"
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._batch = []
+        self._n_batches = 0  # Tells a flush timer if its batch already left
 
         self.routers = []
         self.workers = []
@@ -80,20 +174,7 @@ class Coordinator(Node):
             new_node = Tree(p.src, msg['is_router'],
                             msg['max_children'] if msg['is_router'] else 0)
 
-            def findRoom(tree):
-                if not tree:
-                    return None
-                if tree.hasRoom():
-                    return tree
-                sorted_children = sorted(tree.children,
-                                         key=lambda c: c.numDescendants())
-                for child in sorted_children:
-                    candidate = findRoom(child)
-                    if candidate:
-                        return candidate
-                return None
-
-            new_home = findRoom(self.root)
+            new_home = self.root.findRoom() if self.root else None
 
             # Temporary behavior: Just assign to the root instead
             # TODO remove this at some point
@@ -144,23 +225,139 @@ class Coordinator(Node):
     def handleResultMsg(self, p: Packet):
         msg = p.payload
         assert msg['type'] == 'Result', f"bad Result msg type: {msg}"
-        self.tasks[msg['program_uid']].finish(msg['result'])
+        task = self.tasks[msg['program_uid']]
+        task.finish(msg['result'])
+        with self._window:
+            self.n_in_flight -= 1
+            if not self.keep_results:
+                del self.tasks[task.id]
+            self._window.notify_all()
+        self._futures.pop(task.id).set_result(task)
+        if self._completed is not None:
+            self._completed.put(task)
         self.task_queue.task_done()
-        # TODO pass message along to user
+        self._dispatch()
+        if self._all_done and not self.task_queue.unfinished_tasks:
+            self._all_done.set()
 
-    def enqueueUserTask(self, task: UserTask):
-        self.tasks[task.id] = task
+    def submitUserTask(self, task: UserTask, block: bool = True) -> Future:
+        """
+        Submits TASK, returning a Future which resolves to it once it has a
+        result. If max_in_flight tasks are already in the tree, the task
+        waits its turn; in wall-clock mode with BLOCK (outside asyncio mode)
+        the caller waits with it. Cancelling the Future before the task is
+        dispatched withdraws it.
+        """
+        if block and not (simEnabled() or aioEnabled()):
+            with self._window:
+                self._window.wait_for(self._hasRoom)
+        task.submit_time = simNow()
+        future = Future()
+        with self._window:  # asCompleted may be scanning self.tasks
+            self.tasks[task.id] = task
+            self._futures[task.id] = future
         self.task_queue.put(task)
+        self._dispatch()
+        return future
+
+    def enqueueUserTask(self, task: UserTask):
+        self.submitUserTask(task)
+
+    def asCompleted(self):
+        """
+        Yields tasks as they finish (those already finished first), until
+        none are outstanding. Each is dropped from self.tasks as it's
+        yielded, so a long stream of tasks needn't keep every result.
+        In discrete-event mode, drives the virtual clock as it goes.
+        """
+        # A task finishing as we look may turn up in the queue as well as
+        # here, so the queue skips any we've already yielded
+        with self._window:
+            self._completed = SimpleQueue()
+            finished = [t for t in self.tasks.values() if t.has_result]
+        already_yielded = {task.id for task in finished}
+        for task in finished:
+            self.tasks.pop(task.id, None)
+            yield task
+        try:
+            while self.task_queue.unfinished_tasks \
+                    or not self._completed.empty():
+                if simEnabled():
+                    while self._completed.empty() and simStep():
+                        pass
+                    assert not self._completed.empty(), \
+                        "Event queue drained with tasks still outstanding"
+                task = self._completed.get()
+                if task.id in already_yielded:
+                    already_yielded.discard(task.id)
+                    continue
+                self.tasks.pop(task.id, None)
+                yield task
+        finally:
+            self._completed = None
 
-        # TODO defer this to later
-        user_task = self.task_queue.get()
-        msg = {
-            'type': 'ExecFakeProgram',
-            'program': user_task.program,
-            'program_uid': user_task.id}
+    def _hasRoom(self) -> bool:
+        return self.max_in_flight is None \
+            or self.n_in_flight < self.max_in_flight
+
+    def _dispatch(self):
+        """ Sends queued tasks to the root while the window has room. """
+        with self._window:
+            while self._hasRoom() and not self.task_queue.empty():
+                user_task = self.task_queue.get()
+                if not self._futures[user_task.id]\
+                        .set_running_or_notify_cancel():
+                    del self._futures[user_task.id]
+                    del self.tasks[user_task.id]
+                    self.task_queue.task_done()
+                    continue
+                self.n_in_flight += 1
+                if self.batch_size == 1:
+                    self._sendToRoot({
+                        'type': 'ExecFakeProgram',
+                        'program': user_task.program,
+                        'program_uid': user_task.id})
+                    continue
+                self._batch.append(user_task)
+                if len(self._batch) >= self.batch_size:
+                    self._flushBatch()
+                elif len(self._batch) == 1:
+                    schedule = simSchedule if simEnabled() else \
+                        aioSchedule if aioEnabled() else rtSchedule
+                    schedule(self.batch_delay, self._flushBatch,
+                             self._n_batches)
+
+    def _flushBatch(self, batch_no: int = None):
+        """
+        Sends the tasks batched so far to the root, as one packet. From a flush
+        timer (BATCH_NO given), only if that timer's batch hasn't left yet.
+        """
+        with self._window:
+            if not self._batch or batch_no not in (None, self._n_batches):
+                return
+            batch, self._batch = self._batch, []
+            self._n_batches += 1
+            self._sendToRoot({
+                'type': 'ExecFakeProgramBatch',
+                'programs': [t.program for t in batch],
+                'program_uids': [t.id for t in batch]})
+
+    def _sendToRoot(self, msg):
         packet = Packet(msg, self.host.ip, COORD_SEND_USERTASK_PORT,
                         self.root_ip, ROUTER_RECV_USERTASK_PORT)
         assert self.host.sendPacket(packet), f"Packet failed to send: {packet}"
 
     def joinUserTasks(self):
+        if simEnabled():
+            # Nothing happens until the virtual clock is driven forwards
+            simRun()
+            assert all(t.has_result for t in self.tasks.values()), \
+                "Event queue drained with tasks still outstanding"
         self.task_queue.join()
+
+    async def joinUserTasksAsync(self):
+        """ joinUserTasks for asyncio mode: waits without blocking the loop """
+        if self.task_queue.unfinished_tasks:
+            self._all_done = asyncio.Event()
+            await self._all_done.wait()
+            self._all_done = None
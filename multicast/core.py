@@ -3,6 +3,7 @@ from time import sleep
 from threading import Thread
 from simulators.network import Packet, NetworkHost, simpleSockListener, IpAddr, loopback_ip
 from simulators.enclave import EnclaveProgram, enclaveExecute
+from simulators.events import simNow
 
 ROUTER_SEND_CHILD_BASE_PORT = 5555
 ROUTER_SEND_JOIN_PORT = 6666
@@ -11,6 +12,7 @@ ROUTER_MCAST_PORT = 6667
 ROUTER_RESULT_PORT = 6669
 ROUTER_RECV_USERTASK_PORT = 6670
 ROUTER_SEND_USERTASK_PORT = 6671
+ROUTER_INTEREST_PORT = 6672
 
 WORKER_CONTROL_PORT = 7666
 WORKER_MCAST_PORT = 7667
@@ -41,10 +43,23 @@ class UserTask:
         self.program = program
         self.result = None
         self.has_result = False  # Non-pythonic I know
+        self.submit_time = None  # Simulated seconds, see simulators.events
+        self.arrival = None  # When to submit, from the start of a run, if set
+        self.on_finish = None  # Called with this task once it has a result
+        self.finish_time = None
 
     def finish(self, result: int):
         self.has_result = True
         self.result = result
+        self.finish_time = simNow()
+        if self.on_finish:
+            self.on_finish(self)
+
+    def latency(self) -> float:
+        """ Time from submission to completion, or None if unfinished. """
+        if not self.has_result or self.submit_time is None:
+            return None
+        return self.finish_time - self.submit_time
 
     def __repr__(self):
         return self.__str__()
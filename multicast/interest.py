@@ -0,0 +1,173 @@
+import sys
+from functools import lru_cache
+from hashlib import blake2b
+import numpy as np
+
+# Interest summaries record, for each child of a router, which keys are in use
+# by the tasks outstanding in that child's subtree. The router consults them to
+# decide which children need to see a given KeyUpdate.
+# All summaries share the same interface, so Router can take any of them:
+#   addChild(child)          start tracking a new child
+#   hasChild(child)
+#   add(child, key)          a task using KEY was sent to CHILD
+#   remove(child, key)       ...and has now finished
+#   contains(child, key)     may CHILD care about updates to KEY?
+#   interested(key)          all children which may care about KEY
+#   nbytes()                 approximate memory used by the summary itself
+#   peak_nbytes              the most nbytes() has been so far
+#   audit                    an ExactInterest shadowing this one, or None
+
+
+class ExactInterest:
+    """
+    Exact reference counts, kept as an inverted index from each key to the
+    children with outstanding tasks using it, so that looking up the
+    interested children costs time proportional to how many there are.
+    Entries are dropped once their count reaches zero.
+    """
+
+    def __init__(self):
+        self.audit = None  # Exact already, nothing to check against
+        self._children = set()
+        self._key_children = {}  # Key => {child IP: # outstanding tasks}
+        # Running total for nbytes(), so that it (and so tracking the peak)
+        # is O(1): children, plus each key, its counts and their contents
+        self._child_bytes = 0
+        self._entry_bytes = 0
+        self.peak_nbytes = self.nbytes()
+
+    def addChild(self, child):
+        if child not in self._children:
+            self._child_bytes += sys.getsizeof(child)
+        self._children.add(child)
+        self.peak_nbytes = max(self.peak_nbytes, self.nbytes())
+
+    def hasChild(self, child) -> bool:
+        return child in self._children
+
+    def add(self, child, key):
+        assert child in self._children, f"Unknown child {child}"
+        counts = self._key_children.get(key)
+        if counts is None:
+            counts = self._key_children[key] = {child: 1}
+            self._entry_bytes += sys.getsizeof(key) + sys.getsizeof(counts)\
+                + _entryBytes(child)
+        elif child in counts:
+            counts[child] += 1
+        else:
+            before = sys.getsizeof(counts)
+            counts[child] = 1
+            self._entry_bytes += sys.getsizeof(counts) - before\
+                + _entryBytes(child)
+        self.peak_nbytes = max(self.peak_nbytes, self.nbytes())
+
+    def remove(self, child, key):
+        counts = self._key_children.get(key)
+        assert counts and child in counts, \
+            "child_task_key sub-key missing: Should have populated this earlier!"
+        if counts[child] > 1:
+            counts[child] -= 1
+        elif len(counts) > 1:
+            before = sys.getsizeof(counts)
+            del counts[child]
+            self._entry_bytes -= before - sys.getsizeof(counts)\
+                + _entryBytes(child)
+        else:
+            del self._key_children[key]
+            self._entry_bytes -= sys.getsizeof(key) + sys.getsizeof(counts)\
+                + _entryBytes(child)
+
+    def contains(self, child, key) -> bool:
+        counts = self._key_children.get(key)
+        return counts is not None and child in counts
+
+    def interested(self, key):
+        counts = self._key_children.get(key)
+        # Snapshot, since enclave threads may add/remove tasks as we go
+        return list(counts) if counts else []
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self._children) + self._child_bytes\
+             + sys.getsizeof(self._key_children) + self._entry_bytes
+
+
+class CountingBloomInterest:
+    """
+    One counting Bloom filter per child, each N_COUNTERS counters wide with
+    N_HASHES hash functions. Memory is fixed regardless of the size of the
+    keyspace, at the cost of false positives: children are occasionally sent
+    updates for keys they don't use.
+    If AUDIT is set an ExactInterest is kept alongside the filters (it is not
+    counted by nbytes) so that false positives can be measured.
+    """
+
+    def __init__(self, n_counters: int = 4096, n_hashes: int = 4,
+                 audit: bool = False):
+        assert n_counters > 0 and n_hashes > 0, "Degenerate Bloom filter"
+        self.n_counters = n_counters
+        self.n_hashes = n_hashes
+        self.audit = ExactInterest() if audit else None
+        self._filters = {}  # Child IP => counter array
+        self._nbytes = sys.getsizeof(self._filters)  # Only addChild changes it
+        self.peak_nbytes = self._nbytes
+
+    def addChild(self, child):
+        self._filters[child] = np.zeros(self.n_counters, dtype=np.uint8)
+        self._nbytes = sys.getsizeof(self._filters) + sum(
+            sys.getsizeof(c) + f.nbytes for c, f in self._filters.items())
+        self.peak_nbytes = max(self.peak_nbytes, self._nbytes)
+        if self.audit:
+            self.audit.addChild(child)
+
+    def hasChild(self, child) -> bool:
+        return child in self._filters
+
+    def add(self, child, key):
+        counters = self._filters[child]
+        idx = _bloomPositions(key, self.n_counters, self.n_hashes)
+        # Saturated counters stay put: we can no longer tell when to clear them
+        counters[idx] += counters[idx] < np.iinfo(counters.dtype).max
+        self.peak_nbytes = max(self.peak_nbytes, self._nbytes)
+        if self.audit:
+            self.audit.add(child, key)
+
+    def remove(self, child, key):
+        counters = self._filters[child]
+        idx = _bloomPositions(key, self.n_counters, self.n_hashes)
+        assert counters[idx].all(), \
+            "child_task_key sub-key missing: Should have populated this earlier!"
+        counters[idx] -= counters[idx] < np.iinfo(counters.dtype).max
+        if self.audit:
+            self.audit.remove(child, key)
+
+    def contains(self, child, key) -> bool:
+        idx = _bloomPositions(key, self.n_counters, self.n_hashes)
+        return bool(self._filters[child][idx].all())
+
+    def interested(self, key):
+        idx = _bloomPositions(key, self.n_counters, self.n_hashes)
+        for child, counters in self._filters.items():
+            if counters[idx].all():
+                yield child
+
+    def nbytes(self) -> int:
+        return self._nbytes
+
+
+def _entryBytes(child) -> int:
+    """ Bytes for CHILD's entry in a key's counts: its IP and its count. """
+    return sys.getsizeof(child) + sys.getsizeof(1)
+
+
+@lru_cache(maxsize=65536)
+def _bloomPositions(key, n_counters: int, n_hashes: int):
+    """
+    Counter indices for KEY, by double hashing (Kirsch & Mitzenmacher).
+    Uses a stable digest rather than hash() so that positions, and therefore
+    false positives, are the same in every process.
+    """
+    digest = blake2b(repr(key).encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    idx = np.array([(h1 + i * h2) % n_counters for i in range(n_hashes)])
+    return np.unique(idx)  # Repeated positions must only count once
@@ -0,0 +1,91 @@
+import heapq
+import numpy.random as rand
+
+# Placement policies decide which child of a router each incoming task goes
+# to. All policies share the same interface, so Router can take any of them:
+#   choose(router, program)   the child to send a task running PROGRAM to
+#   place(router, programs)   yields a child per program of a batch in turn;
+#                             the router records each placement (in its
+#                             child_task_counts and child_task_keys) before
+#                             asking for the next
+# Policies read the router's child_task_counts (tasks outstanding in each
+# child's subtree) and child_task_keys (see multicast.interest).
+
+
+class LeastLoaded:
+    """ The child with the fewest outstanding tasks, earliest on ties. """
+
+    def choose(self, router, program):
+        counts = router.child_task_counts
+        return min(counts, key=counts.get)
+
+    def place(self, router, programs):
+        # One heap for the whole batch: picks the same children as choosing
+        # one by one would, in O(log # children) each
+        heap = [(n, i, child) for i, (child, n)
+                in enumerate(router.child_task_counts.items())]
+        heapq.heapify(heap)
+        for _ in programs:
+            n, i, child = heap[0]
+            heapq.heapreplace(heap, (n + 1, i, child))
+            yield child
+
+
+class KeyAffinity:
+    """
+    Scores each child by how many of the program's keys are already in use
+    in its subtree, less WEIGHT per outstanding task there, and picks the
+    best (the least loaded of those on ties). Keeping tasks that share keys
+    together narrows the multicast fan-out of their updates; WEIGHT stops
+    popular keys from piling everything onto one child.
+    """
+
+    def __init__(self, weight: float = 1.0):
+        self.weight = weight
+
+    def choose(self, router, program):
+        counts = router.child_task_counts
+        overlap = dict.fromkeys(counts, 0)
+        for k in set(program.keys):
+            for child in router.child_task_keys.interested(k):
+                overlap[child] += 1
+        return max(counts, key=lambda c: (overlap[c] - self.weight * counts[c],
+                                          -counts[c]))
+
+    def place(self, router, programs):
+        for program in programs:
+            yield self.choose(router, program)
+
+
+class PowerOfTwoChoices:
+    """
+    The less loaded of two children picked at random from RNG (a numpy
+    Generator): nearly as balanced as LeastLoaded, in constant time.
+    """
+
+    def __init__(self, rng=None):
+        self.rng = rng if rng is not None else rand.default_rng()
+
+    def choose(self, router, program):
+        workers, routers = router.child_workers, router.child_routers
+        n = len(workers) + len(routers)
+        if n < 2:
+            return (workers + routers)[0]
+        i = self.rng.integers(n)
+        j = self.rng.integers(n - 1)
+        j += j >= i  # Distinct from i
+        a, b = [workers[x] if x < len(workers) else routers[x - len(workers)]
+                for x in (i, j)]
+        counts = router.child_task_counts
+        return a if counts[a] <= counts[b] else b
+
+    def place(self, router, programs):
+        for program in programs:
+            yield self.choose(router, program)
+
+
+placement_policies = {
+    'least_loaded': LeastLoaded,
+    'affinity': KeyAffinity,
+    'p2c': PowerOfTwoChoices,
+}
@@ -1,9 +1,15 @@
+from collections import deque
 from queue import Queue, SimpleQueue
 from time import sleep
 from threading import Thread
 from simulators.network import Packet, NetworkHost, simpleSockListener, IpAddr, loopback_ip
 from simulators.enclave import EnclaveProgram, enclaveExecute
 from multicast.core import *
+from multicast.interest import ExactInterest
+from multicast.combining import updatesOf, updateMsg
+from multicast.placement import LeastLoaded
+from simulators.events import simEnabled, simNow, simSchedule, rtSchedule
+from simulators.aio import aioEnabled, aioSchedule
 from threading import Lock
 from util.rw_lock import ReadWriteLock
 
@@ -17,7 +23,13 @@ class Router(Node):
             is_root: bool,
             max_children: int,
             debug_name: str,
-            enable_sharding: bool = True):
+            enable_sharding: bool = True,
+            interest_summary=ExactInterest,
+            service_time: float = 0.0,
+            queue_limit: int = None,
+            write_combiner=None,
+            upward_sharding: bool = False,
+            placement=LeastLoaded):
         super().__init__(host, coordinator_ip, f"Router \'{debug_name}\'")
 
         self.is_root = is_root
@@ -25,20 +37,66 @@ class Router(Node):
         self.parent = None
         self.child_workers = []
         self.child_routers = []
+        self._child_router_ips = set()  # For O(1) child-type lookups
         self.enable_sharding = enable_sharding
         self.lock = ReadWriteLock()
 
         self.child_task_counts = {}  # Lets us load-balance new tasks
-        self.child_task_keys = {}  # Idealized (downwards) key-based sharding
+        self.placement = placement()  # See multicast.placement
+        # (Downwards) key-based sharding: see multicast.interest for backends
+        self.child_task_keys = interest_summary()
+        self.n_false_positive_mcasts = 0  # Only counted if summary is audited
+        # Upwards sharding: keys in use outside our subtree, as pushed down by
+        # our parent in 'InterestUpdate's. Updates only climb for these keys.
+        # Interest is tracked from when the tree is built, so routers should
+        # all have joined before the first task is sent.
+        self.upward_sharding = upward_sharding
+        self.outside_interest = set()
+        self._told_interest = {}  # Child router => keys it's been sent
+        # Key => {child router => when its last task using the key came back}
+        self._lapsed_interest = {}
+        # Updates we didn't send up, in case news that someone outside wants
+        # them is still on its way: see _holdBack
+        self._held_back = {}  # Key => [(time held back, update)]
+        # How far behind the present an 'InterestUpdate' can ask us to look:
+        # past that, lapsed interest and held updates are forgotten. Set by
+        # buildTree, which knows the tree's depth and links
+        self.interest_horizon = 0.0
+        # Write-combining of outgoing KeyUpdates, one combiner per neighbour:
+        # WRITE_COMBINER(flush_fn) makes one (None: send updates straight on)
+        self.write_combiner = write_combiner
+        self.combiners = {}  # Neighbour IP => WriteCombiner
+
+        # Processing model (discrete-event mode only): data-plane packets are
+        # served one at a time, SERVICE_TIME seconds each, from an input queue
+        # holding at most QUEUE_LIMIT waiting packets (None: unbounded).
+        # Only multicast traffic is ever dropped; tasks and results are
+        # assumed to be retransmitted, so are always queued.
+        self.service_time = service_time
+        self.queue_limit = queue_limit
+        self._input_queue = deque()  # (arrival time, handler, packet)
+        self._serving = False
+        self.busy_time = 0.0
+        self.n_served = 0
+        self.n_dropped = 0
+        self.total_wait = 0.0
+        self.max_queue_depth = 0
+        self._arrival_time = 0.0  # When the packet being handled arrived
 
         assert host.openPort(simpleSockListener(host, self.handleControlMsg),
                              ROUTER_CONTROL_PORT)
-        assert host.openPort(simpleSockListener(host, self.handleMulticastMsg),
-                             ROUTER_MCAST_PORT)
-        assert host.openPort(simpleSockListener(host, self.handleUserTask),
-                             ROUTER_RECV_USERTASK_PORT)
-        assert host.openPort(simpleSockListener(host, self.handleResultMsg),
-                             ROUTER_RESULT_PORT)
+        assert host.openPort(simpleSockListener(
+            host, self._queued(self.handleMulticastMsg, True)),
+            ROUTER_MCAST_PORT)
+        assert host.openPort(simpleSockListener(
+            host, self._queued(self.handleUserTask)),
+            ROUTER_RECV_USERTASK_PORT)
+        assert host.openPort(simpleSockListener(
+            host, self._queued(self.handleResultMsg)),
+            ROUTER_RESULT_PORT)
+        assert host.openPort(simpleSockListener(
+            host, self._queued(self.handleInterestMsg)),
+            ROUTER_INTEREST_PORT)
 
         join_msg = {
             'type': "RootJoin" if is_root else "Join",
@@ -61,11 +119,12 @@ class Router(Node):
             if msg['node_type'] == 'Worker':
                 self.child_workers.append(ip)
                 self.child_task_counts[ip] = 0
-                self.child_task_keys[ip] = {}
+                self.child_task_keys.addChild(ip)
             elif msg['node_type'] == 'Router':
                 self.child_routers.append(ip)
+                self._child_router_ips.add(ip)
                 self.child_task_counts[ip] = 0
-                self.child_task_keys[ip] = {}
+                self.child_task_keys.addChild(ip)
             else:
                 assert not msg, f"Bad node_type in msg: {msg}"
         else:
@@ -73,83 +132,246 @@ class Router(Node):
 
     def handleMulticastMsg(self, p: Packet):
         msg = p.payload
-        if (msg['type'] == 'KeyUpdate'):
-            def propogateMulticast(ip, is_router):
-                assert ip, f"Null ip cannot be propogated: orig. packet {p}"
-                if ip is p.src:
-                    return  # Don't bounce to the sender!
+        if (msg['type'] == 'KeyUpdate') and not self.write_combiner:
+            for ip, is_router in self._mcastTargets(msg, p.src):
                 dst_port = ROUTER_MCAST_PORT if is_router else WORKER_MCAST_PORT
                 assert self.host.forwardPacket(
                     p, ROUTER_MCAST_PORT, ip, dst_port), "mcast propogate failed"
-
-            # First send up the tree to our parent, unless they sent it to us
-            # TODO shard upwards as well
-            if not self.is_root:
-                propogateMulticast(self.parent, True)
-            # Then send down to children, EXCEPT the one which (if any) sent it!
-            # We traverse our record of their working-set of keys to avoid
-            # sending redundant packets, this is basically the biggest thing
-            # we're working on in this whole project so it's pretty important
-            # In C++ ofc we're doing this with Bloom Filters but this still
-            # gives us a pretty chill lower bound on congestion
-            k = msg['key']
-            if self.enable_sharding:
-                for child, child_dict in self.child_task_keys.items():
-                    if k and k in child_dict and child_dict[k] > 0:
-                        if child in self.child_routers:
-                            propogateMulticast(child, True)
-                        else:
-                            assert child in self.child_workers, "neither router nor child?"
-                            propogateMulticast(child, False)
-            else:
-                for child in self.child_workers:
-                    propogateMulticast(child, False)
-                for child in self.child_routers:
-                    propogateMulticast(child, True)
+        elif msg['type'] in ('KeyUpdate', 'KeyUpdateBatch'):
+            # Split the updates by where they're headed, then combine them
+            # with whatever else is on its way there
+            outgoing = {}  # IP => (is_router, updates)
+            for update in updatesOf(msg):
+                for ip, is_router in self._mcastTargets(update, p.src):
+                    outgoing.setdefault(ip, (is_router, []))[1].append(update)
+            for ip, (is_router, updates) in outgoing.items():
+                if self.write_combiner:
+                    combiner = self._combiner(ip, is_router)
+                    for update in updates:
+                        combiner.add(update)
+                else:
+                    self._sendUpdates(ip, is_router, updates)
         else:
             assert not msg, f"bad msg contents: {msg}"
 
+    def _mcastTargets(self, update: dict, src: IpAddr):
+        """
+        Yields (IP, is a router) for each neighbour UPDATE, which came from
+        SRC, should be passed on to.
+        """
+        k = update['key']
+        def propogateMulticast(ip, is_router):
+            assert ip, f"Null ip cannot be propogated: update from {src}"
+            if ip == src:
+                return []  # Don't bounce to the sender!
+            return [(ip, is_router)]
+
+        # First send up the tree to our parent, unless they sent it to us or
+        # (if sharding upwards) nobody outside our subtree uses the key yet
+        if not self.is_root:
+            if not self.upward_sharding or k in self.outside_interest:
+                yield from propogateMulticast(self.parent, True)
+            elif src != self.parent:
+                self._holdBack(update)
+        # Then send down to children, EXCEPT the one which (if any) sent it!
+        # We traverse our record of their working-set of keys to avoid
+        # sending redundant packets, this is basically the biggest thing
+        # we're working on in this whole project so it's pretty important
+        # In C++ ofc we're doing this with Bloom Filters, which we can
+        # model too; the exact summary gives a pretty chill lower bound
+        if self.enable_sharding:
+            # Costs O(# interested children) with an exact summary
+            audit = self.child_task_keys.audit
+            for child in (self.child_task_keys.interested(k) if k else []):
+                if audit and child != src and not audit.contains(child, k):
+                    self.n_false_positive_mcasts += 1
+                yield from propogateMulticast(
+                    child, child in self._child_router_ips)
+        else:
+            for child in self.child_workers:
+                yield from propogateMulticast(child, False)
+            for child in self.child_routers:
+                yield from propogateMulticast(child, True)
+
+    def _combiner(self, ip: IpAddr, is_router: bool):
+        if ip not in self.combiners:
+            self.combiners[ip] = self.write_combiner(
+                lambda updates: self._sendUpdates(ip, is_router, updates))
+        return self.combiners[ip]
+
+    def _sendUpdates(self, ip: IpAddr, is_router: bool, updates):
+        dst_port = ROUTER_MCAST_PORT if is_router else WORKER_MCAST_PORT
+        assert self.host.sendMsg(updateMsg(updates), ROUTER_MCAST_PORT,
+                                 ip, dst_port), "mcast propogate failed"
+
     def handleUserTask(self, p: Packet):
         msg = p.payload
-        assert msg['type'] == 'ExecFakeProgram', f"Bad packet: {p}"
+        assert msg['type'] in ('ExecFakeProgram', 'ExecFakeProgramBatch'), \
+            f"Bad packet: {p}"
         # TODO bounce back if no children available
         if (not self.child_workers) and (not self.child_routers):
             print(self, self.child_workers, self.child_routers)
             assert self.child_workers or self.child_routers, "I have no child"
+        if msg['type'] == 'ExecFakeProgramBatch':
+            return self._splitBatch(msg)
 
         # Track metadata for our children to optimize mcasting + task assignment
-        # 1.  Select child with fewest queued tasks (as far as we know)
-        lucky_child = min(
-            self.child_task_counts,
-            key=self.child_task_counts.get)
-        self.child_task_counts[lucky_child] += 1  # Track tasks per child
+        # 1.  Select a child by our placement policy: by default the one with
+        #     the fewest queued tasks (as far as we know)
+        lucky_child = self.placement.choose(self, msg['program'])
         #self.lock.acquire_read()
         #    self.lock.release_read()
         #    self.lock.acquire_write()
         #    self.lock.release_write()
-        for k in msg['program'].keys:
-            if k in self.child_task_keys[lucky_child]:
-                self.child_task_keys[lucky_child][k] += 1
-            else:
-                self.child_task_keys[lucky_child][k] = 1
+        self._assignTask(lucky_child, msg['program'])
 
         self.host.forwardPacket(
             p,
             p.dst_port,
             lucky_child,
-            ROUTER_RECV_USERTASK_PORT if lucky_child in self.child_routers else WORKER_RECV_USERTASK_PORT)
+            self._taskPort(lucky_child))
+
+    def _splitBatch(self, msg):
+        """
+        Deals out a batch of tasks in one pass, each to the child our
+        placement policy picks at that point (so the same children as
+        one-by-one dispatch would pick), then sends each child its share as
+        a single batch.
+        """
+        programs = msg['programs']
+        shares = {}  # Child => (programs, program uids)
+        for program, uid, child in zip(programs, msg['program_uids'],
+                                       self.placement.place(self, programs)):
+            self._assignTask(child, program)
+            child_programs, child_uids = shares.setdefault(child, ([], []))
+            child_programs.append(program)
+            child_uids.append(uid)
+
+        for child, (child_programs, child_uids) in shares.items():
+            batch = {
+                'type': 'ExecFakeProgramBatch',
+                'programs': child_programs,
+                'program_uids': child_uids}
+            self.host.sendMsg(batch, ROUTER_SEND_USERTASK_PORT,
+                              child, self._taskPort(child))
+
+    def _assignTask(self, child: IpAddr, program: EnclaveProgram):
+        self.child_task_counts[child] += 1  # Track tasks per child
+        self._trackInterest(child, program.keys, True)
+
+    def _trackInterest(self, child: IpAddr, keys, adding: bool):
+        """
+        Records that a task using KEYS went to (ADDING) or came back from
+        CHILD, telling our child routers if someone outside their subtree
+        now needs their updates.
+        """
+        for k in keys:
+            if adding:
+                self.child_task_keys.add(child, k)
+                if self.upward_sharding:
+                    self._pushInterest(k, self._arrival_time)
+            else:
+                self.child_task_keys.remove(child, k)
+                if self.upward_sharding \
+                        and not self.child_task_keys.contains(child, k):
+                    if child in self._child_router_ips:
+                        self._lapsed_interest.setdefault(k, {})[child] = \
+                            self._arrival_time
+                    schedule = simSchedule if simEnabled() else \
+                        aioSchedule if aioEnabled() else rtSchedule
+                    schedule(self.interest_horizon, self._forgetInterest, k,
+                             simNow())
+
+    def _pushInterest(self, k, since: float):
+        """
+        A child router only sends updates to K up to us if it has tasks using
+        K, and only needs to if someone outside its subtree uses K too: our
+        other children, or anyone outside our own subtree. Sends any such
+        child that hasn't heard it yet an 'InterestUpdate', asking for the
+        updates that would have reached us from SINCE on.
+        Interest is sticky: children aren't told when it lapses, which could
+        only let updates climb needlessly, never stop them. That way each
+        (child, key) pair costs at most one message however often the key
+        changes hands. A child whose tasks using K came back since SINCE
+        still counts, as what it held back may have been meant for us.
+        """
+        interested = set(self.child_task_keys.interested(k))
+        interested.update(
+            child for child, lapsed in self._lapsed_interest.get(k, {}).items()
+            if lapsed >= since)
+        if k not in self.outside_interest and len(interested) < 2:
+            return
+        for child in interested:
+            if child not in self._child_router_ips:
+                continue
+            told = self._told_interest.setdefault(child, set())
+            if k not in told:
+                told.add(k)
+                msg = {'type': 'InterestUpdate', 'key': k, 'since': since}
+                self.host.sendMsg(msg, ROUTER_INTEREST_PORT,
+                                  child, ROUTER_INTEREST_PORT)
+
+    def handleInterestMsg(self, p: Packet):
+        msg = p.payload
+        assert msg['type'] == 'InterestUpdate', f"Bad packet: {p}"
+        assert p.src == self.parent, f"InterestUpdate from non-parent: {p}"
+        k = msg['key']
+        if k in self.outside_interest:
+            return
+        self.outside_interest.add(k)
+        # Send on whatever we held back that would have reached our parent
+        # from SINCE on, and ask our children for the same
+        since = msg['since'] - self.host.ping(self.parent)[1] / 2
+        held = [update for t, update in self._held_back.pop(k, [])
+                if t >= since]
+        if held:
+            self._sendUpdates(self.parent, True, held)
+        self._pushInterest(k, since)
+
+    def _forgetInterest(self, k, cutoff: float):
+        """
+        Drops what we've held back of K, and which of our children K lapsed
+        in, up to CUTOFF: run interest_horizon after then (when K lapsed in
+        a child), once no 'InterestUpdate' can still ask about it, so that
+        nothing is kept for keys never wanted outside our subtree.
+        """
+        held = [(t, update) for t, update in self._held_back.pop(k, [])
+                if t > cutoff]
+        if held:
+            self._held_back[k] = held
+        lapsed = {child: t for child, t
+                  in self._lapsed_interest.pop(k, {}).items() if t > cutoff}
+        if lapsed:
+            self._lapsed_interest[k] = lapsed
+
+    def _holdBack(self, update: dict):
+        """
+        We aren't sending UPDATE up to our parent, as nobody outside our
+        subtree used its key when it got here. Someone may have started to
+        since: news of that takes a hop per level to come down the tree,
+        while our workers keep writing the key. So we keep the updates we
+        hold back until an 'InterestUpdate' for the key comes, and send up
+        those it turns out to want. Over links with only latency (no
+        bandwidth limit, service time or write-combining to delay them),
+        those are exactly the ones an unsharded tree would have delivered:
+        so bench() allows nothing else with upward sharding.
+        """
+        self._held_back.setdefault(update['key'], []).append((simNow(),
+                                                              update))
+
+    def _taskPort(self, child: IpAddr) -> int:
+        return ROUTER_RECV_USERTASK_PORT if child in self._child_router_ips\
+            else WORKER_RECV_USERTASK_PORT
 
     def handleResultMsg(self, p: Packet):
         msg = p.payload
         assert msg['type'] == 'Result', f"bad Result msg type: {msg}"
 
         self.child_task_counts[p.src] -= 1  # Track tasks per child
-        assert p.src in self.child_task_keys, \
+        assert self.child_task_keys.hasChild(p.src), \
             "child_task_key missing: Should have populated this earlier!"
-        for k in msg['program'].keys:      # Track keys in use per child
-            assert k in self.child_task_keys[p.src], \
-                "child_task_key sub-key missing: Should have populated this earlier!"
-            self.child_task_keys[p.src][k] -= 1
+        # Track keys in use per child
+        self._trackInterest(p.src, msg['program'].keys, False)
 
         if self.is_root:
             self.host.forwardPacket(
@@ -160,3 +382,39 @@ class Router(Node):
         else:
             self.host.forwardPacket(p, ROUTER_RESULT_PORT,
                                     self.parent, ROUTER_RESULT_PORT)
+
+    def _queued(self, handler, droppable: bool = False):
+        """
+        Wraps packet handler HANDLER so that packets pass through this
+        router's input queue and are charged its service time.
+        """
+        def admit(p: Packet):
+            if not simEnabled() or self.service_time <= 0:
+                self._arrival_time = simNow()
+                return handler(p)
+            if not self._serving:
+                return self._startService(simNow(), handler, p)
+            if droppable and self.queue_limit is not None\
+                    and len(self._input_queue) >= self.queue_limit:
+                self.n_dropped += 1
+                return
+            self._input_queue.append((simNow(), handler, p))
+            self.max_queue_depth = max(self.max_queue_depth,
+                                       len(self._input_queue))
+        return admit
+
+    def _startService(self, arrival_time: float, handler, p: Packet):
+        self._serving = True
+        self.n_served += 1
+        self.total_wait += simNow() - arrival_time
+        self.busy_time += self.service_time
+        simSchedule(self.service_time, self._finishService, arrival_time,
+                    handler, p)
+
+    def _finishService(self, arrival_time: float, handler, p: Packet):
+        self._arrival_time = arrival_time
+        handler(p)
+        if self._input_queue:
+            self._startService(*self._input_queue.popleft())
+        else:
+            self._serving = False
@@ -1,14 +1,19 @@
-from queue import Queue, SimpleQueue
+from collections import deque
+from queue import Queue
 from time import sleep
-from threading import Thread
+from threading import Thread, Lock
 from simulators.network import Packet, NetworkHost, simpleSockListener, IpAddr, loopback_ip
 from simulators.enclave import EnclaveProgram, enclaveExecute
+from simulators.events import simEnabled, simNow
 from multicast.core import *
+from multicast.combining import updatesOf, updateMsg
+from multicast.cache import KeyCache
 
 
 class Worker(Node):
     def __init__(self, host: NetworkHost, coordinator_ip: IpAddr,
-                 debug_name: str = ""):
+                 debug_name: str = "", rng=None, write_combiner=None,
+                 cache=KeyCache):
         super().__init__(host, coordinator_ip, f"Worker \'{debug_name}\'")
 
         assert host.openPort(simpleSockListener(host, self.handleControlMsg),
@@ -19,9 +24,20 @@ class Worker(Node):
                              WORKER_RECV_USERTASK_PORT)
 
         self.parent = None
-        self._enclave_queue = SimpleQueue()
-        self._enclave_thread = None
-        self._enclave_memcache = {}
+        # Programs are submitted on the dispatching thread but finish on the
+        # timer threads, so the queue and busy flag change hands under a lock
+        self._enclave_lock = Lock()
+        self._enclave_queue = deque()  # FIFO of programs waiting to run
+        self._enclave_busy = False
+        self.cache = cache()  # Keys the enclave has used: see multicast.cache
+        self._enclave_rng = rng  # Shared by all this worker's programs
+        self._n_updates_sent = 0
+        self.n_tasks_run = 0
+        self.key_update_arrivals = {}  # Update ID => (time sent, time arrived)
+        # Combines our KeyUpdates before they go to our parent, if given a
+        # factory for one: see multicast.combining
+        self.combiner = write_combiner(self._sendUpdates) \
+            if write_combiner else None
 
         join_msg = {
             'type': "Join",
@@ -41,37 +57,60 @@ class Worker(Node):
             assert false, f"bad msg contents: {msg}"
 
     def handleMulticastMsg(self, p: Packet):
-        # TODO update local memcache if it's relevant, maybe reply or something
-        pass
+        msg = p.payload
+        assert msg['type'] in ("KeyUpdate", "KeyUpdateBatch"), \
+            f"Bad packet: {p}"
+        for update in updatesOf(msg):
+            self.key_update_arrivals[update['update_id']] = (update['time'],
+                                                             simNow())
+            self.cache.update(update['key'], update['value'])
 
     def handleUserTask(self, p: Packet):
         msg = p.payload
-        assert msg['type'] == "ExecFakeProgram", f"Bad packet: {p}"
-        program = msg['program']
-
         assert self.parent, "Detached worker cannot run!"
-        if self._enclave_thread is None:
-            self._enclaveStart(program, msg['program_uid'])
+        if msg['type'] == "ExecFakeProgramBatch":
+            for program, uid in zip(msg['programs'], msg['program_uids']):
+                self._enclaveSubmit(program, uid)
         else:
-            self._enclave_queue.put((program, msg['program_uid']))
+            assert msg['type'] == "ExecFakeProgram", f"Bad packet: {p}"
+            self._enclaveSubmit(msg['program'], msg['program_uid'])
+
+    def _enclaveSubmit(self, program: EnclaveProgram, program_uid: int):
+        with self._enclave_lock:
+            if self._enclave_busy:
+                self._enclave_queue.append((program, program_uid))
+                return
+            self._enclave_busy = True
+        self._enclaveStart(program, program_uid)
 
     def _enclaveStart(self, program: EnclaveProgram, program_uid: int):
-        assert self._enclave_thread is None, "Enclave already running"
+        # Started outside the lock: an empty program completes right away
+        assert self._enclave_busy, "Enclave started without claiming it"
+        self.n_tasks_run += 1
 
         def callback(result):
             return self._enclaveComplete(program, program_uid, result)
-        self._enclave_thread = Thread(
-            target=enclaveExecute,
-            args=(program, self._enclaveUpdate, callback))
-        self._enclave_thread.start()
+        # Key steps are scheduled as events/timers, so this returns immediately
+        enclaveExecute(program, self._enclaveUpdate, callback,
+                       self._enclave_rng)
 
     def _enclaveUpdate(self, key, value, program: EnclaveProgram):
-        self._enclave_memcache[key] = value
+        self.cache.get(key)  # Counts as a hit or miss
+        self.cache.put(key, value)
         mcast_msg = {
-            'type': "KeyUpdate", 'key': key, 'value': value
+            'type': "KeyUpdate", 'key': key, 'value': value,
+            'update_id': (self.host.ip, self._n_updates_sent),
+            'time': simNow()
         }
+        self._n_updates_sent += 1
+        if self.combiner:
+            self.combiner.add(mcast_msg)
+        else:
+            self._sendUpdates([mcast_msg])
+
+    def _sendUpdates(self, updates):
         self.host.sendMsg(
-            mcast_msg,
+            updateMsg(updates),
             WORKER_MCAST_PORT,
             self.parent,
             ROUTER_MCAST_PORT)
@@ -81,9 +120,8 @@ class Worker(Node):
             program: EnclaveProgram,
             program_uid: int,
             result):
-        # Currently runs synchronously so no need to join
-        # self._enclave_thread.join()
-
+        if self.combiner:
+            self.combiner.flush()  # Results never overtake their updates
         result_msg = {
             'type': "Result",
             'result': result,
@@ -92,9 +130,9 @@ class Worker(Node):
         self.host.sendMsg(result_msg, WORKER_SEND_RESULT_PORT,
                           self.parent, ROUTER_RESULT_PORT)
 
-        if not self._enclave_queue.empty():
-            self._enclave_thread = None
-            task, t_id = self._enclave_queue.get()
-            self._enclaveStart(task, t_id)
-        else:
-            self._enclave_thread = None
+        with self._enclave_lock:
+            if not self._enclave_queue:
+                self._enclave_busy = False
+                return
+            task, t_id = self._enclave_queue.popleft()
+        self._enclaveStart(task, t_id)  # Still busy: handed straight on
@@ -0,0 +1,147 @@
+import argparse
+import threading
+import numpy as np
+from time import perf_counter, sleep
+from termcolor import colored
+
+from benchmark import *
+from simulators.enclave import ProgramBatch, _enclaveSteps
+
+# Measures how the cost of *setting up* a simulation grows with its size, as
+# opposed to benchmark.py, which measures the simulated system itself.
+
+
+def scale_registerHosts(n_hosts):
+    """ Seconds taken to put N_HOSTS hosts on the network. """
+    netReset()
+    start = perf_counter()
+    for _ in range(n_hosts):
+        NetworkHost("90")
+    return perf_counter() - start
+
+
+def scale_buildTree(n_hosts, branch):
+    """
+    Seconds taken to assemble a tree of N_HOSTS nodes with branching factor
+    BRANCH, about 1/BRANCH of which are routers.
+    """
+    netReset()
+    n_routers = n_hosts // branch
+    start = perf_counter()
+    buildTree(n_routers, n_hosts - n_routers, branch, branch)
+    return perf_counter() - start
+
+
+def scale_enclaves(n_workers, thread_per_program=False):
+    """
+    Seconds taken for N_WORKERS enclaves to each run a short program at once,
+    in wall-clock mode, and the peak number of threads alive meanwhile.
+    Uses the shared timer threads, or with THREAD_PER_PROGRAM the old scheme
+    of one thread per program sleeping through each key step.
+    """
+    simEnable(False)
+    # ~25ms of work each: long enough for the thread-per-program runs to overlap
+    rng = np.random.default_rng(0)
+    programs = ProgramBatch.sample(['x', 'y', 'z'], n_workers, 0.3, 1, rng)
+    done = threading.Semaphore(0)
+    peakThreads = _sampleThreads()
+
+    def update(key, value, program): pass
+    def finish(result): done.release()
+
+    def sleepThrough(program):
+        steps = _enclaveSteps(program, update, rng)
+        try:
+            while True:
+                sleep(next(steps))
+        except StopIteration as result:
+            finish(result.value)
+
+    start = perf_counter()
+    for program in programs:
+        if thread_per_program:
+            threading.Thread(target=sleepThrough, args=(program,)).start()
+        else:
+            enclaveExecute(program, update, finish, rng)
+    for _ in range(n_workers):
+        done.acquire()
+    seconds = perf_counter() - start
+    return seconds, peakThreads()
+
+
+def scale_asyncio(n_hosts, branch):
+    """
+    Seconds taken to build a tree of N_HOSTS nodes on one asyncio event loop
+    and run a task on each worker, all arriving at once, plus the peak number
+    of threads alive meanwhile.
+    """
+    n_routers = n_hosts // branch
+    n_workers = n_hosts - n_routers
+    peakThreads = _sampleThreads()
+    start = perf_counter()
+    bench(False, working_sets(n_workers, 10, 4, 5)(), n_routers, n_workers,
+          branch, branch, branch, True, log_packets=False, task_interval=0,
+          seed=0, asyncio_mode=True)
+    return perf_counter() - start, peakThreads()
+
+
+def _sampleThreads():
+    """
+    Starts watching the number of threads alive (not counting the watcher).
+    Returns a function which stops watching, returning the peak.
+    """
+    peak_threads = threading.active_count()
+    sampling = True
+
+    def sample():
+        nonlocal peak_threads
+        while sampling:
+            peak_threads = max(peak_threads, threading.active_count() - 1)
+            sleep(0.001)
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+
+    def stop():
+        nonlocal sampling
+        sampling = False
+        sampler.join()
+        return peak_threads
+    return stop
+
+
+scaling_stats = {
+    'hosts': lambda n, args: scale_registerHosts(n),
+    'tree': lambda n, args: scale_buildTree(n, args.max_children),
+    'enclaves': lambda n, args: scale_enclaves(n),
+    'enclave_threads': lambda n, args: scale_enclaves(n, True),
+    'asyncio': lambda n, args: scale_asyncio(n, args.max_children),
+}
+
+parser = argparse.ArgumentParser(
+    description='Measure simulator setup cost against simulation size')
+parser.add_argument('-n', '--sizes', metavar='N_HOSTS', nargs='+', type=int,
+                    default=[1000, 10000, 100000, 1000000], dest='sizes')
+parser.add_argument('-b', '--branch', metavar='BRANCH_FACTOR', default=32,
+                    dest='max_children', type=int, action='store')
+parser.add_argument('-s', '--stat', metavar='STAT', action='append',
+                    dest='stats', choices=list(scaling_stats),
+                    help=f"One of {list(scaling_stats)}")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    def br(s): return colored(str(s), 'green')
+    def res(s): return colored(str(s), 'blue')
+
+    for stat in (args.stats or list(scaling_stats)):
+        for n in args.sizes:
+            try:
+                seconds = scaling_stats[stat](n, args)
+            except RuntimeError as e:  # e.g. out of threads
+                print(f"{br('[')}{stat} @ {n} hosts: failed ({e}){br(']')}")
+                continue
+            extra = ""
+            if isinstance(seconds, tuple):  # Enclave stats: + peak threads
+                seconds, n_threads = seconds
+                extra = f", {res(n_threads)} threads at peak"
+            print(f"{br('[')}{stat} @ {n} hosts: {res(f'{seconds:.3f}')}s"
+                  f" ({res(f'{1e6 * seconds / n:.2f}')}us/host{extra}){br(']')}")
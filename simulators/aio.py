@@ -0,0 +1,69 @@
+import asyncio
+
+# asyncio runtime: a third way of running the simulator, alongside plain
+# synchronous callbacks and the discrete-event engine (simulators.events).
+# While aioRun() is driving a coroutine, every port of every NetworkHost gets
+# an asyncio.Queue: sent packets are put on the recipient's queue, and a pump
+# task per port (started when a packet arrives, finished once the queue is
+# empty) hands them to the port's handler, awaiting it if it's a coroutine.
+# Enclave
+# steps await asyncio.sleep instead of occupying a thread. A whole tree then
+# runs on one event loop in one OS thread, in wall-clock time.
+
+_loop = None
+_tasks = set()  # Strong references, since the event loop only keeps weak ones
+
+
+def aioEnabled() -> bool:
+    """ True while aioRun() is running. """
+    return _loop is not None
+
+
+def aioRun(main, *args):
+    """
+    Runs coroutine function MAIN(*ARGS) to completion on a new event loop,
+    with asyncio delivery switched on throughout. Returns its result.
+    """
+    async def body():
+        global _loop
+        _loop = asyncio.get_running_loop()
+        try:
+            return await main(*args)
+        finally:
+            _loop = None
+            _tasks.clear()
+    return asyncio.run(body())
+
+
+def aioSpawn(coroutine):
+    """ Starts COROUTINE as a task on the running loop. """
+    task = _loop.create_task(coroutine)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+def aioSchedule(delay: float, callback, *args):
+    """ Runs CALLBACK(*ARGS) on the loop DELAY seconds from now. """
+    _loop.call_later(delay, callback, *args)
+
+
+async def aioIdle():
+    """
+    Waits until every spawned task (port pumps, running enclaves...) has
+    finished, including any they spawn in turn.
+    """
+    while _tasks:
+        await asyncio.wait(set(_tasks))
+
+
+async def aioSteps(steps, callback_fn):
+    """
+    Drives a step generator like simulators.enclave's: sleeps for each delay
+    it yields, then passes its return value to CALLBACK_FN.
+    """
+    try:
+        while True:
+            await asyncio.sleep(next(steps))
+    except StopIteration as done:
+        callback_fn(done.value)
@@ -1,25 +1,106 @@
 import numpy as np
 import numpy.random as rand
 import threading
-from time import sleep
+from simulators.events import simEnabled, simSchedule, rtSchedule
+from simulators.aio import aioEnabled, aioSpawn, aioSteps
+
+
+class ProgramBatch:
+    """
+    Many programs sampled at once, stored CSR-style: each key is an int32
+    index into the shared KEYSPACE table, and program i's keys are
+    key_ids[offsets[i]:offsets[i + 1]]. Individual programs are
+    EnclavePrograms viewing the batch.
+    """
+
+    __slots__ = ('keyspace', 'work_factor', 'key_ids', 'offsets')
+
+    def __init__(self, keyspace, work_factor: float, key_ids, offsets):
+        self.keyspace = keyspace
+        self.work_factor = work_factor
+        self.key_ids = key_ids
+        self.offsets = offsets
+
+    @classmethod
+    def sample(cls, keyspace, n_programs: int, length_factor: float,
+               work_factor: float, rng=None, key_lo=0, key_hi=None):
+        """
+        Samples N_PROGRAMS programs, as EnclaveProgram would one at a time.
+        Program i only uses keys KEYSPACE[KEY_LO[i]:KEY_HI[i]]; each of
+        KEY_LO and KEY_HI may be a single index or one per program.
+        """
+        rng = rng if rng is not None else rand.default_rng()
+        key_hi = len(keyspace) if key_hi is None else key_hi
+        lengths = 1 + rng.geometric(p=(1 - length_factor), size=n_programs)
+        offsets = np.zeros(n_programs + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        key_ids = rng.integers(
+            np.repeat(np.broadcast_to(key_lo, n_programs), lengths),
+            np.repeat(np.broadcast_to(key_hi, n_programs), lengths),
+            dtype=np.int32)
+        return cls(keyspace, work_factor, key_ids, offsets)
+
+    @classmethod
+    def fromKeyIds(cls, keyspace, work_factor: float, lengths, key_ids):
+        """ Programs of LENGTHS[i] keys each, taken in order from KEY_IDS. """
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        assert offsets[-1] == len(key_ids), "Lengths don't match key ids"
+        return cls(keyspace, work_factor,
+                   np.asarray(key_ids, dtype=np.int32), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int):
+        return EnclaveProgram.view(self, i)
+
+    def __iter__(self):
+        return (EnclaveProgram.view(self, i) for i in range(len(self)))
 
 
 class EnclaveProgram:
+    """ A view of one program in a ProgramBatch. """
+
+    __slots__ = ('batch', 'index')
 
-    def __init__(self, keyspace, length_factor: float, work_factor: float):
+    def __init__(self, keyspace, length_factor: float, work_factor: float,
+                 rng=None):
         """
         Higher LENGTH_FACTOR => longer program sequences (range: 0-1)
         WORK_FACTOR => expected number of milliseconds spent executing each key
+        Keys are drawn from RNG, a numpy Generator (default: freshly seeded)
+        Use ProgramBatch.sample to generate many programs at once.
         """
-        self.keyspace = keyspace
-        self.work_factor = work_factor
-        self.keys = []
+        self.batch = ProgramBatch.sample(keyspace, 1, length_factor,
+                                         work_factor, rng)
+        self.index = 0
+
+    @classmethod
+    def view(cls, batch: ProgramBatch, index: int):
+        program = cls.__new__(cls)
+        program.batch = batch
+        program.index = index
+        return program
+
+    @property
+    def keyspace(self):
+        return self.batch.keyspace
+
+    @property
+    def work_factor(self):
+        return self.batch.work_factor
 
-        rng = rand.default_rng()
-        n_keys = 1 + rng.geometric(p=(1 - length_factor))
-        for _ in range(n_keys):
-            next_key = self.keyspace[rng.integers(0, len(keyspace))]
-            self.keys.append(next_key)
+    @property
+    def key_ids(self):
+        """ This program's keys, as indices into its keyspace. """
+        offsets = self.batch.offsets
+        return self.batch.key_ids[offsets[self.index]:offsets[self.index + 1]]
+
+    @property
+    def keys(self):
+        keyspace = self.batch.keyspace
+        return [keyspace[k] for k in self.key_ids.tolist()]
 
     def __repr__(self):
         return self.__str__()
@@ -28,9 +109,10 @@ class EnclaveProgram:
         return f"<Program: {self.keys}>"
 
 
-def enclaveExecute(program: EnclaveProgram, key_update_fn, callback_fn):
+def enclaveExecute(program: EnclaveProgram, key_update_fn, callback_fn,
+                   rng=None):
     """
-    Spawns a new thread to simulate the execution of the mock program PROGRAM.
+    Starts simulating the execution of the mock program PROGRAM.
     Each EnclaveProgram contains an ordered list of keys along with a 'work
     factor' which scales the execution time of executions of that program.
     'Executing' this program consists of iterating through the list of keys,
@@ -39,20 +121,46 @@ def enclaveExecute(program: EnclaveProgram, key_update_fn, callback_fn):
     MEMCACHE to a random value, then calling CALLBACK with the key as a
     parameter to let the parent Worker node know to propogate the key update
     throughout the multicast tree.
+    Nothing actually sleeps, and this function returns immediately: each key
+    step is scheduled on the virtual clock in discrete-event mode, awaited in
+    a task in asyncio mode (see simulators.aio), and run on the shared
+    wall-clock timer threads otherwise (see simulators.events).
+    Execution times are drawn from RNG, a numpy Generator (default: freshly
+    seeded).
+    """
+
+    steps = _enclaveSteps(program, key_update_fn, rng)
+    if aioEnabled():
+        aioSpawn(aioSteps(steps, callback_fn))
+        return
+    schedule = simSchedule if simEnabled() else rtSchedule
+
+    def step():
+        try:
+            schedule(next(steps), step)
+        except StopIteration as done:
+            callback_fn(done.value)
+    step()
+
+
+def _enclaveSteps(program: EnclaveProgram, key_update_fn, rng=None):
+    """
+    Generator implementing the body of enclaveExecute. Yields the time to spend
+    on each key before it is updated; resuming it performs that update.
+    The program's result is returned when the generator is exhausted.
     """
 
     base_sleep = 0.01  # 1ms
-    sleep_rng = rand.default_rng()
-    value_rng = rand.default_rng()
+    rng = rng if rng is not None else rand.default_rng()
     result = 0
 
     prev_value = 0
     for key in program.keys:
-        sleep(base_sleep * sleep_rng.exponential(1 / program.work_factor))
-        new_value = value_rng.integers(-65536, 65536)  # not inclusive
+        yield base_sleep * rng.exponential(1 / program.work_factor)
+        new_value = rng.integers(-65536, 65536)  # not inclusive
         new_value = hash(key)
         result //= 2
         result += new_value
         key_update_fn(key, prev_value, program)
         prev_value = new_value
-    callback_fn(result)
+    return result
@@ -0,0 +1,144 @@
+import heapq
+import os
+import threading
+import traceback
+from itertools import count
+from time import monotonic
+
+# A minimal discrete-event engine. When enabled, anything that would otherwise
+# sleep (enclave key steps, task arrivals, packet delivery) is instead queued as
+# a callback against a virtual clock, and simRun() drains the queue in
+# timestamp order. Nothing ever actually waits, so a run takes only as long as
+# it takes the CPU to process its events.
+# When disabled, simNow() falls back to the wall clock so that timestamps taken
+# by the rest of the simulator remain meaningful, and rtSchedule() stands in
+# for simSchedule(): see the end of this file.
+
+_events = []
+_event_seq = count()  # Tie-breaker: equal-time events run in FIFO order
+_now = 0.0
+_enabled = False
+
+
+def simEnable(enabled: bool = True):
+    """ Switches discrete-event (virtual clock) mode on or off. """
+    global _enabled
+    _enabled = enabled
+
+
+def simEnabled() -> bool:
+    return _enabled
+
+
+def simNow() -> float:
+    """
+    Returns the current simulated time, in seconds, if discrete-event mode is
+    enabled; otherwise returns the (monotonic) wall-clock time.
+    """
+    if _enabled:
+        return _now
+    return monotonic()
+
+
+def simSchedule(delay: float, callback, *args):
+    """
+    Queues CALLBACK(*ARGS) to be run DELAY simulated seconds from now.
+    Only valid in discrete-event mode.
+    """
+    assert _enabled, "simSchedule requires discrete-event mode"
+    assert delay >= 0, f"Cannot schedule an event in the past: {delay}"
+    heapq.heappush(_events, (_now + delay, next(_event_seq), callback, args))
+
+
+def simRun(until: float = None) -> float:
+    """
+    Runs queued events in timestamp order until the queue is empty, or until
+    the next event would occur after UNTIL (if given).
+    Returns the simulated time at which the run stopped.
+    """
+    global _now
+    while _events:
+        if until is not None and _events[0][0] > until:
+            _now = until
+            break
+        t, _, callback, args = heapq.heappop(_events)
+        _now = t
+        callback(*args)
+    return _now
+
+
+def simStep() -> bool:
+    """ Runs the next queued event, if any. Returns whether there was one. """
+    global _now
+    if not _events:
+        return False
+    _now, _, callback, args = heapq.heappop(_events)
+    callback(*args)
+    return True
+
+
+def simPending() -> int:
+    """ Returns the number of events still waiting to run. """
+    return len(_events)
+
+
+def simReset():
+    """ Drops all pending events and rewinds the virtual clock to zero. """
+    global _events
+    global _event_seq
+    global _now
+
+    _events = []
+    _event_seq = count()
+    _now = 0.0
+
+
+# Wall-clock timers. Rather than every sleeping activity (e.g. each running
+# enclave program) getting a thread of its own, callbacks are queued by due
+# time and run by a fixed pool of RT_THREADS threads, started as needed.
+# Callbacks should be short and must not sleep: anything that needs to wait
+# schedules its continuation instead.
+
+RT_THREADS = min(32, (os.cpu_count() or 1) + 4)
+
+_rt_timers = []
+_rt_timer_seq = count()
+_rt_cond = threading.Condition()
+_rt_threads = []
+
+
+def rtSchedule(delay: float, callback, *args):
+    """
+    Runs CALLBACK(*ARGS) on a timer thread DELAY wall-clock seconds from now.
+    Callbacks due at the same time run in FIFO order, although with several
+    timer threads they may overlap.
+    """
+    assert delay >= 0, f"Cannot schedule a timer in the past: {delay}"
+    with _rt_cond:
+        heapq.heappush(_rt_timers,
+                       (monotonic() + delay, next(_rt_timer_seq), callback, args))
+        if len(_rt_threads) < RT_THREADS:
+            thread = threading.Thread(target=_rtRun, daemon=True,
+                                      name=f"rt-timer-{len(_rt_threads)}")
+            _rt_threads.append(thread)
+            thread.start()
+        _rt_cond.notify()
+
+
+def rtPending() -> int:
+    """ Returns the number of timers yet to fire. """
+    return len(_rt_timers)
+
+
+def _rtRun():
+    """ Body of each timer thread: run timers as they come due, forever. """
+    while True:
+        with _rt_cond:
+            while not _rt_timers or _rt_timers[0][0] > monotonic():
+                _rt_cond.wait(_rt_timers[0][0] - monotonic()
+                              if _rt_timers else None)
+            _, _, callback, args = heapq.heappop(_rt_timers)
+        try:
+            callback(*args)
+        except Exception:
+            traceback.print_exc()
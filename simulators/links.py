@@ -0,0 +1,183 @@
+import numpy.random as rand
+from simulators.network import IpAddr, Packet
+
+# Link models decide how long a packet spends on the wire between two hosts.
+# Each hop costs
+#   queueing      waiting for earlier packets on the same link to finish sending
+#   serialization packet size / link bandwidth
+#   propagation   the link's latency
+# Links are directional and (like the rest of the network) point-to-point
+# between every pair of hosts. Only used in discrete-event mode: see
+# simulators.events and netReset.
+
+HEADER_BYTES = 64  # Rough IP + transport + our own framing
+FIELD_BYTES = 8
+
+
+def packetBytes(p: Packet) -> int:
+    """ Estimated on-the-wire size of P, in bytes. """
+    payload = p.payload
+    if isinstance(payload, str):
+        return HEADER_BYTES + len(payload)
+    if not isinstance(payload, dict):
+        return HEADER_BYTES
+    n_bytes = HEADER_BYTES + FIELD_BYTES * len(payload)
+    if 'program' in payload:
+        n_bytes += FIELD_BYTES * len(payload['program'].keys)
+    if 'programs' in payload:  # One uid + its keys per batched task
+        n_bytes += FIELD_BYTES * sum(1 + len(program.keys)
+                                     for program in payload['programs'])
+    if 'updates' in payload:  # Combined KeyUpdates
+        n_bytes += sum(FIELD_BYTES * len(update)
+                       for update in payload['updates'])
+    return n_bytes
+
+
+class LinkModel:
+    """
+    Base class: zero latency and unlimited bandwidth, i.e. the same network
+    as having no link model at all. Subclasses override latency() and/or
+    bandwidth().
+    """
+
+    def __init__(self):
+        self._link_free_at = {}  # (src, dst) => when its backlog will clear
+
+    def latency(self, src: IpAddr, dst: IpAddr) -> float:
+        """ One-way propagation delay from SRC to DST, in seconds. """
+        return 0.0
+
+    def bandwidth(self, src: IpAddr, dst: IpAddr) -> float:
+        """ Link capacity from SRC to DST in bytes/sec, or None if unlimited. """
+        return None
+
+    def limitsBandwidth(self) -> bool:
+        """ Whether any link's bandwidth is limited, so packets can queue. """
+        return False
+
+    def transmit(self, p: Packet, now: float) -> float:
+        """
+        Puts P on the link from its source to its destination at time NOW,
+        returning how long until it arrives. Later packets on the same link
+        queue up behind it.
+        """
+        if p.src == p.dst:
+            return 0.0
+        bw = self.bandwidth(p.src, p.dst)
+        if not bw:
+            return self.latency(p.src, p.dst)
+        link = (p.src, p.dst)
+        start = max(now, self._link_free_at.get(link, now))
+        done = start + packetBytes(p) / bw
+        self._link_free_at[link] = done
+        return (done - now) + self.latency(p.src, p.dst)
+
+    def seed(self, seed_seq):
+        """
+        Redraws any randomness in this model from SEED_SEQ, a numpy
+        SeedSequence. Nothing to do unless the model is random.
+        """
+        pass
+
+
+class UniformLinks(LinkModel):
+    """ Every link has the same LATENCY and BANDWIDTH. """
+
+    def __init__(self, latency: float = 0.0, bandwidth: float = None):
+        super().__init__()
+        self._latency = latency
+        self._bandwidth = bandwidth
+
+    def latency(self, src: IpAddr, dst: IpAddr) -> float:
+        return self._latency
+
+    def bandwidth(self, src: IpAddr, dst: IpAddr) -> float:
+        return self._bandwidth
+
+    def limitsBandwidth(self) -> bool:
+        return bool(self._bandwidth)
+
+
+class SubnetLinks(LinkModel):
+    """
+    Each host's access link is described by the longest matching prefix in
+    SUBNETS, a dict of address prefix (e.g. "90" or "80.0") => (latency,
+    bandwidth); hosts matching no prefix use DEFAULT. A hop's latency is the
+    sum of both ends' latencies, and its bandwidth is the smaller of the two.
+    """
+
+    def __init__(self, subnets: dict, default=(0.0, None)):
+        super().__init__()
+        self.subnets = subnets
+        self.default = default
+        self._host_links = {}  # IpAddr => (latency, bandwidth)
+
+    def latency(self, src: IpAddr, dst: IpAddr) -> float:
+        return self._hostLink(src)[0] + self._hostLink(dst)[0]
+
+    def bandwidth(self, src: IpAddr, dst: IpAddr) -> float:
+        bws = [bw for bw in (self._hostLink(src)[1], self._hostLink(dst)[1])
+               if bw]
+        return min(bws) if bws else None
+
+    def limitsBandwidth(self) -> bool:
+        return any(bw for _, bw in [self.default, *self.subnets.values()])
+
+    def _hostLink(self, ip: IpAddr):
+        if ip not in self._host_links:
+            octets = ip.split('.')
+            self._host_links[ip] = self.default
+            for n in range(len(octets), 0, -1):
+                prefix = ".".join(octets[:n])
+                if prefix in self.subnets:
+                    self._host_links[ip] = self.subnets[prefix]
+                    break
+        return self._host_links[ip]
+
+
+class RandomLinks(LinkModel):
+    """
+    Each link's latency is drawn (once, when first used) from an exponential
+    distribution with mean MEAN_LATENCY, plus MIN_LATENCY; bandwidth is
+    uniform. Latencies are symmetric: A => B is the same as B => A.
+    """
+
+    def __init__(self, mean_latency: float, min_latency: float = 0.0,
+                 bandwidth: float = None, rng=None):
+        super().__init__()
+        self.mean_latency = mean_latency
+        self.min_latency = min_latency
+        self._bandwidth = bandwidth
+        self._rng = rng if rng is not None else rand.default_rng()
+        self._latencies = {}  # (IpAddr, IpAddr), in sorted order => latency
+
+    def latency(self, src: IpAddr, dst: IpAddr) -> float:
+        link = (src, dst) if src < dst else (dst, src)
+        if link not in self._latencies:
+            self._latencies[link] = self.min_latency\
+                + self._rng.exponential(self.mean_latency)
+        return self._latencies[link]
+
+    def bandwidth(self, src: IpAddr, dst: IpAddr) -> float:
+        return self._bandwidth
+
+    def limitsBandwidth(self) -> bool:
+        return bool(self._bandwidth)
+
+    def seed(self, seed_seq):
+        self._rng = rand.default_rng(seed_seq)
+        self._latencies = {}
+
+
+# 'subnet' puts the coordinator (73.*) and routers (80.*) on a core network,
+# with hops between them costing LATENCY and unlimited bandwidth, and workers
+# (90.*) on slower edge links: 1.5 x LATENCY a hop, capped at BANDWIDTH
+link_profiles = {
+    'uniform': lambda latency, bandwidth:
+        UniformLinks(latency, bandwidth),
+    'random': lambda latency, bandwidth:
+        RandomLinks(latency, bandwidth=bandwidth),
+    'subnet': lambda latency, bandwidth:
+        SubnetLinks({'73': (latency / 2, None), '80': (latency / 2, None),
+                     '90': (latency, bandwidth)}),
+}
@@ -1,7 +1,13 @@
+import asyncio
+from collections import deque
+from inspect import isawaitable
 from itertools import count
-from datetime import datetime
+from threading import Lock
 import typing
 from pprint import pprint
+import numpy as np
+from simulators.events import simEnabled, simNow, simSchedule
+from simulators.aio import aioEnabled, aioSpawn
 
 # We abstract away all protocols which are necessary only due to the
 # *decentralized* nature of the internet: BGP, ARP, TCP, DNS, etc. IP remains,
@@ -22,7 +28,7 @@ class Packet:
         self.src_port = src_port
         self.dst_port = dst_port
         self.payload = payload
-        self.time = datetime.now()
+        self.time = simNow()
 
     def __str__(self):
         return (f"Packet: "
@@ -41,11 +47,13 @@ class NetworkHost:
     def __init__(self, ip: IpAddr = None):
         self.local_ports = {}
         self.port_buffers = {}
+        self.port_queues = {}  # asyncio mode only: see simulators.aio
+        self._pumping = set()  # Ports whose queue is being drained
         if ip is None:
             self.ip = _registerHost(self)
         else:
             self.ip = _registerHost(self, ip)
-            assert ip, "Failed to register host!"
+        assert self.ip, "Failed to register host!"
 
     def openPort(self, callback, port: int) -> bool:
         """
@@ -63,6 +71,16 @@ class NetworkHost:
         """If port is open, frees it."""
         self.local_ports.pop(port, None)
         self.port_buffers.pop(port, None)
+        self.port_queues.pop(port, None)
+
+    def disconnect(self):
+        """
+        Closes all ports and takes this host off the network, releasing its
+        address for reuse.
+        """
+        for port in list(self.local_ports):
+            self.closePort(port)
+        _unregisterHost(self.ip)
 
     def sendPacket(self, packet: Packet) -> bool:
         """
@@ -117,12 +135,218 @@ class NetworkHost:
             return True
         return False
 
+    async def recvPacketAsync(self, p: Packet) -> bool:
+        """ As recvPacket, but awaits the handler if it's a coroutine. """
+        port = p.dst_port
+        if port in self.local_ports:
+            self.port_buffers[port] = p
+            result = self.local_ports[port](port)
+            if isawaitable(result):
+                await result
+            return True
+        return False
+
+    def queuePacket(self, p: Packet):
+        """
+        asyncio mode: puts P on its port's queue, starting a task to pump the
+        queue if there isn't one already.
+        """
+        port = p.dst_port
+        queue = self.port_queues.get(port)
+        if queue is None:
+            queue = self.port_queues[port] = asyncio.Queue()
+        queue.put_nowait(p)
+        if port not in self._pumping:
+            self._pumping.add(port)
+            aioSpawn(self._pumpPort(port, queue))
+
+    async def _pumpPort(self, port: int, queue: asyncio.Queue):
+        try:
+            while not queue.empty():
+                p = queue.get_nowait()
+                if not await self.recvPacketAsync(p):
+                    _logged_failures.append(("Port closed", p))
+        finally:
+            self._pumping.discard(port)
+
     def ping(self, dst: IpAddr) -> (bool, float):
         """
         The first parameter returned is True iff DST is online and reachable.
         If so, the second the round-trip time, in seconds, to DST.
         """
-        _calcNetworkDistance(self.ip, dst) + _calcNetworkDistance(dst, self.ip)
+        if _route(self.ip, dst) is None:
+            return (False, None)
+        return (True, _calcNetworkDistance(self.ip, dst)
+                      + _calcNetworkDistance(dst, self.ip))
+
+
+class PacketLog:
+    """
+    Append-only record of every packet delivered, stored column-wise in NumPy
+    arrays which double in size as needed. Addresses and message types are
+    interned to small integer ids; payloads themselves are not kept.
+    Iterating over (or indexing) the log rebuilds Packets whose payload is just
+    the message type, for debugging.
+    """
+
+    _columns = (('src', np.int32), ('dst', np.int32),
+                ('src_port', np.int32), ('dst_port', np.int32),
+                ('msg_type', np.int16), ('time', np.float64))
+
+    def __init__(self, capacity: int = 1024):
+        self._n = 0
+        self._n_dropped = 0
+        self._lock = Lock()
+        self._cols = {name: np.empty(capacity, dtype=dtype)
+                      for name, dtype in self._columns}
+        self._ip_ids = {}  # IpAddr => interned id
+        self._ips = []
+        self._type_ids = {}  # Message type => interned id
+        self._types = []
+
+    def __len__(self):
+        return self._n - self._n_dropped
+
+    def __repr__(self):
+        return f"<PacketLog: {len(self)} packets>"
+
+    def __getitem__(self, i: int) -> Packet:
+        if not self._n_dropped:
+            return self._packetAt(range(self._n)[i])
+        return self._packetAt(self._rows()[i])
+
+    def __iter__(self):
+        rows = self._rows()
+        if isinstance(rows, slice):
+            rows = range(self._n)
+        for row in rows:
+            yield self._packetAt(row)
+
+    def append(self, p: Packet) -> int:
+        """ Logs P, returning its row number (for rollback). """
+        with self._lock:
+            row = self._n
+            if row == len(self._cols['src']):
+                for name in self._cols:
+                    self._cols[name] = np.resize(self._cols[name], 2 * row)
+            self._cols['src'][row] = self._intern(p.src)
+            self._cols['dst'][row] = self._intern(p.dst)
+            self._cols['src_port'][row] = p.src_port
+            self._cols['dst_port'][row] = p.dst_port
+            self._cols['msg_type'][row] = self._internType(p.payload)
+            self._cols['time'][row] = p.time
+            self._n += 1
+            return row
+
+    def rollback(self, row: int):
+        """
+        Un-logs the packet at ROW. O(1): if other packets have been logged
+        since, the row is only marked as dropped.
+        """
+        with self._lock:
+            if row == self._n - 1:
+                self._n -= 1
+            else:
+                self._cols['src'][row] = -1
+                self._n_dropped += 1
+
+    def column(self, name: str) -> np.ndarray:
+        """ The named column (see PacketLog._columns), one entry per packet. """
+        return self._cols[name][self._rows()]
+
+    def ipId(self, ip: IpAddr) -> int:
+        """ The id IP is interned as in the src/dst columns, or -1. """
+        return self._ip_ids.get(ip, -1)
+
+    def countInvolving(self, ip: IpAddr) -> int:
+        """ Number of packets sent from and/or to IP. """
+        ip_id = self.ipId(ip)
+        if ip_id < 0:
+            return 0
+        return int(np.count_nonzero((self.column('src') == ip_id)
+                                    | (self.column('dst') == ip_id)))
+
+    def hostCounts(self) -> dict:
+        """
+        Maps each address to the number of packets it sent plus the number it
+        received (so a packet to oneself counts twice).
+        """
+        counts = np.bincount(self.column('src'), minlength=len(self._ips))\
+               + np.bincount(self.column('dst'), minlength=len(self._ips))
+        return {ip: int(counts[i]) for i, ip in enumerate(self._ips)
+                if counts[i]}
+
+    def _packetAt(self, row: int) -> Packet:
+        p = Packet(self._types[self._cols['msg_type'][row]],
+                   self._ips[self._cols['src'][row]],
+                   int(self._cols['src_port'][row]),
+                   self._ips[self._cols['dst'][row]],
+                   int(self._cols['dst_port'][row]))
+        p.time = float(self._cols['time'][row])
+        return p
+
+    def _rows(self):
+        if not self._n_dropped:
+            return slice(0, self._n)
+        return np.flatnonzero(self._cols['src'][:self._n] >= 0)
+
+    def _intern(self, ip: IpAddr) -> int:
+        ip_id = self._ip_ids.get(ip)
+        if ip_id is None:
+            ip_id = self._ip_ids[ip] = len(self._ips)
+            self._ips.append(ip)
+        return ip_id
+
+    def _internType(self, payload) -> int:
+        msg_type = payload.get('type') if isinstance(payload, dict) else None
+        type_id = self._type_ids.get(msg_type)
+        if type_id is None:
+            type_id = self._type_ids[msg_type] = len(self._types)
+            self._types.append(msg_type)
+        return type_id
+
+
+class TrafficStats:
+    """
+    Running packet counts, updated as each packet is sent, so that metrics can
+    be read off in time proportional to the number of hosts rather than the
+    number of packets. Kept whether or not packets are being logged.
+    """
+
+    def __init__(self):
+        self.n_packets = 0
+        self.sent = {}  # IpAddr => # packets sent
+        self.received = {}  # IpAddr => # packets received
+        self.to_self = {}  # IpAddr => # packets both sent and received
+        self.ports = {}  # (IpAddr, port) => # packets sent or received on it
+        self.msg_types = {}  # Message type => # packets
+        self._lock = Lock()
+
+    def record(self, p: Packet, n: int = 1):
+        """ Counts P (N times; pass -1 to un-count it). """
+        msg_type = p.payload.get('type') if isinstance(p.payload, dict) else None
+        with self._lock:
+            self.n_packets += n
+            self.sent[p.src] = self.sent.get(p.src, 0) + n
+            self.received[p.dst] = self.received.get(p.dst, 0) + n
+            if p.src == p.dst:
+                self.to_self[p.src] = self.to_self.get(p.src, 0) + n
+            src_port = (p.src, p.src_port)
+            dst_port = (p.dst, p.dst_port)
+            self.ports[src_port] = self.ports.get(src_port, 0) + n
+            self.ports[dst_port] = self.ports.get(dst_port, 0) + n
+            self.msg_types[msg_type] = self.msg_types.get(msg_type, 0) + n
+
+    def involving(self, ip: IpAddr) -> int:
+        """ Number of packets sent from and/or to IP. """
+        return self.throughput(ip) - self.to_self.get(ip, 0)
+
+    def throughput(self, ip: IpAddr) -> int:
+        """
+        Number of packets sent by IP plus number received (so a packet to
+        oneself counts twice, as it passes through both ends).
+        """
+        return self.sent.get(ip, 0) + self.received.get(ip, 0)
 
 
 def simpleSockListener(host: NetworkHost, callback):
@@ -135,8 +359,18 @@ def simpleSockListener(host: NetworkHost, callback):
 
 _ip_map = {}
 _reserved_ips = [loopback_ip]
-_logged_packets = []
+_subnets = {}  # Prefix => _SubnetAllocator
+_logged_packets = PacketLog()  # None if logging is off
 _logged_failures = []
+_traffic = TrafficStats()
+
+# Queued delivery: see _dispatchPackets
+_queued_delivery = False
+_delivery_queue = deque()
+_dispatching = False
+_dispatch_lock = Lock()
+
+_link_model = None  # See simulators.links
 
 
 def getNetworkDebugInfo():
@@ -144,23 +378,88 @@ def getNetworkDebugInfo():
     return (_ip_map, _logged_packets, _logged_failures)
 
 
-def netReset():
-    """ Resets the network state to its base (empty) configuration. """
+def getTrafficStats() -> TrafficStats:
+    """ Returns the running packet counts since the last netReset. """
+    return _traffic
+
+
+def netReset(log_packets: bool = True, queued_delivery: bool = False,
+             link_model=None):
+    """
+    Resets the network state to its base (empty) configuration.
+    If LOG_PACKETS is False, sent packets are only counted (see TrafficStats),
+    not logged individually.
+    If QUEUED_DELIVERY is True, sent packets go onto a network-wide FIFO
+    rather than being handed straight to the recipient (see _dispatchPackets).
+    LINK_MODEL (see simulators.links) sets the latency and bandwidth of every
+    link; it is only applied in discrete-event mode.
+    """
     global _ip_map
     global _reserved_ips
+    global _subnets
     global _logged_packets
     global _logged_failures
+    global _traffic
+    global _queued_delivery
+    global _delivery_queue
+    global _link_model
 
     _ip_map = {}
     _reserved_ips = [loopback_ip]
-    _logged_packets = []
+    _subnets = {}
+    _logged_packets = PacketLog() if log_packets else None
     _logged_failures = []
+    _traffic = TrafficStats()
+    _queued_delivery = queued_delivery
+    _delivery_queue = deque()
+    _link_model = link_model
 
 
 def _calcNetworkDistance(src: IpAddr, dst: IpAddr):
-    if (src == dst) or (dst == loopback and _route(src, dst)):
+    """ One-way propagation delay from SRC to DST, in seconds. """
+    if (src == dst) or (dst == loopback_ip and _route(src, dst)):
+        return 0
+    if _link_model is None:
         return 0
-    return 0  # TODO at some point
+    return _link_model.latency(src, dst)
+
+
+class _SubnetAllocator:
+    """
+    Hands out the addresses under a prefix (e.g. "90.0") in ascending order,
+    preferring addresses freed by departed hosts. Both are amortized O(1):
+    addresses registered explicitly by other means are skipped over lazily.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.n_free_octets = 4 - len(prefix.split('.'))
+        assert 0 < self.n_free_octets < 4, f"Bad address prefix {prefix}"
+        self.capacity = 256 ** self.n_free_octets
+        self.cursor = 0  # Every address below this has been handed out
+        self.free = []  # Released addresses, possibly since re-taken
+
+    def allocate(self) -> IpAddr:
+        while self.free:
+            ip = self.free.pop()
+            if ip not in _ip_map:
+                return ip
+        while self.cursor < self.capacity:
+            ip = self._addrAt(self.cursor)
+            self.cursor += 1
+            if (ip not in _ip_map) and (ip not in _reserved_ips):
+                return ip
+        return None
+
+    def release(self, ip: IpAddr):
+        self.free.append(ip)
+
+    def _addrAt(self, idx: int) -> IpAddr:
+        octets = []
+        for _ in range(self.n_free_octets):
+            octets.append(str(idx % 256))
+            idx //= 256
+        return self.prefix + "." + ".".join(reversed(octets))
 
 
 def _registerHost(host: NetworkHost, ip: IpAddr = None) -> IpAddr:
@@ -175,40 +474,30 @@ def _registerHost(host: NetworkHost, ip: IpAddr = None) -> IpAddr:
 
     if ip is None:
         ip = "192.168"
-        # for c in range(1, 256): # Giga lazy brute force
-        #    for d in range(1, 256):
-        #        ip = "192.168." + str(c) + "." + str(d)
-        #        if ip not in _ip_map:
-        #            _ip_map[ip] = host
-        #            return ip
-        # return None
     if (ip in _ip_map) or (ip in _reserved_ips):
         return None
+    if len(ip.split('.')) == 4:
+        addr = ip
     else:
-        addr = ""
-        octets = ip.split('.')
-        # Look it was late, I know how to do this in Haskell
-        if len(octets) == 4:
-            addr = ip
-        elif len(octets) == 3:
-            for d in range(0, 256):
-                new_ip = ip + "." + str(d)
-                if new_ip not in _ip_map:
-                    addr = new_ip
-                    break
-        elif len(octets) == 2:
-            for c in range(0, 256):  # Giga lazy brute force
-                for d in range(0, 256):
-                    new_ip = ip + "." + str(c) + "." + str(d)
-                    if new_ip not in _ip_map:
-                        addr = new_ip
-                        break
-                if addr != "":
-                    break
-        else:
-            assert False, "I'll redo this whole thing later"
-        _ip_map[addr] = host
-        return addr
+        if ip not in _subnets:
+            _subnets[ip] = _SubnetAllocator(ip)
+        addr = _subnets[ip].allocate()
+        if addr is None:
+            return None  # Subnet is full
+    _ip_map[addr] = host
+    return addr
+
+
+def _unregisterHost(ip: IpAddr):
+    """ Removes the host at IP from the network, freeing its address. """
+    if _ip_map.pop(ip, None) is None:
+        return
+    # Any subnet this address could have come from may hand it out again
+    octets = ip.split('.')
+    for n in range(1, 4):
+        prefix = ".".join(octets[:n])
+        if prefix in _subnets:
+            _subnets[prefix].release(ip)
 
 
 def _route(src: IpAddr, dst: IpAddr) -> NetworkHost:
@@ -229,20 +518,87 @@ def _sendPacket(p: Packet) -> bool:
     Tries to send packet via network. May fail (e.g. if recipient DNE).
     Returns false only if recipient address is not bound or if recipient
     at given address does not have a port open.
+    In discrete-event mode the packet is delivered by a scheduled event rather
+    than synchronously, with queued delivery it is put on the delivery queue,
+    and in asyncio mode on its port's queue; in all three the send succeeds
+    iff the port is open right now.
     """
-    # TODO build in network delays?
     target_host = _route(p.src, p.dst)
 
-    if target_host:
+    if target_host and (simEnabled() or _queued_delivery or aioEnabled()):
+        if p.dst_port in target_host.local_ports:
+            _logPacket(p)
+            if simEnabled():
+                delay = 0
+                if _link_model is not None and target_host is not _ip_map[p.src]:
+                    delay = _link_model.transmit(p, simNow())
+                simSchedule(delay, _deliverPacket, target_host, p)
+            elif aioEnabled():
+                target_host.queuePacket(p)
+            else:
+                _delivery_queue.append((target_host, p))
+                _dispatchPackets()
+            return True
+        _logged_failures.append(("Port closed", p))
+    elif target_host:
         # Since recvPacket is blocking right now, we optimistically log the
         # packet and remove it if the send fails, preventing the stack of packet
         # log messages from landing on the log in reverse order.
-        _logged_packets.append(p)  # Since recvPacket is blocking, we
+        row = _logPacket(p)  # Since recvPacket is blocking, we
         if target_host.recvPacket(p):
             return True
         else:
-            _logged_packets.remove(p)
+            _unlogPacket(p, row)
             _logged_failures.append(("Port closed", p))
     else:
         _logged_failures.append(("Routing failed", p))
     return False
+
+
+def _dispatchPackets():
+    """
+    Delivers queued packets in FIFO order until the queue is empty. Handlers
+    which send packets of their own just add to the queue, and return to the
+    loop here; only the outermost send on the stack (and only one thread at a
+    time) dispatches. Stack depth therefore stays constant however many hops a
+    packet takes, and packets from concurrent multicasts are interleaved
+    breadth-first.
+    """
+    global _dispatching
+    with _dispatch_lock:
+        if _dispatching:
+            return  # Whoever is dispatching will get to our packet
+        _dispatching = True
+    try:
+        while True:
+            with _dispatch_lock:
+                if not _delivery_queue:
+                    _dispatching = False
+                    return
+                target_host, p = _delivery_queue.popleft()
+            _deliverPacket(target_host, p)
+    except BaseException:
+        with _dispatch_lock:
+            _dispatching = False
+        raise
+
+
+def _logPacket(p: Packet) -> int:
+    """ Counts and (if enabled) logs P. Returns its log row, if any. """
+    _traffic.record(p)
+    if _logged_packets is not None:
+        return _logged_packets.append(p)
+    return None
+
+
+def _unlogPacket(p: Packet, row: int):
+    """ Undoes _logPacket, for sends which turn out to have failed. """
+    _traffic.record(p, -1)
+    if row is not None:
+        _logged_packets.rollback(row)
+
+
+def _deliverPacket(target_host: NetworkHost, p: Packet):
+    """ Event callback: hands a packet in flight to its recipient. """
+    if not target_host.recvPacket(p):
+        _logged_failures.append(("Port closed", p))
@@ -0,0 +1,204 @@
+import threading
+import numpy as np
+import numpy.random as rand
+from simulators.events import simEnabled, simNow, simSchedule, rtSchedule
+
+# Load generators decide *when* tasks are submitted to a Coordinator, so that
+# the offered load is set by the experiment rather than by how fast the host
+# machine happens to run bench()'s submission loop.
+#   OpenLoop    tasks arrive at a target rate (tasks/sec), regardless of how
+#               quickly earlier ones complete: Poisson or evenly spaced
+#   ClosedLoop  N clients each submit a task, wait for its result, think for
+#               a while, and repeat
+# An open loop's rate may vary over time: see StepProfile and RampProfile,
+# plain classes so that (unlike closures) they pickle for util.sweep's pool.
+# Generators run on the virtual clock in discrete-event mode and on the shared
+# timer threads otherwise; loadReport() summarises how a run went.
+
+
+class LoadGenerator:
+    """
+    Base class. Stops submitting when its tasks run out or, if DURATION is
+    set, DURATION seconds after starting. Random choices are drawn from RNG.
+    """
+
+    def __init__(self, duration: float = None, rng=None):
+        self.duration = duration
+        self.rng = rng
+
+    def seed(self, seed_seq):
+        """ Draws this generator's randomness from SEED_SEQ from now on. """
+        self.rng = rand.default_rng(seed_seq)
+
+    def start(self, coord, tasks):
+        """
+        Begins submitting TASKS (an iterable of UserTasks) to COORD, and
+        returns immediately.
+        """
+        if self.rng is None:
+            self.rng = rand.default_rng()
+        self.n_submitted = 0
+        self.n_finished = 0
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._exhausted = False
+        self.coord = coord
+        self._tasks = iter(tasks)
+        self.start_time = simNow()
+        self._begin()
+
+    def wait(self):
+        """ Blocks until every task has been submitted and has finished. """
+        if not simEnabled():
+            self._done.wait()
+
+    def _begin(self):
+        raise NotImplementedError
+
+    def _elapsed(self) -> float:
+        return simNow() - self.start_time
+
+    def _submit(self, on_finish=None):
+        """
+        Submits the next task, which will call ON_FINISH(task) when done.
+        Returns the task, or None (and submits nothing) if there are no more
+        to submit.
+        """
+        task = None
+        if self.duration is None or self._elapsed() < self.duration:
+            task = next(self._tasks, None)
+        with self._lock:
+            if task is None:
+                self._exhausted = True
+                self._checkDone()
+                return None
+            self.n_submitted += 1
+
+        def finished(task):
+            with self._lock:
+                self.n_finished += 1
+                self._checkDone()
+            if on_finish:
+                on_finish(task)
+        task.on_finish = finished
+        # Never wait on the coordinator's in-flight window: we may be on a
+        # timer thread, which mustn't block (see simulators.events)
+        self.coord.submitUserTask(task, block=False)
+        return task
+
+    def _checkDone(self):
+        if self._exhausted and self.n_finished == self.n_submitted:
+            self._done.set()
+
+    @staticmethod
+    def _schedule(delay: float, callback, *args):
+        (simSchedule if simEnabled() else rtSchedule)(delay, callback, *args)
+
+
+class OpenLoop(LoadGenerator):
+    """
+    Submits tasks at RATE tasks/sec: either a number, or a function of the
+    seconds elapsed since the start (see StepProfile and RampProfile).
+    Gaps between arrivals are exponential if POISSON, otherwise constant.
+    """
+
+    def __init__(self, rate, poisson: bool = True, duration: float = None,
+                 rng=None):
+        super().__init__(duration, rng)
+        self.rate = rate
+        self.poisson = poisson
+
+    def _begin(self):
+        self._arrive()
+
+    def _arrive(self):
+        if self._submit() is None:
+            return
+        rate = self.rate(self._elapsed()) if callable(self.rate) else self.rate
+        assert rate > 0, f"Arrival rate must be positive, not {rate}"
+        gap = self.rng.exponential(1 / rate) if self.poisson else 1 / rate
+        self._schedule(gap, self._arrive)
+
+
+class ClosedLoop(LoadGenerator):
+    """
+    N_CLIENTS clients, each with at most one task outstanding, wait THINK_TIME
+    seconds (on average, if EXPONENTIAL) after each result before submitting
+    their next task.
+    """
+
+    def __init__(self, n_clients: int, think_time: float = 0.0,
+                 exponential: bool = True, duration: float = None, rng=None):
+        super().__init__(duration, rng)
+        self.n_clients = n_clients
+        self.think_time = think_time
+        self.exponential = exponential
+
+    def _begin(self):
+        for _ in range(self.n_clients):
+            self._client()
+
+    def _client(self, *_):
+        self._submit(on_finish=self._think)
+
+    def _think(self, task):
+        think = self.think_time
+        if self.exponential and think > 0:
+            think = self.rng.exponential(think)
+        self._schedule(think, self._client)
+
+
+class StepProfile:
+    """
+    Rate profile for OpenLoop: STEPS is a list of (start time, rate) pairs in
+    time order, each rate holding until the next step begins.
+    """
+
+    def __init__(self, steps):
+        self.steps = [(t, r) for t, r in steps]
+
+    def __call__(self, t: float) -> float:
+        starts = [start for start, _ in self.steps]
+        i = max(0, np.searchsorted(starts, t, 'right') - 1)
+        return self.steps[i][1]
+
+
+class RampProfile:
+    """
+    Rate profile for OpenLoop rising (or falling) linearly from START_RATE to
+    END_RATE over DURATION seconds, then holding at END_RATE.
+    """
+
+    def __init__(self, start_rate: float, end_rate: float, duration: float):
+        self.start_rate = start_rate
+        self.end_rate = end_rate
+        self.duration = duration
+
+    def __call__(self, t: float) -> float:
+        return self.start_rate + (self.end_rate - self.start_rate)\
+            * min(1.0, t / self.duration)
+
+
+def loadReport(tasks) -> dict:
+    """
+    Summarises a run of TASKS:
+      offered_load  submitted tasks/sec, over the span of submissions
+      throughput    completed tasks/sec, from first submission to last result
+      mean/p50/p99_latency
+    """
+    done = [t for t in tasks if t.has_result]
+    submits = np.array([t.submit_time for t in tasks
+                        if t.submit_time is not None])
+    latencies = np.array([t.latency() for t in done])
+    report = {'n_submitted': len(submits), 'n_completed': len(done)}
+    span = submits.max() - submits.min() if len(submits) else 0
+    # N submissions bound N-1 gaps
+    report['offered_load'] = (len(submits) - 1) / span if span else 0.0
+    span = max(t.finish_time for t in done) - submits.min() if done else 0
+    report['throughput'] = len(done) / span if span else 0.0
+    for name, q in (('mean', None), ('p50', 50), ('p99', 99)):
+        report[f'{name}_latency'] = (
+            0.0 if not len(latencies) else
+            float(latencies.mean() if q is None
+                  else np.percentile(latencies, q)))
+    return report
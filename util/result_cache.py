@@ -0,0 +1,120 @@
+import hashlib
+import json
+import numbers
+import os
+import sqlite3
+from functools import lru_cache, partial
+from util.traces import Trace
+
+# Content-addressed store of bench() results, so that sweeps only simulate the
+# points they haven't seen before. An entry is keyed by
+#   every keyword argument given to bench() (see util.sweep)
+#   the workload spec: generator function + arguments, or a trace's contents
+#   the seed
+#   a hash of the simulator's source code
+# and holds one value per metric, so asking for a new metric at an old point
+# reruns just that point. Each result is committed as soon as it comes in,
+# so an interrupted sweep picks up where it left off.
+
+DEFAULT_PATH = "results.sqlite"
+
+# Everything that can change what a simulation does
+_SOURCE_DIRS = ["multicast", "simulators"]
+_SOURCE_FILES = ["benchmark.py", os.path.join("util", "workloads.py"),
+                 os.path.join("util", "loadgen.py"),
+                 os.path.join("util", "sweep.py"),
+                 os.path.join("util", "traces.py")]
+
+
+class ResultCache:
+    """ Results stored in the SQLite database at PATH. """
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute("CREATE TABLE IF NOT EXISTS results ("
+                         " key TEXT, metric TEXT, value TEXT, config TEXT,"
+                         " PRIMARY KEY (key, metric))")
+        self._db.commit()
+
+    def key(self, point: dict, seed) -> str:
+        """ The cache key for one run of bench() at POINT with SEED. """
+        return hashlib.sha256(configSpec(point, seed).encode()).hexdigest()
+
+    def get(self, key: str, metrics):
+        """
+        The values of METRICS stored under KEY, in order, or None unless every
+        one of them is present.
+        """
+        rows = dict(self._db.execute(
+            "SELECT metric, value FROM results WHERE key = ?", (key,)))
+        if not all(m in rows for m in metrics):
+            return None
+        return [json.loads(rows[m]) for m in metrics]
+
+    def put(self, key: str, metrics, scores, config: str = None):
+        """ Stores SCORES, the values of METRICS, under KEY. """
+        self._db.executemany(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+            [(key, m, json.dumps(s, default=_describe), config)
+             for m, s in zip(metrics, scores)])
+        self._db.commit()
+
+    def __len__(self):
+        return self._db.execute(
+            "SELECT COUNT(DISTINCT key) FROM results").fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+def configSpec(point: dict, seed) -> str:
+    """
+    Canonical JSON description of a run of bench() at POINT with SEED; equal
+    specs mean equal simulations.
+    """
+    return json.dumps({'point': _describe(point),
+                       'seed': seed,
+                       'code': codeVersion()}, sort_keys=True)
+
+
+@lru_cache(maxsize=None)
+def codeVersion() -> str:
+    """ Hash of the simulator's source, so stale results are never reused. """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    paths = [os.path.join(root, f) for f in _SOURCE_FILES]
+    for d in _SOURCE_DIRS:
+        paths += [os.path.join(root, d, f)
+                  for f in os.listdir(os.path.join(root, d))
+                  if f.endswith(".py")]
+    h = hashlib.sha256()
+    for path in sorted(paths):
+        h.update(os.path.relpath(path, root).encode())
+        with open(path, 'rb') as file:
+            h.update(file.read())
+    return h.hexdigest()
+
+
+def _describe(value):
+    """ Reduces VALUE to something JSON can encode deterministically. """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, numbers.Integral):  # e.g. NumPy scalars
+        return int(value)
+    if isinstance(value, numbers.Real):
+        return float(value)
+    if isinstance(value, (list, tuple)):
+        return [_describe(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _describe(v) for k, v in value.items()}
+    if isinstance(value, partial):
+        return {'fn': _describe(value.func),
+                'args': _describe(value.args),
+                'kwargs': _describe(value.keywords)}
+    if isinstance(value, Trace):  # By content: the path may be reused
+        return {'class': _describe(type(value)), 'digest': value.digest()}
+    if hasattr(value, '__qualname__'):  # Functions and classes
+        return f"{value.__module__}.{value.__qualname__}"
+    # Other objects (e.g. link models): class + configuration, where it has any
+    return {'class': _describe(type(value)),
+            'state': _describe(getattr(value, '__dict__', {}))}
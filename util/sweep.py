@@ -0,0 +1,85 @@
+import multiprocessing as mp
+import os
+import statistics
+from itertools import product
+
+import benchmark
+from util.result_cache import ResultCache, configSpec
+
+# Parameter sweeps over benchmark.bench. Every (point, trial) pair is its own
+# task on a process pool, so a sweep keeps all cores busy however its points
+# and trials are shaped; results come back over the pool's pipes as plain
+# lists rather than through Manager proxies.
+#
+# A point is a dict of keyword arguments for bench(), except that 'workload'
+# must be a callable taking just an RNG keyword and returning the workload's
+# generator function, e.g. functools.partial(working_sets, 512, 1, 4, 5), so
+# that it can be pickled across to the pool and seeded there.
+
+
+def sweepGrid(**axes):
+    """
+    Returns the cartesian product of AXES (each a list of values) as a list of
+    points, e.g. sweepGrid(a=[1, 2], b=[3]) == [{a: 1, b: 3}, {a: 2, b: 3}].
+    """
+    names = list(axes)
+    return [dict(zip(names, values))
+            for values in product(*(axes[name] for name in names))]
+
+
+def sweep(points, n_trials: int, metrics, processes: int = None,
+          cache: ResultCache = None):
+    """
+    Runs bench() N_TRIALS times at each of POINTS, collecting METRICS (names
+    from benchmark.benchmark_stats). Uses a pool of PROCESSES processes,
+    by default one per core.
+    Trial T is run with seed T, so sweeps are reproducible.
+    With a CACHE, trials already stored there aren't rerun, and new results
+    are stored as they finish.
+    Returns a list with one entry per point, each a list with one entry per
+    trial of the values of METRICS, in order.
+    """
+    metrics = list(metrics)
+    results = [[None] * n_trials for _ in points]
+    jobs = []
+    for i, point in enumerate(points):
+        for t in range(n_trials):
+            if cache is not None:
+                results[i][t] = cache.get(cache.key(point, t), metrics)
+            if results[i][t] is None:
+                jobs.append((i, t, point, metrics))
+    if not jobs:
+        return results
+
+    ctx = mp.get_context('spawn')
+    with ctx.Pool(min(processes or os.cpu_count(), len(jobs))) as pool:
+        for i, t, scores in pool.imap_unordered(_runTrial, jobs):
+            results[i][t] = scores
+            if cache is not None:
+                cache.put(cache.key(points[i], t), metrics, scores,
+                          configSpec(points[i], t))
+    return results
+
+
+def sweepStats(results):
+    """
+    Summarizes the output of sweep(): returns, for each metric, a pair of
+    lists (means, standard deviations) with one entry per point.
+    """
+    n_metrics = len(results[0][0])
+    stats = []
+    for m in range(n_metrics):
+        per_point = [[trial[m] for trial in point] for point in results]
+        stats.append(([statistics.mean(s) for s in per_point],
+                      [statistics.stdev(s) if len(s) > 1 else 0.0
+                       for s in per_point]))
+    return stats
+
+
+def _runTrial(job):
+    """ Pool task: one trial at one sweep point. """
+    i, t, point, metrics = job
+    benchmark.bench_metrics[:] = metrics
+    kwargs = dict(point)
+    workload = kwargs.pop('workload')(rng=benchmark.workloadRng(t))
+    return i, t, benchmark.bench(False, workload(), seed=t, **kwargs)
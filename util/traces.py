@@ -0,0 +1,225 @@
+import argparse
+import hashlib
+import os
+import pickle
+import shutil
+import struct
+import tempfile
+from functools import lru_cache
+import numpy as np
+from multicast.core import UserTask
+from simulators.enclave import ProgramBatch, EnclaveProgram
+
+# Binary task traces, so that exactly the same input can be replayed through
+# different topologies (or imported from elsewhere). A trace file is
+#   header      see _HEADER
+#   task_ids    int64[n_tasks]
+#   arrivals    float64[n_tasks]   seconds since the start of the run
+#   offsets     int64[n_tasks + 1] CSR: task i's keys are
+#   key_ids     int32[n_key_slots]   key_ids[offsets[i]:offsets[i + 1]]
+#   keyspace    pickled sequence mapping key ids back to keys
+# all little-endian. Reading one memory-maps the columns, so traces far
+# larger than RAM can be streamed through a simulation. A Trace also serves
+# as a util.sweep workload, and is pickled (and cached) as just its file.
+
+_MAGIC = b"MCTRACE1"
+# Magic, n_tasks, n_key_slots, keyspace bytes, work factor
+_HEADER = struct.Struct("<8sQQQd")
+_CHUNK = 1 << 16  # Tasks buffered per column before spilling to disk
+
+
+class TraceWriter:
+    """
+    Streams tasks into a trace file at PATH. Columns are spilled to temporary
+    files as they grow and stitched together by close(), so memory use stays
+    flat however long the trace. Keys are interned into the trace's own
+    keyspace in order of first use.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.n_tasks = 0
+        self.n_key_slots = 0
+        self.work_factor = None
+        self._key_ids = {}  # Key => id in the trace's keyspace
+        self._keyspace = []
+        self._columns = {name: ([], tempfile.TemporaryFile())
+                         for name in ('task_ids', 'arrivals', 'lengths',
+                                      'key_ids')}
+
+    def write(self, task: UserTask, arrival: float):
+        """ Appends TASK, which arrives ARRIVAL seconds into the run. """
+        program = task.program
+        if self.work_factor is None:
+            self.work_factor = program.work_factor
+        assert program.work_factor == self.work_factor, \
+            "All tasks in a trace must share a work factor"
+        keys = program.keys
+        for k in keys:
+            if k not in self._key_ids:
+                self._key_ids[k] = len(self._keyspace)
+                self._keyspace.append(k)
+        self._append('task_ids', [task.id])
+        self._append('arrivals', [arrival])
+        self._append('lengths', [len(keys)])
+        self._append('key_ids', [self._key_ids[k] for k in keys])
+        self.n_tasks += 1
+        self.n_key_slots += len(keys)
+
+    def close(self):
+        for name in self._columns:
+            self._spill(name)
+        keyspace = pickle.dumps(self._keyspace)
+        with open(self.path, 'wb') as file:
+            file.write(_HEADER.pack(_MAGIC, self.n_tasks, self.n_key_slots,
+                                    len(keyspace), self.work_factor or 0.0))
+            for name in ('task_ids', 'arrivals'):
+                self._copyColumn(name, file)
+            # Offsets are the running total of the lengths, from 0
+            file.write(np.zeros(1, dtype='<i8').tobytes())
+            spill = self._columns['lengths'][1]
+            spill.seek(0)
+            total = 0
+            while True:
+                lengths = np.frombuffer(spill.read(8 * _CHUNK), dtype='<i8')
+                if not len(lengths):
+                    break
+                offsets = total + np.cumsum(lengths)
+                file.write(offsets.astype('<i8').tobytes())
+                total = offsets[-1]
+            self._copyColumn('key_ids', file)
+            file.write(keyspace)
+        for _, spill in self._columns.values():
+            spill.close()
+
+    def _append(self, name: str, values):
+        buffer = self._columns[name][0]
+        buffer.extend(values)
+        if len(buffer) >= _CHUNK:
+            self._spill(name)
+
+    def _spill(self, name: str):
+        buffer, spill = self._columns[name]
+        if buffer:
+            spill.write(np.asarray(buffer, dtype=_DTYPES[name]).tobytes())
+            buffer.clear()
+
+    def _copyColumn(self, name: str, file):
+        spill = self._columns[name][1]
+        spill.seek(0)
+        shutil.copyfileobj(spill, file)
+
+
+_DTYPES = {'task_ids': '<i8', 'arrivals': '<f8', 'lengths': '<i8',
+           'key_ids': '<i4'}
+
+
+def writeTrace(path: str, workload, task_interval: float = 0.01) -> int:
+    """
+    Records every task yielded by WORKLOAD (e.g. a generator from
+    util.workloads) to a trace at PATH. Tasks with no arrival time of their
+    own arrive every TASK_INTERVAL seconds, as they would in bench().
+    Returns the number of tasks written.
+    """
+    writer = TraceWriter(path)
+    for i, task in enumerate(workload):
+        writer.write(task, i * task_interval if task.arrival is None
+                     else task.arrival)
+    writer.close()
+    return writer.n_tasks
+
+
+class Trace:
+    """
+    A trace file at PATH, memory-mapped: nothing but the header and keyspace
+    is read until tasks are asked for.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            magic, n_tasks, n_key_slots, keyspace_bytes, work_factor = \
+                _HEADER.unpack(file.read(_HEADER.size))
+            assert magic == _MAGIC, f"{path} is not a task trace"
+            offset = _HEADER.size
+
+            def column(dtype, n):
+                nonlocal offset
+                if not n:  # Can't map zero bytes
+                    return np.empty(0, dtype=dtype)
+                mapped = np.memmap(path, dtype=dtype, mode='r',
+                                   offset=offset, shape=(n,))
+                offset += mapped.nbytes
+                return mapped
+            self.task_ids = column('<i8', n_tasks)
+            self.arrivals = column('<f8', n_tasks)
+            self.offsets = column('<i8', n_tasks + 1)
+            self.key_ids = column('<i4', n_key_slots)
+            file.seek(offset)
+            keyspace = pickle.loads(file.read(keyspace_bytes))
+        self.batch = ProgramBatch(keyspace, work_factor,
+                                  self.key_ids, self.offsets)
+
+    def __len__(self):
+        return len(self.task_ids)
+
+    def tasks(self, start: int = 0, stop: int = None):
+        """
+        Yields the trace's tasks from START up to STOP (default: the end),
+        each with its recorded arrival time.
+        """
+        for i in range(start, len(self) if stop is None else stop):
+            task = UserTask(EnclaveProgram.view(self.batch, i),
+                            int(self.task_ids[i]))
+            task.arrival = float(self.arrivals[i])
+            yield task
+
+    def __call__(self, rng=None):
+        """ As a sweep workload: replays the whole trace, ignoring RNG. """
+        return self.tasks
+
+    def __reduce__(self):
+        # Reopen by path, rather than pickling the mapped columns into RAM
+        return (Trace, (self.path,))
+
+    def digest(self) -> str:
+        """ Hash of the trace file's contents. """
+        st = os.stat(self.path)
+        return _fileDigest(os.path.abspath(self.path), st.st_size,
+                           st.st_mtime_ns)
+
+
+@lru_cache(maxsize=None)
+def _fileDigest(path: str, size: int, mtime_ns: int) -> str:
+    """ SHA-256 of PATH, computed once per (size, mtime) it's seen with. """
+    h = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+if __name__ == "__main__":
+    from benchmark import workloads, workloadRng
+
+    parser = argparse.ArgumentParser(
+        description='Record a workload to a task trace')
+    parser.add_argument('path', metavar='TRACE')
+    parser.add_argument('-w', '--workload', default='4x5',
+                        dest='workload', action='store')
+    parser.add_argument('-n', '--tasks', metavar='N_TASKS', default=1000,
+                        dest='n_tasks', type=int, action='store')
+    parser.add_argument('-t', '--time_factor', metavar='WORK_FACTOR',
+                        default=5, dest='time_factor', type=float,
+                        action='store')
+    parser.add_argument('-i', '--interval', metavar='SECONDS', default=0.01,
+                        dest='task_interval', type=float, action='store')
+    parser.add_argument('--seed', metavar='SEED', default=None,
+                        dest='seed', type=int, action='store')
+    args = parser.parse_args()
+
+    workload = workloads[args.workload](args.n_tasks, args.time_factor,
+                                        rng=workloadRng(args.seed))
+    n = writeTrace(args.path, workload(), args.task_interval)
+    print(f"Wrote {n} tasks ({os.path.getsize(args.path)} bytes) "
+          f"to {args.path}")
@@ -1,13 +1,38 @@
+import sys
+import threading
 import unittest
+import numpy as np
 from pprint import pprint
+from types import SimpleNamespace
 from time import sleep
 
 from multicast.core import *
 from multicast.coordinator import *
 from multicast.router import *
 from multicast.worker import *
+from multicast.interest import *
+from multicast.combining import *
+from multicast.cache import *
+from multicast.placement import *
 from simulators.network import *
 from simulators.enclave import *
+from simulators.events import *
+from simulators.links import *
+from simulators.aio import *
+from functools import partial
+import os
+import pickle
+import tempfile
+import weakref
+from util.result_cache import ResultCache, configSpec
+from util.traces import Trace, writeTrace
+from util.loadgen import OpenLoop, ClosedLoop, StepProfile, RampProfile, \
+    loadReport
+import benchmark
+from benchmark import bench, bench_metrics, buildTree, workloadOptions
+from util.user_args import parser
+from util.sweep import sweep, sweepGrid, sweepStats
+from util.workloads import working_sets, monic, zipf, hot_set, drifting
 
 
 class TestNetworkSimulator(unittest.TestCase):
@@ -88,6 +113,83 @@ class TestNetworkSimulator(unittest.TestCase):
             "Packet failed to send")
         self.assertFalse(listener.expects_packet, "Packet not received")
 
+    def test_packet_log(self):
+        """ Logged packets can be read back, and rolled back, in any order. """
+        log = PacketLog(capacity=2)
+        packets = [Packet({'type': t}, "1.0.0." + str(i), i, "2.0.0.1", 80)
+                   for i, t in enumerate(["A", "B", "A", "C"])]
+        rows = [log.append(p) for p in packets]
+        log.rollback(rows[3])
+        log.rollback(rows[1])
+
+        self.assertEqual(len(log), 2)
+        self.assertEqual([(p.src, p.payload) for p in log],
+                         [("1.0.0.0", "A"), ("1.0.0.2", "A")])
+        self.assertEqual(log[-1].src_port, 2)
+        self.assertEqual(log.countInvolving("2.0.0.1"), 2)
+        self.assertEqual(log.hostCounts(),
+                         {"1.0.0.0": 1, "1.0.0.2": 1, "2.0.0.1": 2})
+
+    def test_traffic_stats(self):
+        """ Running counters agree with what the packet log recorded. """
+        netReset()
+        server_A = NetworkHost()
+        server_B = NetworkHost()
+        listener = self.PortListener(self, "A", server_A, 1)
+        for src in (server_B, server_A):
+            ping = Packet({'type': "Ping"}, src.ip, 1, server_A.ip, 1)
+            listener.setExpectation(ping)
+            src.sendPacket(ping)
+        server_B.sendMsg({'type': "Ping"}, 2, server_A.ip, 3)  # Port closed
+
+        traffic = getTrafficStats()
+        _, packets, _ = getNetworkDebugInfo()
+        self.assertEqual(traffic.n_packets, len(packets))
+        for ip in (server_A.ip, server_B.ip):
+            self.assertEqual(traffic.involving(ip), packets.countInvolving(ip))
+            self.assertEqual(traffic.throughput(ip), packets.hostCounts()[ip])
+        self.assertEqual(traffic.msg_types, {'Ping': 2})
+        self.assertEqual(traffic.ports[(server_A.ip, 1)], 3)
+        self.assertEqual(traffic.involving(server_A.ip), 2)
+
+    def test_link_model(self):
+        """
+        Packets take latency + serialization time per hop, and queue behind
+        each other on a busy link.
+        """
+        netReset(link_model=UniformLinks(0.001, 1000))
+        simReset()
+        simEnable()
+        server_A = NetworkHost()
+        server_B = NetworkHost()
+        self.assertEqual(server_A.ping(server_B.ip), (True, 0.002))
+        self.assertEqual(server_A.ping("10.9.9.9"), (False, None))
+
+        arrivals = []
+        server_B.openPort(lambda port: arrivals.append(simNow()), 80)
+        msg = "x" * (1000 - HEADER_BYTES)  # Takes a second to serialize
+        server_A.sendMsg(msg, 80, server_B.ip, 80)
+        server_A.sendMsg(msg, 80, server_B.ip, 80)
+        simRun()
+        simEnable(False)
+        self.assertEqual(arrivals, [1.001, 2.001])
+
+    def test_address_allocation(self):
+        """ Subnets fill in order, and reuse addresses freed by hosts. """
+        netReset()
+        explicit = NetworkHost("10.0.0.2")
+        hosts = [NetworkHost("10.0") for _ in range(300)]
+        self.assertEqual(hosts[0].ip, "10.0.0.0")
+        self.assertEqual(hosts[2].ip, "10.0.0.3")  # Skips the taken address
+        self.assertEqual(hosts[299].ip, "10.0.1.44")
+
+        hosts[7].disconnect()
+        self.assertEqual(NetworkHost("10.0").ip, "10.0.0.8")
+        self.assertEqual(NetworkHost("10.0").ip, "10.0.1.45")
+
+        netReset()
+        self.assertEqual(NetworkHost("10.0").ip, "10.0.0.0")
+
 
 class TestMulticastTreeStructure(unittest.TestCase):
 
@@ -108,6 +210,58 @@ class TestMulticastTreeStructure(unittest.TestCase):
             router = Router(server, serv_coord.ip, False, 3, "r_" + str(i))
             worker = Worker(server, serv_coord.ip, "w_" + str(i))
 
+    def test_placement_matches_reference(self):
+        """
+        Tree.findRoom's incremental bookkeeping must place nodes exactly where
+        a from-scratch search of the tree would.
+        """
+        def descendants(tree):
+            return sum(1 + descendants(c) for c in tree.children)
+
+        def referenceFindRoom(tree):
+            if tree.hasRoom():
+                return tree
+            for child in sorted(tree.children, key=descendants):
+                candidate = referenceFindRoom(child)
+                if candidate:
+                    return candidate
+            return None
+
+        rng = np.random.default_rng(262)
+        root = Tree("root", True, 3)
+        for i in range(600):
+            is_router = rng.random() < 0.3
+            node = Tree(i, is_router, int(rng.integers(1, 4)) if is_router else 0)
+            home = root.findRoom()
+            self.assertIs(home, referenceFindRoom(root))
+            if home:
+                home.addChild(node)
+            else:
+                root.forceAddChild(node)
+            self.assertEqual(root.numDescendants(), descendants(root))
+
+    def test_queued_delivery_tall_tree(self):
+        """
+        With queued delivery, a tree far taller than the recursion limit would
+        allow for synchronous delivery still works.
+        """
+        netReset(queued_delivery=True)
+
+        serv_coord = NetworkHost("73.0.0.1")
+        coord = Coordinator(serv_coord, serv_coord.ip, "coord")
+        root = Router(serv_coord, serv_coord.ip, True, 1, "root")
+        for i in range(400):  # A chain of routers, each with one child
+            router = Router(NetworkHost("80.0"), serv_coord.ip, False, 1,
+                            "r_" + str(i))
+        worker = Worker(NetworkHost("90.0"), serv_coord.ip, "w")
+        self.assertEqual(coord.root.numDescendants(), 401)
+
+        task = UserTask(EnclaveProgram(['x', 'y'], 0.3, 1000), 0)
+        coord.enqueueUserTask(task)
+        coord.joinUserTasks()
+        self.assertTrue(task.has_result)
+        netReset()
+
     def test_program_determinism(self):
         """
         Multiple user-tasks based on the same program should have the same
@@ -191,5 +345,765 @@ class TestMulticastTreeStructure(unittest.TestCase):
         print(coord.root.prettyString())
 
 
+    def test_task_placement_policies(self):
+        """
+        Affinity placement follows a program's keys unless the load gap
+        outweighs them, power-of-two-choices takes the less loaded of its
+        two picks, and batches are placed as tasks sent one by one would be.
+        """
+        def router(counts, keys):
+            summary = ExactInterest()
+            for child in counts:
+                summary.addChild(child)
+            for child, k in keys:
+                summary.add(child, k)
+            return SimpleNamespace(child_task_counts=counts,
+                                   child_task_keys=summary,
+                                   child_workers=list(counts),
+                                   child_routers=[])
+        program = ProgramBatch.fromKeyIds(['x', 'y'], 1, [2], [0, 1])[0]
+        r = router({'a': 0, 'b': 2, 'c': 2},
+                   [('b', 'x'), ('b', 'y'), ('c', 'x')])
+        self.assertEqual(LeastLoaded().choose(r, program), 'a')
+        self.assertEqual(KeyAffinity(0.5).choose(r, program), 'b')
+        self.assertEqual(KeyAffinity(2.0).choose(r, program), 'a')
+
+        r = router({'a': 0, 'b': 5, 'c': 1, 'd': 9}, [])
+        picks = [PowerOfTwoChoices(np.random.default_rng(0)).choose(r, None)
+                 for _ in range(50)]
+        self.assertNotIn('d', picks)  # Always loses
+        self.assertEqual(picks, [PowerOfTwoChoices(
+            np.random.default_rng(0)).choose(r, None) for _ in range(50)])
+
+        for policy in (LeastLoaded(), KeyAffinity(0.5)):
+            one_by_one, batched = [], []
+            for picks, place in ((one_by_one, None), (batched, policy.place)):
+                r = router({'a': 0, 'b': 2, 'c': 2}, [('b', 'x')])
+                programs = [program] * 6
+                children = place(r, programs) if place else\
+                    (policy.choose(r, p) for p in programs)
+                for p, child in zip(programs, children):
+                    r.child_task_counts[child] += 1
+                    for k in p.keys:
+                        r.child_task_keys.add(child, k)
+                    picks.append(child)
+            self.assertEqual(one_by_one, batched)
+
+
+class TestDiscreteEvent(unittest.TestCase):
+
+    def test_virtual_clock(self):
+        """
+        Tasks run to completion on the virtual clock, finishing at simulated
+        times consistent with when they were submitted.
+        """
+        netReset()
+        simReset()
+        simEnable()
+
+        serv_coord = NetworkHost("73.0.0.1")
+        coord = Coordinator(serv_coord, serv_coord.ip, "coord")
+        root = Router(serv_coord, serv_coord.ip, True, 2, "root")
+        for i in range(2):
+            router = Router(NetworkHost("80.0"), serv_coord.ip, False, 2,
+                            "r_" + str(i))
+        for i in range(4):
+            worker = Worker(NetworkHost("90.0"), serv_coord.ip, "w_" + str(i))
+
+        tasks = []
+        program = EnclaveProgram(['x', 'y', 'z'], 0.3, 1)
+        for i in range(8):
+            task = UserTask(program, i)
+            tasks.append(task)
+            simSchedule(i, coord.enqueueUserTask, task)
+
+        coord.joinUserTasks()
+        simEnable(False)
+
+        self.assertEqual(simPending(), 0)
+        for i, task in enumerate(tasks):
+            self.assertTrue(task.has_result)
+            self.assertEqual(task.submit_time, i)
+            self.assertGreater(task.finish_time, task.submit_time)
+        self.assertEqual(len({t.result for t in tasks}), 1)
+
+    def test_router_service_queue(self):
+        """
+        Routers with a service time still deliver every task and result, even
+        with no room to queue multicasts; they just take longer.
+        """
+        netReset()
+        simReset()
+        simEnable()
+
+        serv_coord = NetworkHost("73.0.0.1")
+        coord = Coordinator(serv_coord, serv_coord.ip, "coord")
+        root = Router(serv_coord, serv_coord.ip, True, 4, "root",
+                      service_time=0.01, queue_limit=0)
+        for i in range(4):
+            worker = Worker(NetworkHost("90.0"), serv_coord.ip, "w_" + str(i))
+
+        tasks = [UserTask(EnclaveProgram(['x', 'y'], 0.3, 1), i)
+                 for i in range(8)]
+        for task in tasks:
+            coord.enqueueUserTask(task)
+        coord.joinUserTasks()
+        simEnable(False)
+
+        self.assertTrue(all(t.has_result for t in tasks))
+        self.assertGreaterEqual(root.n_served, 16)  # Each task + result
+        self.assertAlmostEqual(root.busy_time, root.n_served * 0.01)
+        self.assertGreater(root.n_dropped, 0)
+        self.assertGreaterEqual(min(t.latency() for t in tasks), 0.02)
+
+    def test_shared_timer_threads(self):
+        """
+        In wall-clock mode enclaves share a bounded pool of timer threads, yet
+        each worker still runs its programs one at a time, in arrival order.
+        """
+        netReset()
+        simReset()
+        simEnable(False)
+
+        serv_coord = NetworkHost("73.0.0.1")
+        coord = Coordinator(serv_coord, serv_coord.ip, "coord")
+        root = Router(serv_coord, serv_coord.ip, True, 4, "root")
+        workers = [Worker(NetworkHost("90.0"), serv_coord.ip, "w_" + str(i))
+                   for i in range(4)]
+        finish_order = []
+        completed = Worker._enclaveComplete
+
+        def recordCompletion(worker, program, program_uid, result):
+            finish_order.append((worker.host.ip, program_uid))
+            return completed(worker, program, program_uid, result)
+
+        tasks = [UserTask(p, i) for i, p in
+                 enumerate(ProgramBatch.sample(['x', 'y'], 64, 0.3, 20))]
+        baseline = threading.active_count()
+        Worker._enclaveComplete = recordCompletion
+        try:
+            for task in tasks:
+                coord.enqueueUserTask(task)
+            coord.joinUserTasks()
+        finally:
+            Worker._enclaveComplete = completed
+
+        self.assertTrue(all(t.has_result for t in tasks))
+        self.assertLessEqual(threading.active_count(), baseline + RT_THREADS)
+        for w in workers:
+            uids = [uid for ip, uid in finish_order if ip == w.host.ip]
+            self.assertEqual(uids, sorted(uids))
+
+    def test_enclave_handoff(self):
+        """
+        Programs submitted from several threads, while others finish on the
+        timer threads, all run: one at a time, each thread's in order.
+        """
+        netReset()
+        simReset()
+        simEnable(False)
+
+        worker = Worker(NetworkHost("90.0"), "73.0.0.1", "w")
+        worker.parent = "73.0.0.1"
+        worker.host.sendMsg = lambda *args: None  # Nobody to hear results
+        finish_order = []
+        running = []
+        overlapped = []
+        completed = threading.Event()
+        n_submitters, n_programs = 8, 200
+
+        def start(program, program_uid):
+            running.append(program_uid)
+            if len(running) > 1:  # Timer threads can't fail the test
+                overlapped.append(list(running))
+            Worker._enclaveStart(worker, program, program_uid)
+
+        def complete(program, program_uid, result):
+            running.remove(program_uid)
+            finish_order.append(program_uid)
+            if len(finish_order) == n_submitters * n_programs:
+                completed.set()
+            Worker._enclaveComplete(worker, program, program_uid, result)
+
+        worker._enclaveStart = start
+        worker._enclaveComplete = complete
+        batch = ProgramBatch.sample(['x'], n_programs, 0.0, 1000)
+
+        def submit(thread_id):
+            for i in range(n_programs):
+                worker._enclaveSubmit(batch[i], (thread_id, i))
+                sleep(0.0001)  # Let the queue run dry now and then
+        threads = [threading.Thread(target=submit, args=(t,))
+                   for t in range(n_submitters)]
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # Switch threads often, to find races
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertTrue(completed.wait(10))
+        finally:
+            sys.setswitchinterval(switch_interval)
+        self.assertEqual(overlapped, [])
+        for t in range(n_submitters):
+            self.assertEqual([i for t_id, i in finish_order if t_id == t],
+                             list(range(n_programs)))
+
+    def test_asyncio_runtime(self):
+        """
+        A whole tree runs on one asyncio event loop: packets go through
+        per-port queues and enclaves await their steps, with no extra threads.
+        """
+        netReset()
+        simReset()
+        simEnable(False)
+        baseline = threading.active_count()
+
+        async def main():
+            serv_coord = NetworkHost("73.0.0.1")
+            coord = Coordinator(serv_coord, serv_coord.ip, "coord")
+            root = Router(serv_coord, serv_coord.ip, True, 2, "root")
+            for i in range(2):
+                Router(NetworkHost("80.0"), serv_coord.ip, False, 2,
+                       "r_" + str(i))
+            for i in range(4):
+                Worker(NetworkHost("90.0"), serv_coord.ip, "w_" + str(i))
+            await aioIdle()
+            self.assertTrue(serv_coord.port_queues)
+
+            tasks = [UserTask(p, i) for i, p in
+                     enumerate(ProgramBatch.sample(['x', 'y'], 16, 0.3, 20))]
+            for task in tasks:
+                coord.enqueueUserTask(task)
+            await coord.joinUserTasksAsync()
+            self.assertEqual(threading.active_count(), baseline)
+            return tasks
+
+        tasks = aioRun(main)
+        self.assertFalse(aioEnabled())
+        self.assertTrue(all(t.has_result for t in tasks))
+
+
+    def test_load_generators(self):
+        """
+        An open loop submits at its target rate whatever the tree can keep up
+        with; a closed loop never has more tasks outstanding than clients.
+        """
+        def run(load, n_tasks):
+            netReset()
+            simReset()
+            simEnable()
+            coord, _, _, _ = buildTree(2, 6, 3, 3)
+            tasks = []
+            workload = working_sets(n_tasks, 0.5, 3, 4,
+                                    np.random.default_rng(0))
+            load.seed(np.random.SeedSequence(0))
+            load.start(coord, (tasks.append(t) or t for t in workload()))
+            coord.joinUserTasks()
+            simEnable(False)
+            self.assertEqual(simPending(), 0)
+            self.assertTrue(all(t.has_result for t in tasks))
+            return tasks
+
+        tasks = run(OpenLoop(100, poisson=False), 50)
+        report = loadReport(tasks)
+        self.assertEqual(report['n_completed'], 50)
+        self.assertAlmostEqual(report['offered_load'], 100)
+        profile = StepProfile([(0, 100), (0.2, 1000)])
+        tasks = run(OpenLoop(profile), 200)
+        self.assertLess(tasks[-1].submit_time, 0.5)
+        # Profiles go through util.sweep's process pool and ResultCache keys
+        self.assertEqual(pickle.loads(pickle.dumps(profile))(0.3), 1000)
+        self.assertNotEqual(configSpec({'load': profile}, 0),
+                            configSpec({'load': StepProfile(
+                                [(0, 100), (0.3, 1000)])}, 0))
+        self.assertEqual(RampProfile(100, 200, 1.0)(0.5), 150)
+
+        tasks = run(ClosedLoop(3, think_time=0.01), 40)
+        self.assertEqual(len(tasks), 40)
+        for task in tasks:
+            outstanding = [t for t in tasks if t.submit_time
+                           <= task.submit_time < t.finish_time]
+            self.assertLessEqual(len(outstanding), 3)
+        self.assertGreater(loadReport(tasks)['throughput'], 0)
+
+
+    def test_task_futures(self):
+        """
+        Submitted tasks resolve their futures in turn, no more than
+        max_in_flight are ever in the tree, and streaming the results out
+        leaves nothing behind.
+        """
+        for discrete_event in (True, False):
+            netReset()
+            simReset()
+            simEnable(discrete_event)
+            coord, _, _, _ = buildTree(1, 4, 4, 2, max_in_flight=3)
+            workload = working_sets(20, 0.1, 2, 3, np.random.default_rng(0))
+            peak = 0
+            done = []
+
+            def finished(future):
+                nonlocal peak
+                if not future.cancelled():
+                    peak = max(peak, coord.n_in_flight + 1)
+                    done.append(future.result())
+            futures = []
+            for task in workload():
+                futures.append(coord.submitUserTask(task))
+                futures[-1].add_done_callback(finished)
+                peak = max(peak, coord.n_in_flight)
+            # Only queued tasks can be withdrawn
+            self.assertEqual(futures[-1].cancel(), discrete_event)
+
+            streamed = list(coord.asCompleted())
+            simEnable(False)
+            self.assertEqual(peak, 3)
+            self.assertEqual(coord.tasks, {})
+            self.assertCountEqual(streamed, done)
+            self.assertEqual(len(done), 19 if discrete_event else 20)
+            self.assertTrue(all(f.done() for f in futures))
+
+
+    def test_batched_dispatch(self):
+        """
+        Batches are split between children as one-by-one dispatch would
+        split them, in far fewer packets; partial batches still go out.
+        """
+        def run(batch_size):
+            netReset(False)
+            simReset()
+            simEnable()
+            coord, root, _, _ = buildTree(
+                2, 6, 3, 3, worker_seeds=np.random.SeedSequence(0),
+                batch_size=batch_size, batch_delay=0.5)
+            workload = working_sets(10, 0.1, 2, 3, np.random.default_rng(0))
+            tasks = list(workload())
+            for task in tasks:
+                coord.enqueueUserTask(task)
+            coord.joinUserTasks()
+            simEnable(False)
+            stats = getTrafficStats()
+            n_dispatched = stats.msg_types.get('ExecFakeProgram', 0)\
+                + stats.msg_types.get('ExecFakeProgramBatch', 0)
+            n_from_coord = stats.ports[(coord.host.ip,
+                                        COORD_SEND_USERTASK_PORT)]
+            return [t.result for t in tasks], n_dispatched, n_from_coord
+
+        results, n_single, n_single_root = run(1)
+        # Two full batches and one partial
+        batched_results, n_batched, n_batched_root = run(4)
+        self.assertEqual(results, batched_results)
+        self.assertEqual((n_single_root, n_batched_root), (10, 3))
+        self.assertLess(n_batched, n_single)
+
+
+    def test_write_combining(self):
+        """
+        Combined updates keep only each key's latest value, go out together
+        on a timer or once enough keys are waiting, and cut tree traffic.
+        """
+        netReset()
+        simReset()
+        simEnable()
+        sent = []
+        combiner = WriteCombiner(0.5, 3, sent.append)
+        for key, value in [('x', 1), ('y', 1), ('x', 2)]:
+            combiner.add({'type': "KeyUpdate", 'key': key, 'value': value})
+        simRun()
+        self.assertEqual([[(u['key'], u['value']) for u in updates]
+                          for updates in sent], [[('x', 2), ('y', 1)]])
+        self.assertEqual(simNow(), 0.5)
+        self.assertEqual(combiner.total_delay, 1.0)
+        for key in ['a', 'b', 'c']:  # The third fills it: no need to wait
+            combiner.add({'type': "KeyUpdate", 'key': key, 'value': 0})
+        self.assertEqual(len(sent), 2)
+        simRun()
+        self.assertEqual((combiner.nSaved(), len(sent)), (4, 2))
+        self.assertEqual(updateMsg(sent[0])['type'], "KeyUpdateBatch")
+
+        def run(combine_window):
+            point = dict(n_routers=4, n_workers=16, max_children=4,
+                         max_routers_root=4, max_children_root=4,
+                         sharding=True, discrete_event=True,
+                         combine_window=combine_window)
+            return bench(False, monic(32, 1, np.random.default_rng(0))(),
+                         seed=0, **point)
+        saved_metrics = list(bench_metrics)
+        bench_metrics[:] = ["n_packets", "mcast_packets_saved"]
+        (n_plain, n_saved), (n_combined, n_saved_combined) = \
+            run(None), run(0.005)
+        bench_metrics[:] = saved_metrics
+        simEnable(False)
+        self.assertEqual(n_saved, 0)
+        self.assertGreater(n_saved_combined, 0)
+        self.assertLessEqual(n_combined, n_plain - n_saved_combined)
+
+
+    def test_upward_sharding(self):
+        """
+        Sharding upwards delivers every update to the same workers as before,
+        in fewer packets and with less traffic through the root; with link
+        latency too, when interest reaches a router after its workers have
+        started writing the key. Routers forget what they held back once no
+        interest can come asking for it. Other delays aren't allowed.
+        """
+        def run(upward_sharding, link_model=None, shape=(12, 32, 3, 3)):
+            netReset(False, link_model is not None, link_model)
+            simReset()
+            simEnable()
+            coord, root, routers, workers = buildTree(
+                *shape, worker_seeds=np.random.SeedSequence(0),
+                upward_sharding=upward_sharding)
+            workload = zipf(64, 1, 1024, 1.1, np.random.default_rng(0))
+            for i, task in enumerate(workload()):
+                simSchedule(0.002 * i, coord.enqueueUserTask, task)
+            coord.joinUserTasks()
+            simEnable(False)
+            stats = getTrafficStats()
+            return ([set(w.key_update_arrivals) for w in workers],
+                    stats.n_packets, stats.involving(root.host.ip),
+                    stats.msg_types.get('InterestUpdate', 0),
+                    [root] + routers)
+
+        arrivals, n_packets, n_root, n_interest, _ = run(False)
+        sharded_arrivals, n_sharded, n_sharded_root, n_sharded_interest, _ = \
+            run(True)
+        self.assertEqual(n_interest, 0)
+        self.assertGreater(n_sharded_interest, 0)
+        self.assertEqual(arrivals, sharded_arrivals)
+        self.assertLess(n_sharded, n_packets)
+        self.assertLess(n_sharded_root, n_root)
+
+        # Each router gets interest a hop's latency after its parent, and can
+        # have held updates back meanwhile: it has to send them on late
+        for make_links in (
+                lambda: UniformLinks(0.001),
+                lambda: RandomLinks(0.001, rng=np.random.default_rng(0))):
+            arrivals, n_packets, _, _, _ = run(False, make_links(),
+                                               (20, 40, 4, 2))
+            sharded_arrivals, n_sharded, _, _, routers = run(
+                True, make_links(), (20, 40, 4, 2))
+            for worker_arrivals, sharded in zip(arrivals, sharded_arrivals):
+                self.assertLessEqual(worker_arrivals, sharded)
+            self.assertLess(n_sharded, n_packets)
+            for router in routers:
+                self.assertEqual(router._held_back, {})
+                self.assertEqual(router._lapsed_interest, {})
+
+        # Anything else delaying updates could outlast the catch-up, so
+        # bench() won't have it
+        for delay in ({'router_service_time': 0.001},
+                      {'link_model': UniformLinks(0.001, 1e6)},
+                      {'link_model': SubnetLinks(
+                          {'10.0': (0.001, 1e6)}, (0.001, None))},
+                      {'combine_window': 0.001}):
+            with self.assertRaises(AssertionError):
+                bench(False, [], 2, 6, 3, 3, 3, True, True,
+                      upward_sharding=True, **delay)
+
+
+class TestInterestSummaries(unittest.TestCase):
+
+    def test_bloom_matches_exact(self):
+        """
+        A roomy counting Bloom filter should agree with the exact summary as
+        keys are added and removed, and report no false positives.
+        """
+        exact = ExactInterest()
+        bloom = CountingBloomInterest(1 << 16, 4, audit=True)
+        for summary in (exact, bloom):
+            summary.addChild("a")
+            summary.addChild("b")
+            for k in range(100):
+                summary.add("a", k)
+                summary.add("b" if k % 2 else "a", k)
+            for k in range(50):
+                summary.remove("a", k)
+
+        for k in range(100):
+            self.assertEqual(exact.contains("a", k), bloom.contains("a", k))
+            self.assertEqual(set(exact.interested(k)),
+                             set(bloom.interested(k)))
+        self.assertFalse(bloom.contains("b", 0))
+        self.assertTrue(bloom.contains("a", 0))  # Added twice, removed once
+
+    def test_summary_bytes(self):
+        """
+        Summaries remember their peak size after emptying, and the exact one
+        counts its keys and children, not just its containers.
+        """
+        exact = ExactInterest()
+        bloom = CountingBloomInterest(1024, 4)
+        for summary in (exact, bloom):
+            summary.addChild("80.0.0.1")
+            summary.addChild("80.0.0.2")
+        empty = exact.nbytes()
+        for k in range(1000):
+            exact.add("80.0.0.1" if k % 3 else "80.0.0.2", f"key {k}")
+            exact.add("80.0.0.2", f"key {k}")
+            bloom.add("80.0.0.2", f"key {k}")
+        full = exact.nbytes()
+        self.assertGreater(full, empty + 1000 * sys.getsizeof("key 999"))
+        for k in range(1000):
+            exact.remove("80.0.0.1" if k % 3 else "80.0.0.2", f"key {k}")
+            exact.remove("80.0.0.2", f"key {k}")
+        self.assertEqual(exact.peak_nbytes, full)
+        self.assertLess(exact.nbytes(), full)
+        self.assertEqual(bloom.peak_nbytes, bloom.nbytes())
+        self.assertGreater(bloom.nbytes(), 2 * 1024)
+
+
+class TestKeyCaches(unittest.TestCase):
+
+    def access(self, cache, keys):
+        for k in keys:
+            cache.get(k)
+            cache.put(k, k)
+
+    def test_eviction_policies(self):
+        """
+        Each policy evicts its own victim, only ever holds CAPACITY keys, and
+        counts remote updates to resident keys as invalidations.
+        """
+        lru, lfu = LRUCache(2), LFUCache(2)
+        for cache in (lru, lfu):
+            self.access(cache, ['a', 'a', 'b', 'c'])
+        self.assertEqual(set(lru._values), {'b', 'c'})
+        self.assertEqual(set(lfu._values), {'a', 'c'})  # 'a' used twice
+
+        for cache in (KeyCache(), lru, lfu, ARCCache(2)):
+            self.access(cache, ['x', 'y', 'x'])
+            self.assertTrue(cache.update('x', -1))
+            self.assertFalse(cache.update('zz', 0))
+            self.assertEqual(cache.get('x'), (True, -1))
+            self.assertEqual(cache.n_invalidations, 1)
+            self.assertLessEqual(len(cache), cache.capacity or len(cache))
+
+    def test_arc_scan_resistance(self):
+        """
+        A one-off scan through many keys flushes LRU's hot keys but not ARC's.
+        """
+        hot = list(range(8))
+        scan = list(range(100, 200))
+        hit_rates = []
+        for cache in (LRUCache(16), ARCCache(16)):
+            self.access(cache, hot * 4 + scan)
+            cache.n_hits = cache.n_misses = 0
+            self.access(cache, hot)
+            hit_rates.append(cache.hitRate())
+        self.assertEqual(hit_rates, [0.0, 1.0])
+
+
+class TestWorkloads(unittest.TestCase):
+
+    def test_program_batch(self):
+        """
+        Batched programs are views into one CSR key array, each keeping to
+        its own slice of the keyspace.
+        """
+        rng = np.random.default_rng(0)
+        lo = 5 * rng.integers(4, size=1000)
+        batch = ProgramBatch.sample(range(20), 1000, 0.6, 1, rng, lo, lo + 5)
+        self.assertEqual(len(batch), 1000)
+        self.assertEqual(batch.key_ids.dtype, np.int32)
+        self.assertEqual(batch.offsets[-1], len(batch.key_ids))
+        for i, program in enumerate(batch):
+            self.assertGreaterEqual(len(program.keys), 1)
+            self.assertTrue(all(lo[i] <= k < lo[i] + 5 for k in program.keys))
+        self.assertEqual(batch[3].keys,
+                         batch.key_ids[batch.offsets[3]:batch.offsets[4]]
+                         .tolist())
+
+        # Programs built one at a time are still supported
+        program = EnclaveProgram(['x', 'y'], 0.3, 1, rng)
+        self.assertTrue(set(program.keys) <= {'x', 'y'})
+        self.assertEqual(program.work_factor, 1)
+
+    def test_skewed_workloads(self):
+        """
+        Skewed workloads favour their hot keys, and drifting moves its hot
+        set between phases.
+        """
+        def keyCounts(tasks):
+            return np.bincount([k for t in tasks for k in t.program.keys],
+                               minlength=1000)
+        rng = np.random.default_rng(0)
+
+        counts = keyCounts(zipf(2000, 1, 1000, 1.2, rng)())
+        self.assertEqual(counts.argmax(), 0)
+        self.assertGreater(counts[0], counts[10:20].sum())
+
+        counts = keyCounts(hot_set(2000, 1, 1000, 10, 0.9, rng)())
+        self.assertGreater(counts[:10].sum(), 0.8 * counts.sum())
+
+        tasks = list(drifting(2000, 1, 1000, 10, 0.9, 2, rng)())
+        first, second = keyCounts(tasks[:1000]), keyCounts(tasks[1000:])
+        self.assertGreater(first[:10].sum(), 0.8 * first.sum())
+        self.assertGreater(second[10:20].sum(), 0.8 * second.sum())
+
+    def test_trace_round_trip(self):
+        """
+        A recorded trace replays the same tasks, keys and arrival times, and
+        drives a simulation exactly as the original workload did.
+        """
+        def tasks():
+            return working_sets(300, 1, 4, 5, np.random.default_rng(7))()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "tasks.trace")
+            self.assertEqual(writeTrace(path, tasks(), 0.02), 300)
+            trace = Trace(path)
+            self.assertEqual(len(trace), 300)
+            self.assertIsInstance(trace.key_ids, np.memmap)
+            for original, replayed in zip(tasks(), trace.tasks()):
+                self.assertEqual(original.id, replayed.id)
+                self.assertEqual(original.program.keys, replayed.program.keys)
+            self.assertAlmostEqual(list(trace.tasks(299))[0].arrival, 5.98)
+
+            bench_args = (3, 9, 3, 3, 3, True, True)
+            bench_metrics[:] = ["n_packets", "sim_time"]
+            direct = bench(False, tasks(), *bench_args, log_packets=False,
+                           task_interval=0.02, seed=1)
+            replayed = bench(False, trace.tasks(), *bench_args,
+                             log_packets=False, seed=1)
+            bench_metrics.clear()
+
+            # As a sweep workload: pickled by path, cached by contents
+            self.assertEqual(pickle.loads(pickle.dumps(trace)).path, path)
+            spec = configSpec({'workload': trace}, 0)
+            del trace
+            writeTrace(path, list(tasks())[:200], 0.02)
+            self.assertNotEqual(configSpec({'workload': Trace(path)}, 0),
+                                spec)
+        self.assertEqual(direct, replayed)
+
+
+    def test_workload_options(self):
+        """
+        The CLI's skew and keyspace options go to workloads that take them,
+        and are refused by those that don't rather than silently dropped.
+        """
+        args = parser.parse_args(['-w', 'hot_set', '--n_keys', '100',
+                                  '--hot_keys', '5'])
+        self.assertEqual(workloadOptions(args), {'n_keys': 100, 'hot_keys': 5})
+        self.assertEqual(workloadOptions(parser.parse_args(['-w', '4x5'])), {})
+        for argv in (['-w', '4x5', '--n_keys', '100'],
+                     ['-w', 'zipf', '--hot_fraction', '0.5']):
+            with self.assertRaises(AssertionError):
+                workloadOptions(parser.parse_args(argv))
+
+    def test_streamed_arrivals(self):
+        """
+        In discrete-event mode each task is only drawn from the workload when
+        the previous one arrives, and unless a metric needs the task list,
+        none are kept once they finish.
+        """
+        drawn_at, finished = [], []
+
+        def tasks():
+            for task in working_sets(50, 1, 2, 4, np.random.default_rng(0))():
+                drawn_at.append(simNow())
+                finished.append(weakref.ref(task))
+                yield task
+
+        bench_metrics[:] = ["n_packets"]
+        bench(False, tasks(), 2, 6, 3, 3, 3, True, True, log_packets=False,
+              task_interval=0.01, seed=0)
+        bench_metrics.clear()
+        self.assertAlmostEqual(drawn_at[-1] - drawn_at[0], 0.48)
+        self.assertTrue(all(ref() is None for ref in finished))
+
+
+    def test_bench_without_metrics(self):
+        """
+        The CLI leaves bench_metrics None when no -m is given: bench() still
+        runs, and reports nothing.
+        """
+        saved, benchmark.bench_metrics = benchmark.bench_metrics, None
+        try:
+            self.assertEqual(bench(False, working_sets(
+                10, 1, 2, 4, np.random.default_rng(0))(), 2, 6, 3, 3, 3,
+                True, True, log_packets=False, seed=0), [])
+        finally:
+            benchmark.bench_metrics = saved
+
+    def test_bench_rejects_shifted_flags(self):
+        """
+        Flags passed a position early (so that sharding lands in
+        max_children_root) are caught, though bools are also ints.
+        """
+        with self.assertRaises(AssertionError):
+            bench(False, [], 2, 6, 3, 3, True, True)
+
+
+class TestSweep(unittest.TestCase):
+
+    def test_sweep_grid(self):
+        """
+        Every point x trial of a sweep is run, and each result lands in its
+        own point's slot regardless of the order the pool finishes them in.
+        """
+        points = sweepGrid(workload=[partial(working_sets, 16, 1, 2, 4)],
+                           n_routers=[0, 2],
+                           n_workers=[4],
+                           max_children=[2],
+                           max_routers_root=[2],
+                           max_children_root=[4],
+                           sharding=[True],
+                           discrete_event=[True],
+                           log_packets=[False])
+        self.assertEqual(len(points), 2)
+        results = sweep(points, 3, ["n_packets", "n_packets_root"], 2)
+        self.assertEqual([len(r) for r in results], [3, 3])
+        [(means, stdevs), _] = sweepStats(results)
+        self.assertEqual(len(means), 2)
+        # Every task visits the root and a worker, and returns a result
+        self.assertTrue(all(m >= 16 * 2 for m in means))
+
+    def test_seeded_sweep(self):
+        """
+        Sweeps are seeded per trial: rerunning one reproduces it exactly, even
+        with random link latencies, while different trials still differ.
+        """
+        point = dict(workload=partial(working_sets, 32, 1, 4, 5),
+                     n_routers=3, n_workers=9, max_children=3,
+                     max_routers_root=3, max_children_root=3, sharding=True,
+                     discrete_event=True, log_packets=False,
+                     link_model=RandomLinks(0.001))
+        metrics = ["n_packets", "sim_time", "mean_latency"]
+        first = sweep([point], 3, metrics, 3)
+        second = sweep([point], 3, metrics, 2)
+        self.assertEqual(first, second)
+        self.assertNotEqual(first[0][0], first[0][1])
+
+    def test_result_cache(self):
+        """
+        Results are keyed by configuration and seed, and a repeated sweep is
+        served entirely from the cache.
+        """
+        point = dict(workload=partial(working_sets, 16, 1, 2, 4),
+                     n_routers=0, n_workers=4, max_children=4,
+                     max_routers_root=4, max_children_root=4, sharding=True,
+                     discrete_event=True, log_packets=False)
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ResultCache(os.path.join(tmp, "results.sqlite"))
+            self.assertNotEqual(cache.key(point, 0), cache.key(point, 1))
+            self.assertNotEqual(cache.key(point, 0),
+                                cache.key(dict(point, n_workers=5), 0))
+            self.assertIsNone(cache.get(cache.key(point, 0), ["n_packets"]))
+
+            first = sweep([point], 2, ["n_packets"], 2, cache)
+            self.assertEqual(len(cache), 2)
+            # Poison one entry: if it's read back, nothing was rerun
+            cache.put(cache.key(point, 1), ["n_packets"], [-1])
+            second = sweep([point], 2, ["n_packets"], 2, cache)
+            self.assertEqual(second, [[first[0][0], [-1]]])
+            # New metrics at known points are simulated afresh
+            third = sweep([point], 2, ["n_packets", "n_packets_root"], 2, cache)
+            self.assertGreater(third[0][1][0], 0)
+            cache.close()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -20,12 +20,124 @@ parser.add_argument('--root_branch', metavar='ROOT_BRANCH_FACTOR',
                     dest='max_children_root', type=int, action='store')
 parser.add_argument('-w', '--workload',
                     default='fruits_of_my_labor', metavar='WORKLOAD',
-                    dest='workload', action='store')
+                    dest='workload', action='store',
+                    help='fruits_of_my_labor, posterboard, monic, 2x10, 4x5, '
+                         '1x20, zipf, hot_set or drifting')
+parser.add_argument('--trace', metavar='TRACE', default=None,
+                    dest='trace', action='store',
+                    help='Replay a recorded task trace instead of a workload '
+                         '(see util/traces.py)')
+parser.add_argument('--n_keys', metavar='N_KEYS', default=None,
+                    dest='n_keys', type=int, action='store',
+                    help='Keyspace size for zipf, hot_set and drifting')
+parser.add_argument('--zipf_exponent', metavar='S', default=None,
+                    dest='zipf_exponent', type=float, action='store')
+parser.add_argument('--hot_keys', metavar='N_KEYS', default=None,
+                    dest='hot_keys', type=int, action='store',
+                    help='Hot set size for hot_set and drifting')
+parser.add_argument('--hot_fraction', metavar='FRACTION', default=None,
+                    dest='hot_fraction', type=float, action='store',
+                    help='Share of key uses going to the hot set')
+parser.add_argument('--n_phases', metavar='N_PHASES', default=None,
+                    dest='n_phases', type=int, action='store',
+                    help='Number of hot sets drifting goes through')
 parser.add_argument('--disable_sharding',
                     dest='sharding', action='store_false')
+parser.add_argument('--placement', default='least_loaded',
+                    dest='placement', action='store',
+                    choices=['least_loaded', 'affinity', 'p2c'],
+                    help='How routers choose a child for each task')
+parser.add_argument('--affinity_weight', metavar='WEIGHT', default=1.0,
+                    dest='affinity_weight', type=float, action='store',
+                    help='Keys shared worth one outstanding task, for '
+                         '--placement affinity')
+parser.add_argument('--upward_sharding', dest='upward_sharding',
+                    action='store_true',
+                    help='Only send KeyUpdates up to routers that need them')
+parser.add_argument('--discrete_event', dest='discrete_event',
+                    action='store_true',
+                    help='Run on a virtual clock instead of sleeping')
+parser.add_argument('--asyncio', dest='asyncio_mode', action='store_true',
+                    help='Run every node on one asyncio event loop')
+parser.add_argument('--queued_delivery', dest='queued_delivery',
+                    action='store_true',
+                    help='Deliver packets from a FIFO instead of recursively')
+parser.add_argument('--link_profile', metavar='PROFILE', dest='link_profile',
+                    choices=['uniform', 'random', 'subnet'], action='store',
+                    help='Link model (needs --discrete_event): '
+                         'uniform, random or subnet (core routers, '
+                         'edge workers)')
+parser.add_argument('--link_latency', metavar='SECONDS', default=0.0005,
+                    dest='link_latency', type=float, action='store',
+                    help='(Mean) per-hop propagation latency')
+parser.add_argument('--link_bandwidth', metavar='BYTES_PER_SEC', default=None,
+                    dest='link_bandwidth', type=float, action='store')
+parser.add_argument('--service_time', metavar='SECONDS', default=0.0,
+                    dest='service_time', type=float, action='store',
+                    help='Per-packet router processing time '
+                         '(needs --discrete_event)')
+parser.add_argument('--queue_limit', metavar='N_PACKETS', default=None,
+                    dest='queue_limit', type=int, action='store',
+                    help='Router input queue size; multicasts beyond it drop')
+parser.add_argument('--seed', metavar='SEED', default=None,
+                    dest='seed', type=int, action='store',
+                    help='Seed every random choice, for reproducible runs')
+parser.add_argument('--arrival_rate', metavar='TASKS_PER_SEC', default=None,
+                    dest='arrival_rate', type=float, action='store',
+                    help='Submit tasks open-loop, as a Poisson process')
+parser.add_argument('--constant_arrivals', dest='poisson',
+                    action='store_false',
+                    help='Space --arrival_rate\'s arrivals evenly')
+parser.add_argument('--clients', metavar='N_CLIENTS', default=None,
+                    dest='n_clients', type=int, action='store',
+                    help='Submit tasks closed-loop from N_CLIENTS clients')
+parser.add_argument('--think_time', metavar='SECONDS', default=0.0,
+                    dest='think_time', type=float, action='store',
+                    help='Mean wait between a --clients client\'s tasks')
+parser.add_argument('--max_in_flight', metavar='N_TASKS', default=None,
+                    dest='max_in_flight', type=int, action='store',
+                    help='Hold back tasks while N_TASKS are in the tree')
+parser.add_argument('--batch_size', metavar='N_TASKS', default=1,
+                    dest='batch_size', type=int, action='store',
+                    help='Dispatch tasks down the tree N_TASKS per packet')
+parser.add_argument('--batch_delay', metavar='SECONDS', default=0.0,
+                    dest='batch_delay', type=float, action='store',
+                    help='Longest a partial batch waits before dispatch')
+parser.add_argument('--combine_window', metavar='SECONDS', default=None,
+                    dest='combine_window', type=float, action='store',
+                    help='Hold KeyUpdates up to SECONDS to combine them')
+parser.add_argument('--combine_count', metavar='N_KEYS', default=None,
+                    dest='combine_count', type=int, action='store',
+                    help='Send combined KeyUpdates once N_KEYS are waiting')
+parser.add_argument('--cache_policy', default='unbounded',
+                    dest='cache_policy', action='store',
+                    choices=['unbounded', 'lru', 'lfu', 'arc'],
+                    help='Eviction policy of each worker\'s key cache')
+parser.add_argument('--cache_capacity', metavar='N_KEYS', default=None,
+                    dest='cache_capacity', type=int, action='store',
+                    help='Keys each worker\'s cache can hold')
+parser.add_argument('--no_packet_log', dest='log_packets',
+                    action='store_false',
+                    help='Only count packets, don\'t log each one')
+parser.add_argument('--bloom_counters', metavar='N_COUNTERS', default=0,
+                    dest='bloom_counters', type=int, action='store',
+                    help='Track child keys with counting Bloom filters')
+parser.add_argument('--bloom_hashes', metavar='N_HASHES', default=4,
+                    dest='bloom_hashes', type=int, action='store')
 
 metrics_help = """Metrics:"""\
-    """'n_packets', 'n_packets_root', 'print_tree',"""\
+    """'n_packets', 'n_packets_root', 'root_packets_per_task', """\
+    """'sim_time', 'mean_latency', """\
+    """'n_false_positive_packets', 'summary_bytes', """\
+    """'summary_bytes_saved', 'mean_mcast_reach_time', """\
+    """'p99_mcast_reach_time', 'max_mcast_reach_time', """\
+    """'router_utilisation', 'max_router_utilisation', """\
+    """'router_queue_wait', 'router_queue_depth', 'router_drops', """\
+    """'offered_load', 'throughput', 'p50_latency', 'p99_latency', """\
+    """'mcast_packets_saved', 'combining_delay', """\
+    """'cache_hit_rate', 'cache_invalidations', 'cache_evictions', """\
+    """'n_interest_packets', 'n_mcast_packets', 'load_imbalance', """\
+    """'print_tree',"""\
     """'dump_tasks, dump_packets"""
 parser.add_argument('-m', '--metric', metavar='METRIC',
                     dest='metrics', action='append', help=metrics_help)
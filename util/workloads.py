@@ -1,13 +1,19 @@
 from multicast.core import UserTask
 from simulators.enclave import *
-from random import randrange
+import numpy as np
+import numpy.random as rand
 
 ##### Workloads #####
 
 
-def posterboard(n, time_factor):
+# Every workload takes an optional RNG (a numpy Generator) which all of its
+# randomness is drawn from, so that runs can be reproduced. Workloads of many
+# programs sample them all up front as a single ProgramBatch.
+
+
+def posterboard(n, time_factor, rng=None):
     """ Yields tasks containing the same program back n times. """
-    program = EnclaveProgram(['x', 'y', 'z'], 0.3, time_factor)
+    program = EnclaveProgram(['x', 'y', 'z'], 0.3, time_factor, rng)
 
     iteration = 0
 
@@ -19,59 +25,135 @@ def posterboard(n, time_factor):
     return generator
 
 
-def fruitsOfMyLabor(n, time_factor):
+def fruitsOfMyLabor(n, time_factor, rng=None):
     """ Generates a new program (i.e. new key distribution) for each task. """
     fruits = ["apple", "orange", "pear", "peach", "mango", "rhubarb", "kiwi"]
     fruits = [(fruit,) for fruit in fruits]
+    programs = ProgramBatch.sample(fruits, n, 0.6, time_factor, rng)
 
     iteration = 0
 
     def generator():
         nonlocal iteration
         while iteration < n:
-            yield UserTask(EnclaveProgram(fruits, 0.6, time_factor), iteration)
+            yield UserTask(programs[iteration], iteration)
             iteration += 1
     return generator
 
 
-def working_sets(n_tasks, time_factor, n_working_sets, keys_per_set):
+def working_sets(n_tasks, time_factor, n_working_sets, keys_per_set,
+                 rng=None):
     """
     Assigns (independent) programs from one of N_WORKING_SETS different and
     mutually exclusive sets of keys, each of the same size, KEYS_PER_SET.
     The set used is selected randomly each time.
     """
-    working_sets = []
-    for s in range(n_working_sets):
-        working_set = []
-        for k in range(keys_per_set):
-            key = s*keys_per_set + k
-            working_set.append(key)
-        working_sets.append(working_set)
+    # Working set s is keys s*KEYS_PER_SET up to (s + 1)*KEYS_PER_SET
+    keyspace = range(n_working_sets * keys_per_set)
+    rng = rng if rng is not None else rand.default_rng()
+    set_starts = keys_per_set * rng.integers(n_working_sets, size=n_tasks)
+    programs = ProgramBatch.sample(keyspace, n_tasks, 0.6, time_factor, rng,
+                                   set_starts, set_starts + keys_per_set)
 
     iteration = 0
-    next_working_set = randrange(n_working_sets)
 
     def generator():
         nonlocal iteration
-        nonlocal next_working_set
         while iteration < n_tasks:
-            working_set = working_sets[next_working_set]
-            yield UserTask(
-                    EnclaveProgram(working_set, 0.6, time_factor),
-                    iteration)
+            yield UserTask(programs[iteration], iteration)
             iteration += 1
-            next_working_set = randrange(n_working_sets)
     return generator
 
 
-def monic(n, time_factor):
+def monic(n, time_factor, rng=None):
     """ Generates (independent) programs with a single key. """
+    programs = ProgramBatch.sample(['M'], n, 0.6, time_factor, rng)
+
+    iteration = 0
+
+    def generator():
+        nonlocal iteration
+        while iteration < n:
+            yield UserTask(programs[iteration], iteration)
+            iteration += 1
+    return generator
+
+
+##### Skewed key popularity #####
+# Keyspaces are range(N_KEYS), so they cost nothing to store however large
+# they get. Programs are as long as working_sets', but each key is drawn
+# independently from the given popularity distribution.
+
+
+def zipf(n, time_factor, n_keys=1 << 20, exponent=1.1, rng=None):
+    """
+    Key k is used with probability proportional to 1 / (k + 1)^EXPONENT, so
+    key 0 is the most popular. Any EXPONENT > 0 works, unlike numpy's zipf.
+    """
+    rng = rng if rng is not None else rand.default_rng()
+    cdf = np.cumsum(np.arange(1, n_keys + 1, dtype=np.float64) ** -exponent)
+    cdf /= cdf[-1]
+
+    def draw(task_of_key):
+        # Inverse CDF; the min() guards against rounding at the top end
+        ids = np.searchsorted(cdf, rng.random(len(task_of_key)), 'right')
+        return np.minimum(ids, n_keys - 1)
+    return _popularityWorkload(n, time_factor, n_keys, draw, rng)
+
+
+def hot_set(n, time_factor, n_keys=1 << 20, hot_keys=64, hot_fraction=0.9,
+            rng=None):
+    """
+    HOT_FRACTION of all key uses go to the HOT_KEYS keys 0 .. HOT_KEYS-1;
+    the rest are spread uniformly over the long tail of other keys.
+    """
+    assert 0 < hot_keys < n_keys, "Need both hot and cold keys"
+    rng = rng if rng is not None else rand.default_rng()
+
+    def draw(task_of_key):
+        hot = rng.random(len(task_of_key)) < hot_fraction
+        return np.where(hot,
+                        rng.integers(0, hot_keys, len(task_of_key)),
+                        rng.integers(hot_keys, n_keys, len(task_of_key)))
+    return _popularityWorkload(n, time_factor, n_keys, draw, rng)
+
+
+def drifting(n, time_factor, n_keys=1 << 20, hot_keys=64, hot_fraction=0.9,
+             n_phases=8, rng=None):
+    """
+    Like hot_set, but the tasks are split into N_PHASES consecutive phases
+    and each phase has its own (disjoint, where possible) hot set: phase p's
+    is keys p*HOT_KEYS onwards. Cold keys are drawn from the whole keyspace.
+    """
+    assert 0 < hot_keys <= n_keys, "Hot set must fit in the keyspace"
+    rng = rng if rng is not None else rand.default_rng()
+
+    def draw(task_of_key):
+        phase = task_of_key * n_phases // n
+        hot = rng.random(len(task_of_key)) < hot_fraction
+        hot_ids = (phase * hot_keys
+                   + rng.integers(0, hot_keys, len(task_of_key))) % n_keys
+        return np.where(hot, hot_ids,
+                        rng.integers(0, n_keys, len(task_of_key)))
+    return _popularityWorkload(n, time_factor, n_keys, draw, rng)
+
+
+def _popularityWorkload(n, time_factor, n_keys, draw, rng):
+    """
+    Generator factory for N tasks over keyspace range(N_KEYS). Key ids come
+    from DRAW(task_of_key), which returns one id per key slot given the index
+    of the task each slot belongs to.
+    """
+    lengths = 1 + rng.geometric(p=0.4, size=n)  # As for length_factor 0.6
+    task_of_key = np.repeat(np.arange(n), lengths)
+    programs = ProgramBatch.fromKeyIds(range(n_keys), time_factor, lengths,
+                                       draw(task_of_key))
 
     iteration = 0
 
     def generator():
         nonlocal iteration
         while iteration < n:
-            yield UserTask(EnclaveProgram(['M'], 0.6, time_factor), iteration)
+            yield UserTask(programs[iteration], iteration)
             iteration += 1
     return generator